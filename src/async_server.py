@@ -0,0 +1,234 @@
+#!usr/bin/env python3
+"""
+`async_server` module. Contains the `AsyncServer` class, which serves
+the same protocol as `Server` from a single asyncio event loop instead
+of one thread per connection.
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+import asyncio
+import signal
+from lobby import PlayerView, SpectatorView
+from server import Server, parse_args
+import protocol
+
+
+class AsyncServer(Server):
+    """
+    `AsyncServer` class. Runs every connection as a coroutine on one
+    event loop. Game logic and messages are shared with `Server`
+    through `add_player` and `handle_message`; pushed updates are sent
+    by a second coroutine per connection.
+    """
+
+    ### Instance variables ###
+    writers: set[asyncio.StreamWriter]
+    """Open client connections, closed on shutdown."""
+    stopping: asyncio.Event
+    """Set to shut the server down."""
+
+    def open_socket(self) -> None:
+        """
+        Set up connection bookkeeping. The listening socket itself is
+        created by `asyncio.start_server` in `serve`.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.socket = None
+        self.writers: set[asyncio.StreamWriter] = set()
+        self.stopping: asyncio.Event = None
+
+    async def handle_client(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+        """
+        Run the connection to one client. It's seated when its first
+        message arrives, and pinged whenever it's been quiet for
+        `protocol.HEARTBEAT_INTERVAL`.
+
+        Parameters
+        ---
+        `reader: asyncio.StreamReader` - incoming side of the connection.
+        `writer: asyncio.StreamWriter` - outgoing side of the connection.
+
+        Returns
+        ---
+        `None`
+        """
+        self.writers.add(writer)
+        address = writer.get_extra_info("peername")
+        loop = asyncio.get_running_loop()
+        decoder = protocol.FrameDecoder()
+        view = None
+        pusher = None
+        heard = loop.time()
+        try:
+            while view is None or not view.detached:
+                # at most one buffer per connection is held in memory,
+                # and `drain` stops us from queueing up replies to a
+                # client that isn't reading them
+                try:
+                    data = await asyncio.wait_for(
+                        reader.read(Server.BUFFER_SIZE),
+                        protocol.HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if loop.time() - heard > protocol.IDLE_TIMEOUT:
+                        print(f"No word from {address[0]} at {address[1]}, "
+                              "giving up on it.")
+                        break
+                    if view is not None:
+                        writer.write(protocol.frame(protocol.encode_message(
+                            protocol.MSG_PING)))
+                    continue
+                if data == b"":
+                    break
+                heard = loop.time()
+                for message in decoder.feed(data):
+                    if view is None:
+                        view = self.add_player(address, message)
+                        writer.write(protocol.frame(view.hello()))
+                        wakeup = asyncio.Event()
+                        pusher = asyncio.create_task(
+                            self.push_updates(writer, view, wakeup))
+                        view.subscribe(
+                            lambda: loop.call_soon_threadsafe(wakeup.set))
+                        # in case the table changed before we subscribed
+                        wakeup.set()
+                    reply = self.handle_message(message, view)
+                    if reply is not None:
+                        writer.write(protocol.frame(reply))
+                await writer.drain()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error reading input from {address[0]} "
+                  f"at {address[1]}:", str(e) + ".")
+
+        if pusher is not None:
+            pusher.cancel()
+        if view is not None:
+            self.remove_player(view)
+        self.writers.discard(writer)
+        writer.close()
+
+    async def push_updates(self, writer: asyncio.StreamWriter,
+                           view: PlayerView | SpectatorView,
+                           wakeup: asyncio.Event) -> None:
+        """
+        Send a client their view every time their table changes.
+        Changes that happen while a send is in progress are sent once.
+
+        Parameters
+        ---
+        `writer: asyncio.StreamWriter` - outgoing side of the connection.
+        `view: PlayerView | SpectatorView` - the client's view.
+        `wakeup: asyncio.Event` - set when the table changes.
+
+        Returns
+        ---
+        `None`
+        """
+        try:
+            while True:
+                await wakeup.wait()
+                wakeup.clear()
+                writer.write(protocol.frame(view.view()))
+                await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+
+    async def serve(self) -> None:
+        """
+        Accept connections until SIGINT/SIGTERM, then shut down cleanly.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # not supported on this platform/thread
+
+        server = await asyncio.start_server(
+            self.handle_client, Server.IP or None, self.port,
+            limit=Server.BUFFER_SIZE, reuse_address=True)
+        async with server:
+            await self.stopping.wait()
+
+            print("Closing socket...")
+            server.close()
+            for writer in list(self.writers):
+                writer.close()
+            await server.wait_closed()
+
+    def stop(self) -> None:
+        """
+        Ask a running server to shut down. Must be called from the
+        event loop's thread.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        if self.stopping is not None:
+            self.stopping.set()
+
+    def mainloop(self) -> None:
+        """
+        Keep the server running.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        try:
+            asyncio.run(self.serve())
+        finally:
+            if self.journal is not None:
+                self.journal.close()
+
+
+def main() -> None:
+    """
+    Run everything.
+
+    Parameters
+    ---
+    (no parameters)
+
+    Returns
+    ---
+    `None`
+    """
+    args = parse_args()
+    server = AsyncServer(args.seats, args.journal, args.port, args.shard,
+                         args.shards, args.first_id, args.bots)
+    server.mainloop()
+
+
+if __name__ == "__main__":
+    main()
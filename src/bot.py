@@ -0,0 +1,124 @@
+#!usr/bin/env python3
+"""
+`bot` module. Provides computer players (`Bot` and subclasses)
+that choose moves for a seat in a refereed headless game.
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+from random import Random
+from referee import Referee, Move
+from tracker import CardTracker
+
+
+class Bot:
+    """
+    `Bot` base class. Subclasses override `choose`.
+    """
+
+    ### Constants ###
+    TRACKS_CARDS: bool = False
+    """Whether the bot wants a `CardTracker` for its seat in `tracker`."""
+
+    ### Instance variables ###
+    rng: Random
+    """Private random number generator, so bots don't share global state."""
+    tracker: CardTracker
+    """Card tracker for the bot's seat, or `None`."""
+
+    def __init__(self, seed: int = None) -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        `seed: int = None` - (optional) seed for the bot's RNG.
+
+        Returns
+        ---
+        `None`
+        """
+        self.rng: Random = Random(seed)
+        self.tracker: CardTracker = None
+
+    def choose(self, referee: Referee, player: int,
+               options: list[Move]) -> Move:
+        """
+        Pick a move.
+
+        Parameters
+        ---
+        `referee: Referee` - the game in progress.
+        `player: int` - index of the seat this bot is playing.
+        `options: list[Move]` - moves available, from `Referee.options`.
+
+        Returns
+        ---
+        `Move` - one of `options`.
+        """
+        raise NotImplementedError
+
+
+class RandomBot(Bot):
+    """
+    `RandomBot` class. Picks uniformly among the legal moves.
+    """
+
+    def choose(self, referee: Referee, player: int,
+               options: list[Move]) -> Move:
+        return self.rng.choice(options)
+
+
+class SimpleBot(Bot):
+    """
+    `SimpleBot` class. Always gets rid of its cheapest card:
+    leads and throws in low non-trumps, covers as cheaply as possible,
+    transfers if it can't cover, and takes as a last resort.
+    """
+
+    def cost(self, referee: Referee, move: Move) -> int:
+        """
+        Rank a move by how valuable the card it gives up is.
+
+        Parameters
+        ---
+        `referee: Referee` - the game in progress.
+        `move: Move` - a move that isn't `Referee.PASS`.
+
+        Returns
+        ---
+        `int` - lower is cheaper.
+        """
+        card = move[0]
+        if card.suit == referee.game.trump_suit:
+            return card.value + 13
+        return card.value
+
+    def choose(self, referee: Referee, player: int,
+               options: list[Move]) -> Move:
+        moves = [move for move in options if move is not Referee.PASS]
+        if len(moves) == 0:
+            return Referee.PASS
+
+        if player == referee.game.defending:
+            covers = [move for move in moves if move[1] is not None]
+            if len(covers) > 0:
+                return min(covers, key=lambda move: self.cost(referee, move))
+            # transfer
+            return min(moves, key=lambda move: self.cost(referee, move))
+
+        cheapest = min(moves, key=lambda move: self.cost(referee, move))
+        # hold on to trumps rather than throwing them in
+        if len(referee.game.pairs) > 0 and\
+                cheapest[0].suit == referee.game.trump_suit:
+            return Referee.PASS
+        return cheapest
+
+
+BOTS: dict[str, type[Bot]] = {
+    "random": RandomBot,
+    "simple": SimpleBot,
+}
+"""Bot classes by name, for command-line tools."""
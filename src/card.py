@@ -1,18 +1,17 @@
 #!usr/bin/env python3
 """
 `card` module. Provides the `Card` class.
+Pure rules data only; images are bound separately by `card_display`.
 """
 
 __author__ = "Chris Bao"
 __version__ = 0.9
 
-import pygame
-
 
 class Card:
     """
-    `Card` class. Holds info on a specific card and defines
-    display behavior.
+    `Card` class. Holds info on a specific card (identity only,
+    no display behavior).
     """
 
     ### Constants ###
@@ -46,36 +45,23 @@ class Card:
         3: 'd',
     }
 
-    IMG_WIDTH: int = 179
-    IMG_HEIGHT: int = 250
-
     # Static variables
-    images: dict[int, pygame.Surface] = {}
-
-    def load_images() -> None:
+    cards: "list[Card]"
+    """The 53 canonical instances, indexed by id. Filled in at import."""
+
+    ### Instance variables ###
+    __slots__ = ("id", "suit", "value")
+    id: int
+    """Card ID number, within the range [0, 52), or 52 for the card back."""
+    suit: int
+    """Suit number, or -1 for the card back."""
+    value: int
+    """Value in the range [0, 13), or -1 for the card back."""
+
+    def __new__(cls, id: int) -> "Card":
         """
-        Load all card images into memory.
-
-        Parameters
-        ---
-        (no parameters)
-
-        Returns
-        ---
-        `None`
-        """
-        # card images
-        for id in range(0, 52):
-            Card.images[id] = pygame.transform.scale_by(pygame.image.load(
-                Card.get_path(id)).convert_alpha(), 0.5)
-        
-        # card back
-        Card.images[52] = pygame.transform.scale_by(pygame.image.load(
-            "../res/card/back.png").convert_alpha(), 0.5)
-
-    def __init__(self, id: int) -> None:
-        """
-        Constructor.
+        Constructor. Cards are immutable flyweights, so this returns the
+        canonical instance for the given id rather than a new object.
 
         Parameters
         ---
@@ -88,68 +74,61 @@ class Card:
 
         Returns
         ---
-        `None`
+        `Card`
         """
         if id not in range(0, 53):
             raise ValueError("id must be in range [0, 52) or be 52")
+        return Card.cards[id]
 
-        self.id: int = id
-        if id < 52:
-            self.suit: int = id // 13
-            self.value: int = id % 13
-        else:
-            self.suit = self.value = -1
-        self.image: pygame.Surface = Card.images[id]
-
-    def get_path(id: int) -> str:
+    def _create(id: int) -> "Card":
         """
-        Get the file path for the given card's image.
+        Build the canonical instance for the given id.
+        Only called while filling in `Card.cards`.
 
         Parameters
         ---
-        `id: int` - id of the card.
+        `id: int` - card ID number.
 
         Returns
         ---
-        `str`
+        `Card`
         """
-        suit = id // 13
-        value = id % 13
-        return "../res/card/" + Card.VALUE_CONVERT[value] +\
-            Card.SUIT_CONVERT[suit] + ".png"
+        card = object.__new__(Card)
+        object.__setattr__(card, "id", id)
+        if id < 52:
+            object.__setattr__(card, "suit", id // 13)
+            object.__setattr__(card, "value", id % 13)
+        else:
+            object.__setattr__(card, "suit", -1)
+            object.__setattr__(card, "value", -1)
+        return card
 
-    def touching(self, top_left: tuple[int, int], point: tuple[int, int]) -> bool:
-        """
-        Determine whether the card is touching the given point when
-        drawn at the given position.
-        
-        Parameters
-        ---
-        `top_left: tuple[int, int]` - coordinates of top left corner.
-        `point: tuple[int, int]` - coordinates to check.
-        
-        Returns
-        ---
-        `bool`
-        """
-        rect = Card.images[self.id].get_rect()
-        rect.x, rect.y = top_left
-        return rect.collidepoint(*point)
+    def __setattr__(self, name: str, value: object) -> None:
+        raise AttributeError("Card is immutable")
 
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("Card is immutable")
 
-    def display(self, surface: pygame.Surface, x: int, y: int, angle: int=0) -> None:
-        """
-        Draw this card to the given surface.
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Card):
+            return NotImplemented
+        return self.id == other.id
 
-        Parameters
-        ---
-        `surface: pygame.Surface` - screen to draw on.
-        `x: int` - x-coordinate of top-left corner.
-        `y: int` - y-coordinate of top-left corner.
-        `angle: int=0` - rotation.
+    def __hash__(self) -> int:
+        return self.id
 
-        Returns
-        ---
-        `None`
-        """
-        surface.blit(pygame.transform.rotate(Card.images[self.id], angle), (x, y))
+    def __reduce__(self) -> tuple:
+        # unpickle to the canonical instance
+        return (Card, (self.id, ))
+
+    def __copy__(self) -> "Card":
+        return self
+
+    def __deepcopy__(self, memo: dict) -> "Card":
+        return self
+
+    def __repr__(self) -> str:
+        return f"Card({self.id})"
+
+
+Card.cards = [Card._create(id) for id in range(0, 53)]
@@ -0,0 +1,105 @@
+#!usr/bin/env python3
+"""
+`card_display` module. Provides the `CardDisplay` class, which binds
+card images to `Card` ids for the client. Only the client needs this;
+the rules core (`card`, `game`) and the server never import pygame.
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+import pygame
+from card import Card
+
+
+class CardDisplay:
+    """
+    `CardDisplay` class. Loads card images and defines
+    display behavior for cards.
+    """
+
+    ### Constants ###
+    IMG_WIDTH: int = 179
+    IMG_HEIGHT: int = 250
+
+    # Static variables
+    images: dict[int, pygame.Surface] = {}
+
+    def load_images() -> None:
+        """
+        Load all card images into memory.
+        Requires a display to have been created already.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        # card images
+        for id in range(0, 52):
+            CardDisplay.images[id] = pygame.transform.scale_by(
+                pygame.image.load(CardDisplay.get_path(id)).convert_alpha(), 0.5)
+
+        # card back
+        CardDisplay.images[Card.BACK] = pygame.transform.scale_by(
+            pygame.image.load("../res/card/back.png").convert_alpha(), 0.5)
+
+    def get_path(id: int) -> str:
+        """
+        Get the file path for the given card's image.
+
+        Parameters
+        ---
+        `id: int` - id of the card.
+
+        Returns
+        ---
+        `str`
+        """
+        suit = id // 13
+        value = id % 13
+        return "../res/card/" + Card.VALUE_CONVERT[value] +\
+            Card.SUIT_CONVERT[suit] + ".png"
+
+    def touching(card: Card, top_left: tuple[int, int],
+                 point: tuple[int, int]) -> bool:
+        """
+        Determine whether the card is touching the given point when
+        drawn at the given position.
+
+        Parameters
+        ---
+        `card: Card` - card to check.
+        `top_left: tuple[int, int]` - coordinates of top left corner.
+        `point: tuple[int, int]` - coordinates to check.
+
+        Returns
+        ---
+        `bool`
+        """
+        rect = CardDisplay.images[card.id].get_rect()
+        rect.x, rect.y = top_left
+        return rect.collidepoint(*point)
+
+    def display(card: Card, surface: pygame.Surface, x: int, y: int,
+                angle: int = 0) -> None:
+        """
+        Draw the given card to the given surface.
+
+        Parameters
+        ---
+        `card: Card` - card to draw.
+        `surface: pygame.Surface` - screen to draw on.
+        `x: int` - x-coordinate of top-left corner.
+        `y: int` - y-coordinate of top-left corner.
+        `angle: int=0` - rotation.
+
+        Returns
+        ---
+        `None`
+        """
+        surface.blit(pygame.transform.rotate(
+            CardDisplay.images[card.id], angle), (x, y))
@@ -0,0 +1,268 @@
+#!usr/bin/env python3
+"""
+`cardset` module. Provides the `CardSet` class, a 52-bit bitmask
+representation of a set of cards.
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+from typing import Iterable, Iterator
+from card import Card
+
+
+class CardSet:
+    """
+    `CardSet` class. Holds a set of cards as a single integer where
+    bit `i` is set if and only if the card with id `i` is in the set.
+    Membership, adding, removing and rank/suit queries are all
+    constant-time bit operations.
+    """
+
+    ### Constants ###
+    FULL: int = (1 << 52) - 1
+    """Mask containing every card."""
+    SUIT_MASKS: list[int] = [0x1FFF << (13 * suit) for suit in range(4)]
+    """`SUIT_MASKS[s]` contains every card of suit `s`."""
+    RANK_MASKS: list[int] = [sum(1 << (13 * suit + value) for suit in range(4))
+                             for value in range(13)]
+    """`RANK_MASKS[v]` contains every card of value `v`."""
+
+    # Static variables
+    COVER_MASKS: list[list[int]]
+    """`COVER_MASKS[t][i]` contains every card that can cover the card
+    with id `i` when `t` is the trump suit. Filled in at import."""
+
+    ### Instance variables ###
+    mask: int
+    """The bitmask itself."""
+
+    def __init__(self, cards: Iterable[Card] = (), mask: int = 0) -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        `cards: Iterable[Card] = ()` - (optional) cards to start with.
+        `mask: int = 0` - (optional) bitmask to start with.
+
+        Returns
+        ---
+        `None`
+        """
+        for card in cards:
+            mask |= 1 << card.id
+        self.mask: int = mask
+
+    def cover_mask(target: Card, trump_suit: int) -> int:
+        """
+        Get the mask of every card that can cover the given card.
+
+        Parameters
+        ---
+        `target: Card` - card to be covered.
+        `trump_suit: int` - the trump suit; uses the suit numbers in `Card`.
+
+        Returns
+        ---
+        `int` - mask of higher cards of the same suit, plus every
+        trump if `target` is not a trump.
+        """
+        return CardSet.COVER_MASKS[trump_suit][target.id]
+
+    def add(self, card: Card) -> None:
+        """
+        Add a card to the set.
+
+        Parameters
+        ---
+        `card: Card` - card to add.
+
+        Returns
+        ---
+        `None`
+        """
+        self.mask |= 1 << card.id
+
+    def remove(self, card: Card) -> None:
+        """
+        Remove a card from the set.
+
+        Parameters
+        ---
+        `card: Card` - card to remove.
+
+        Raises
+        ---
+        `KeyError` - card not in the set.
+
+        Returns
+        ---
+        `None`
+        """
+        bit = 1 << card.id
+        if not self.mask & bit:
+            raise KeyError(card.id)
+        self.mask ^= bit
+
+    def clear(self) -> None:
+        """
+        Remove every card from the set.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.mask = 0
+
+    def copy(self) -> "CardSet":
+        """
+        Return a copy of this set.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `CardSet`
+        """
+        return CardSet(mask=self.mask)
+
+    def has_rank(self, value: int) -> bool:
+        """
+        Test if the set contains any card of the given value.
+
+        Parameters
+        ---
+        `value: int` - card value, in the range [0, 13).
+
+        Returns
+        ---
+        `bool`
+        """
+        return self.mask & CardSet.RANK_MASKS[value] != 0
+
+    def of_rank(self, value: int) -> int:
+        """
+        Get the cards in this set of the given value.
+
+        Parameters
+        ---
+        `value: int` - card value, in the range [0, 13).
+
+        Returns
+        ---
+        `int` - mask of matching cards.
+        """
+        return self.mask & CardSet.RANK_MASKS[value]
+
+    def of_suit(self, suit: int) -> int:
+        """
+        Get the cards in this set of the given suit.
+
+        Parameters
+        ---
+        `suit: int` - suit number, see `Card`.
+
+        Returns
+        ---
+        `int` - mask of matching cards.
+        """
+        return self.mask & CardSet.SUIT_MASKS[suit]
+
+    def covering(self, target: Card, trump_suit: int) -> int:
+        """
+        Get the cards in this set that can cover the given card.
+
+        Parameters
+        ---
+        `target: Card` - card to be covered.
+        `trump_suit: int` - the trump suit.
+
+        Returns
+        ---
+        `int` - mask of matching cards.
+        """
+        return self.mask & CardSet.cover_mask(target, trump_suit)
+
+    def same_rank(mask: int) -> int:
+        """
+        Get the mask of every card that shares a value with
+        some card in the given mask.
+
+        Parameters
+        ---
+        `mask: int` - cards to match.
+
+        Returns
+        ---
+        `int`
+        """
+        # fold the four suits onto the lowest 13 bits...
+        ranks = (mask | mask >> 13 | mask >> 26 | mask >> 39) & 0x1FFF
+        # ...then copy them back out to all four suits
+        return ranks | ranks << 13 | ranks << 26 | ranks << 39
+
+    def ids(mask: int) -> Iterator[int]:
+        """
+        Iterate over the card ids in a mask, lowest first.
+
+        Parameters
+        ---
+        `mask: int` - mask to iterate over.
+
+        Returns
+        ---
+        `Iterator[int]`
+        """
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def __contains__(self, card: Card) -> bool:
+        return self.mask >> card.id & 1 == 1
+
+    def __len__(self) -> int:
+        return self.mask.bit_count()
+
+    def __bool__(self) -> bool:
+        return self.mask != 0
+
+    def __iter__(self) -> Iterator[Card]:
+        for id in CardSet.ids(self.mask):
+            yield Card(id)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CardSet):
+            return NotImplemented
+        return self.mask == other.mask
+
+    def __str__(self) -> str:
+        """
+        Return a string representation of this `CardSet`.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `str` - space-separated list of card IDs.
+        """
+        return " ".join(str(id) for id in CardSet.ids(self.mask))
+
+
+# same suit and strictly higher id (ids within a suit are ordered by value),
+# or any trump on a non-trump
+CardSet.COVER_MASKS = [
+    [CardSet.SUIT_MASKS[card.suit] & ~((2 << card.id) - 1) |
+     (0 if card.suit == trump_suit else CardSet.SUIT_MASKS[trump_suit])
+     for card in Card.cards[:52]]
+    for trump_suit in range(4)]
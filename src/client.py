@@ -8,6 +8,9 @@ for providing a lot of the code for the `server` and `client` modules.
 ### Imports ###
 # External imports
 import socket as s
+import threading
+import time
+from queue import Empty, SimpleQueue
 import pygame
 import pygame.freetype
 import pygame.mixer
@@ -18,7 +21,10 @@ import easygui
 # Internal imports
 from game import Player
 from card import Card
+from cardset import CardSet
+from card_display import CardDisplay
 from server import Server
+import protocol
 
 pygame.freetype.init()
 
@@ -36,6 +42,8 @@ class Client:
     """Connection port number. Pretty much arbitrary."""
     BUFFER_SIZE: int = 8192
     """Size of buffer for receiving messages."""
+    RECONNECT_DELAY: float = 1.0
+    """Seconds between attempts to get back to the server."""
 
     # For UI
     WINDOW_WIDTH: int = 1440
@@ -62,6 +70,11 @@ class Client:
     DECK_XPOS: int = 75
     DECK_YPOS: int = 600
 
+    PAIRS_XPOS: int = 350
+    PAIRS_YPOS: int = 300
+    PAIR_SPACING: int = 200  # distance between pairs on the table
+    COVER_OFFSET: int = 40  # offset of a covering card from the attack
+
     # State constants
     STATE_START: int = 0
     STATE_WAIT: int = 1
@@ -73,6 +86,17 @@ class Client:
     """Player name."""
     socket: s.socket
     """Socket that handles the connection to the server."""
+    token: bytes
+    """Session token from the server, for getting our seat back
+    after losing the connection; empty until we have one."""
+    heard: float
+    """When we last heard from the server (`time.monotonic`)."""
+    decoder: protocol.FrameDecoder
+    """Splits what the server sends into messages."""
+    pending: list[bytes]
+    """Messages received but not yet read."""
+    inbox: SimpleQueue
+    """Messages from the server, filled by the listener thread."""
     player: Player
     """Represents the player's hand."""
     clock: pygame.time.Clock
@@ -107,6 +131,13 @@ class Client:
     """Number of cards left in the deck."""
     bottom_card: Card
     """Card visible on the bottom."""
+    pairs: list[list[Card]]
+    """Cards on the table, as [attack] or [attack, cover]."""
+    trump_suit: int
+    """Trump suit, remembered from the bottom card, or -1 if not seen yet."""
+    states: dict[int, dict]
+    """Gamestate fields received from the server by version, kept for
+    as long as the server may send deltas against them."""
 
     flip_sound: pygame.mixer.Sound
     tap_sound: pygame.mixer.Sound
@@ -125,8 +156,11 @@ class Client:
         """
         self.name: str = name
 
-        self.socket: s.socket = s.socket(s.AF_INET, s.SOCK_STREAM)
-        self.player: Player = Player(self.connect())
+        self.token: bytes = b""
+        self.inbox: SimpleQueue = SimpleQueue()
+        self.connect()
+        self.player: Player = Player()
+        threading.Thread(target=self.listen, daemon=True).start()
 
         pygame.init()
         pygame.display.set_caption("Durak!")
@@ -141,7 +175,7 @@ class Client:
         self.tap_sound = pygame.mixer.Sound("../res/sound/tap.wav")
         self.tap_sound.set_volume(0.5)
 
-        Card.load_images()
+        CardDisplay.load_images()
 
         self.state: int = Client.STATE_START
         self.button: Client.Button = self.Button(self.window,
@@ -162,13 +196,17 @@ class Client:
         self.defending_index: int = 0
         self.deck_size: int = 0
         self.bottom_card: Card = None
+        self.pairs: list[list[Card]] = []
+        self.trump_suit: int = -1
+        self.states: dict[int, dict] = {}
 
         self.announcement: str = ""
         self.announcement_sticky = False
 
-    def connect(self) -> str:
+    def connect(self) -> bytes | None:
         """
-        Connect to the server.
+        Connect to the server: back to our seat if we have a session,
+        otherwise as a new player.
 
         Parameters
         ---
@@ -176,36 +214,137 @@ class Client:
 
         Returns
         ---
-        `str` - message from the server.
+        `bytes | None` - greeting from the server,
+        or `None` if we couldn't connect.
         """
+        self.socket: s.socket = s.socket(s.AF_INET, s.SOCK_STREAM)
+        self.socket.settimeout(protocol.HEARTBEAT_INTERVAL)
+        self.decoder: protocol.FrameDecoder = protocol.FrameDecoder()
+        self.pending: list[bytes] = []
+        self.heard: float = time.monotonic()
         try:
             self.socket.connect((Client.IP, Client.PORT))
-            return self.socket.recv(Client.BUFFER_SIZE).decode()
+            if self.token:
+                self.send_message(protocol.encode_message(
+                    protocol.MSG_RESUME, tail=self.token))
+            else:
+                self.send_message(protocol.encode_message(
+                    protocol.MSG_START, tail=self.name.encode()))
+            greeting = self.read_message()
+            _, _, token = protocol.decode_message(greeting)
+            if token != self.token:
+                if self.token:
+                    # our game is gone, so we're somebody new
+                    self.send_message(protocol.encode_message(
+                        protocol.MSG_START, tail=self.name.encode()))
+                self.token = token
+            return greeting
         except Exception as e:
             print(e)
 
+    def reconnect(self) -> None:
+        """
+        Keep trying to get back to the server until we do. If we couldn't
+        have our seat back, the greeting for the new one goes to `inbox`.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.socket.close()
+        token = self.token
+        greeting = self.connect()
+        while greeting is None:
+            time.sleep(Client.RECONNECT_DELAY)
+            greeting = self.connect()
+        if self.token != token:
+            self.inbox.put(greeting)
+
     # TODO get names to appear and change color for attack/defend
     # modify and use the display announcement function to display
     # arbitrary text boxes
 
-    def send_request(self, message: str) -> str:
+    def send_message(self, message: bytes) -> None:
         """
-        Send data to and request data from the server.
+        Send a message to the server. Anything it has to say back
+        arrives through `inbox`.
 
         Parameters
         ---
-        `message: str` - message to send to the server.
+        `message: bytes` - message payload, see `protocol`.
 
         Returns
         ---
-        `str` - data received.
+        `None`
         """
         try:
-            self.socket.send(str.encode(message))
-            return self.socket.recv(Client.BUFFER_SIZE).decode()
+            self.socket.sendall(protocol.frame(message))
         except s.error as e:
             print(e)
 
+    def read_message(self) -> bytes:
+        """
+        Block until a whole message has arrived from the server.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Raises
+        ---
+        `ConnectionError` - the server closed the connection.
+
+        Returns
+        ---
+        `bytes` - the message payload.
+        """
+        while len(self.pending) == 0:
+            data = self.socket.recv(Client.BUFFER_SIZE)
+            if data == b"":
+                raise ConnectionError("server closed the connection")
+            self.heard = time.monotonic()
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.pop(0)
+
+    def listen(self) -> None:
+        """
+        Pass messages from the server to `inbox`, answer its pings, and
+        reconnect whenever the connection is lost or goes quiet. Runs on
+        its own thread so the UI never waits on the network.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        while True:
+            try:
+                message = self.read_message()
+            except s.timeout:
+                if time.monotonic() - self.heard > protocol.IDLE_TIMEOUT:
+                    print("No word from the server, reconnecting...")
+                    self.reconnect()
+                else:
+                    self.send_message(
+                        protocol.encode_message(protocol.MSG_PING))
+                continue
+            except (ConnectionError, s.error) as e:
+                print(e)
+                self.reconnect()
+                continue
+
+            if message[:1] == bytes((protocol.MSG_PING, )):
+                self.send_message(protocol.encode_message(protocol.MSG_PONG))
+            else:
+                self.inbox.put(message)
+
     def draw_announcement(self) -> None:
         """
         Draw announcement box.
@@ -256,11 +395,11 @@ class Client:
                 opponent_hand_size = self.players_hand_sizes[opponent_index]
                 left_edge = int(self.WINDOW_WIDTH/2
                         - opponent_hand_size/2 * Client.CARD_OFFSET
-                        - Card.IMG_WIDTH/5)
+                        - CardDisplay.IMG_WIDTH/5)
                 
                 back = Card(52)
                 for i in range(opponent_hand_size):
-                    back.display(self.window, left_edge + i * Client.CARD_OFFSET,
+                    CardDisplay.display(back, self.window, left_edge + i * Client.CARD_OFFSET,
                                  Client.ACROSS_YPOS, angle=180)
             case 3:
                 # TODO: implement
@@ -284,12 +423,12 @@ class Client:
         # TODO figure out what happens if too many cards
         left_edge = int(self.WINDOW_WIDTH/2
                         - len(self.player.hand)/2 * Client.CARD_OFFSET
-                        - Card.IMG_WIDTH/5)
+                        - CardDisplay.IMG_WIDTH/5)
 
         prev = self.hovered_card
         selected = -1
         for (index, card) in enumerate(self.player.hand):
-            if card.touching((left_edge + index * Client.CARD_OFFSET,
+            if CardDisplay.touching(card, (left_edge + index * Client.CARD_OFFSET,
                              Client.CARD_YPOS),
                              pygame.mouse.get_pos()):
                 selected = index
@@ -304,11 +443,11 @@ class Client:
                                  Client.SELECTED_COLOR,
                                  pygame.Rect(left_edge + index * Client.CARD_OFFSET-5,
                                              Client.CARD_YPOS - Client.CARD_YLIFT-5,
-                                             Card.IMG_WIDTH+10,
-                                             Card.IMG_HEIGHT+10),
+                                             CardDisplay.IMG_WIDTH+10,
+                                             CardDisplay.IMG_HEIGHT+10),
                                  width=6,
                                  border_radius=15)
-                card.display(self.window, left_edge + index * Client.CARD_OFFSET,
+                CardDisplay.display(card, self.window, left_edge + index * Client.CARD_OFFSET,
                              Client.CARD_YPOS - Client.CARD_YLIFT)
             elif index == self.hovered_card:
                 # draw highlight
@@ -316,11 +455,11 @@ class Client:
                                  Client.HIGHLIGHT_COLOR,
                                  pygame.Rect(left_edge + index * Client.CARD_OFFSET-5,
                                              Client.CARD_YPOS - Client.CARD_YLIFT-5,
-                                             Card.IMG_WIDTH+10,
-                                             Card.IMG_HEIGHT+10),
+                                             CardDisplay.IMG_WIDTH+10,
+                                             CardDisplay.IMG_HEIGHT+10),
                                  width=6,
                                  border_radius=15)
-                card.display(self.window, left_edge + index * Client.CARD_OFFSET,
+                CardDisplay.display(card, self.window, left_edge + index * Client.CARD_OFFSET,
                              Client.CARD_YPOS - Client.CARD_YLIFT)
             else:
                 # draw a slight edge
@@ -328,11 +467,11 @@ class Client:
                                  Client.CARD_EDGE_COLOR,
                                  pygame.Rect(left_edge + index * Client.CARD_OFFSET-1,
                                              Client.CARD_YPOS-1,
-                                             Card.IMG_WIDTH+2,
-                                             Card.IMG_HEIGHT+2),
+                                             CardDisplay.IMG_WIDTH+2,
+                                             CardDisplay.IMG_HEIGHT+2),
                                  width=2,
                                  border_radius=10)
-                card.display(self.window, left_edge + index *
+                CardDisplay.display(card, self.window, left_edge + index *
                          Client.CARD_OFFSET, Client.CARD_YPOS)
 
     def draw_deck(self) -> None:
@@ -348,15 +487,34 @@ class Client:
         `None`
         """
         if self.bottom_card is not None:
-            self.bottom_card.display(self.window,
-                                     Client.DECK_XPOS,
-                                     Client.DECK_YPOS + int(Card.IMG_WIDTH/4),
-                                     angle=270)
+            CardDisplay.display(self.bottom_card, self.window,
+                                Client.DECK_XPOS,
+                                Client.DECK_YPOS + int(CardDisplay.IMG_WIDTH/4),
+                                angle=270)
         for i in range(self.deck_size-1):
             c = Card(52)
-            c.display(self.window, Client.DECK_XPOS, Client.DECK_YPOS-int(i/2))
+            CardDisplay.display(c, self.window, Client.DECK_XPOS, Client.DECK_YPOS-int(i/2))
         
 
+    def draw_pairs(self) -> None:
+        """
+        Draw the cards on the table.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        for (index, pair) in enumerate(self.pairs):
+            for (depth, card) in enumerate(pair):
+                CardDisplay.display(card, self.window,
+                                    Client.PAIRS_XPOS + index * Client.PAIR_SPACING
+                                    + depth * Client.COVER_OFFSET,
+                                    Client.PAIRS_YPOS + depth * Client.COVER_OFFSET)
+
     def draw(self) -> None:
         """
         Draw everything to the window.
@@ -399,45 +557,174 @@ class Client:
                 self.draw_player_cards()
                 self.draw_opponent_cards()
                 self.draw_deck()
+                self.draw_pairs()
 
                 # default arrow
                 pygame.mouse.set_cursor(
                     pygame.cursors.Cursor(pygame.SYSTEM_CURSOR_ARROW))
 
-    def handle_server_reply(self, reply: str) -> None:
+    def handle_server_reply(self, kind: int, numbers: tuple[int, ...],
+                            data: bytes) -> None:
         """
-        Update the player given the server's info.
-        
+        Update the player given the server's info: a full snapshot,
+        or a delta against an earlier version.
+        Every version applied is acknowledged.
+
         Parameters
         ---
-        `reply: str` - server message.
-        
+        `kind: int` - `protocol.MSG_STATE` or `protocol.MSG_DELTA`.
+        `numbers: tuple[int, ...]` - the message's version numbers.
+        `data: bytes` - the message's gamestate fields.
+
+        Returns
+        ---
+        `None`
+        """
+        if kind == protocol.MSG_STATE:
+            base = None
+            (version, ) = numbers
+            fields = {}
+        else:
+            base, version = numbers
+            if base not in self.states:
+                # lost track, ask for a full snapshot
+                self.states.clear()
+                self.send_message(protocol.encode_message(protocol.MSG_SYNC))
+                return
+            fields = self.states[base].copy()
+
+        for (name, value) in protocol.decode_fields(data).items():
+            match name:
+                case "add":
+                    fields["hand"] |= value
+                case "remove":
+                    fields["hand"] &= ~value
+                case _:
+                    fields[name] = value
+
+        self.states[version] = fields
+        if base is not None:
+            # the server has seen our acknowledgement of `base`,
+            # and never diffs against anything older
+            for old in [old for old in self.states if old < base]:
+                del self.states[old]
+        self.send_message(protocol.encode_message(protocol.MSG_ACK, version))
+        self.apply_state(fields)
+
+    def apply_state(self, fields: dict) -> None:
+        """
+        Update the player and the game state from a complete set of fields.
+
+        Parameters
+        ---
+        `fields: dict` - field values by name, see `protocol.FIELDS`.
+
         Returns
         ---
         `None`
         """
-        lines = reply.split("\n")[1:]
         # update player
-        self.player = Player(lines[0])
-        self.player.sort_cards()
+        self.player = Player()
+        for card in CardSet(mask=fields["hand"]):
+            self.player.deal_card(card)
         # update game state
-        self.player_index = int(lines[1])
-        self.players_hand_sizes = [int(i) for i in lines[2].split(" ")]
-        self.attacking_index = int(lines[3][0])
-        self.defending_index = int(lines[3][2])
-        
-        deck_info = lines[4].split(" ")
-        self.deck_size = int(deck_info[0])
+        self.player_index = fields["seat"]
+        self.players_hand_sizes = list(fields["sizes"])
+        self.attacking_index, self.defending_index = fields["turn"]
+
+        self.deck_size, bottom = fields["deck"]
         if self.deck_size > 0:
-            self.bottom_card = Card(int(deck_info[1]))
+            self.bottom_card = Card(bottom)
+            self.trump_suit = self.bottom_card.suit
         else:
             self.bottom_card = None
+        self.pairs = [[Card(id) for id in pair] for pair in fields["pairs"]]
         # player names
-        self.players_names = lines[5].split("`")
+        self.players_names = list(fields["names"])
+
+    def send_move(self, card: Card | None, covering: int | None) -> None:
+        """
+        Ask the server to make a move. If it isn't legal by the time the
+        server gets to it, nothing happens.
+
+        Parameters
+        ---
+        `card: Card | None` - card to play, or `None` to pass
+        (attacker) or take everything (defender).
+        `covering: int | None` - index of the pair to cover, or `None`.
+
+        Returns
+        ---
+        `None`
+        """
+        self.send_message(protocol.encode_message(
+            protocol.MSG_MOVE,
+            protocol.NO_CARD if card is None else card.id,
+            protocol.NO_CARD if covering is None else covering))
+
+    def play_selected_card(self) -> None:
+        """
+        Play the selected card. When defending, it covers the first
+        uncovered card it can beat; otherwise it attacks or transfers.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        card = self.player.hand[self.selected_card]
+        covering = None
+        if self.player_index == self.defending_index and self.trump_suit >= 0:
+            for (index, pair) in enumerate(self.pairs):
+                if len(pair) == 1 and\
+                        CardSet.COVER_MASKS[self.trump_suit][pair[0].id] >> card.id & 1:
+                    covering = index
+                    break
+        self.send_move(card, covering)
+
+    def handle_server_message(self, message: bytes) -> None:
+        """
+        Act on one message pushed by the server.
+
+        Parameters
+        ---
+        `message: bytes` - server message payload.
+
+        Returns
+        ---
+        `None`
+        """
+        if not self.announcement_sticky:
+            self.announcement = ""
+
+        kind, numbers, tail = protocol.decode_message(message)
+        match kind:
+            case protocol.MSG_HELLO:
+                # we couldn't get our seat back and have a new one
+                self.state = Client.STATE_START
+                self.button.visible = True
+                self.states.clear()
+                self.announcement = "Lost your seat, joined a new table."
+            case protocol.MSG_START:
+                pass
+            case protocol.MSG_WAIT:
+                ready, seats = numbers
+                if ready == seats:
+                    self.state = Client.STATE_PLAY
+                else:
+                    self.announcement = f"Waiting for players to ready..." +\
+                        f"{ready}/{seats} ready."
+            case protocol.MSG_STATE | protocol.MSG_DELTA:
+                self.state = Client.STATE_PLAY
+                self.handle_server_reply(kind, numbers, tail)
 
     def mainloop(self) -> None:
         """
         Mainloop. Handle all events while the app is running.
+        Messages are only sent when the player does something.
 
         Parameters
         ---
@@ -449,19 +736,6 @@ class Client:
         """
         while True:
             self.clock.tick(60)
-            # self.clock.tick(30)  # temporary, to reduce the number of messages
-
-            match self.state:
-                case Client.STATE_START:
-                    message = "start " + self.name
-                case Client.STATE_WAIT:
-                    message = "wait"
-                case Client.STATE_PLAY:
-                    message = "play"
-                case Client.STATE_END:
-                    message = "end"
-            if not self.announcement_sticky:
-                self.announcement = ""
 
             # handle events
             for event in pygame.event.get():
@@ -474,31 +748,34 @@ class Client:
                     if self.button.check_hover():
                         self.tap_sound.play()
                         self.button.visible = False
-                        message = "ready"
+                        self.send_message(
+                            protocol.encode_message(protocol.MSG_READY))
                         self.state = Client.STATE_WAIT
 
-                    # playing cards
-                    if self.hovered_card != -1:
+                    # playing cards: select, then click again to play
+                    if self.hovered_card != -1 and\
+                            self.hovered_card == self.selected_card:
+                        self.play_selected_card()
+                        self.tap_sound.play()
+                        self.selected_card = -1
+                    elif self.hovered_card != -1:
                         self.selected_card = self.hovered_card
                         self.tap_sound.play()
                     else:
                         self.selected_card = -1
 
-            # handle updates from server
-            reply = self.send_request(message)
-            match reply.split()[0]:
-                case "start":
-                    pass
-                case "wait":
-                    wait_counter = reply.split()[1:]
-                    if wait_counter[0] == wait_counter[1]:
-                        self.state = Client.STATE_PLAY
-                    else:
-                        self.announcement = f"Waiting for players to ready..." +\
-                            f"{wait_counter[0]}/{wait_counter[1]} ready."
-                case "play":
-                    self.handle_server_reply(reply)
-                    
+                # space to pass, or to take everything when defending
+                if event.type == pygame.KEYUP and event.key == K_SPACE and\
+                        self.state == Client.STATE_PLAY:
+                    self.send_move(None, None)
+
+            # handle updates pushed by the server, without waiting
+            while True:
+                try:
+                    self.handle_server_message(self.inbox.get_nowait())
+                except Empty:
+                    break
+
             # draw things
             self.draw()
             pygame.display.update()
@@ -8,8 +8,12 @@ __version__ = 0.9
 
 ### Imports ###
 from card import Card
-from random import shuffle
+from cardset import CardSet
+from random import Random
 from collections import deque
+import struct
+from copy import copy
+from typing import Callable
 
 
 class Player:
@@ -18,6 +22,12 @@ class Player:
     and defines behavior for playing and receiving cards.
     """
 
+    ### Instance variables ###
+    hand: list[Card]
+    """Cards in hand, in display order."""
+    hand_set: CardSet
+    """The same cards as a bitmask, for constant-time membership tests."""
+
     ### Constructors ###
     def __init__(self, hand_string: str = None) -> None:
         """
@@ -32,10 +42,11 @@ class Player:
         `None`
         """
         self.hand: list[Card] = []
+        self.hand_set: CardSet = CardSet()
         if hand_string is not None:
             for card_string in hand_string.split(" "):
                 if card_string != "" and card_string != "Player:":
-                    self.hand.append(Card(int(card_string)))
+                    self.deal_card(Card(int(card_string)))
 
     def sort_cards(self) -> None:
         """
@@ -63,6 +74,7 @@ class Player:
         `None`
         """
         self.hand.append(card)
+        self.hand_set.add(card)
 
     def play_card(self, card: Card) -> None:
         """
@@ -76,8 +88,27 @@ class Player:
         ---
         `None`
         """
+        self.hand_set.remove(card)
         self.hand.remove(card)
 
+    def copy(self) -> "Player":
+        """
+        Return an independent copy of this player.
+        Cards are immutable, so only the containers are copied.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `Player`
+        """
+        player = Player()
+        player.hand = self.hand.copy()
+        player.hand_set = self.hand_set.copy()
+        return player
+
     def __str__(self) -> str:
         """
         Return a string representation of this `Player`.
@@ -109,6 +140,34 @@ class Game:
     CONDITION_ONGOING: int = -1
     CONDITION_DRAW: int = -2
 
+    RESET: tuple[int, int, int] = (-1, -1, -1)
+    """Entry in `history` for a call to `reset_round`."""
+    NO_COVER: int = -1
+    """`covering` value in `history` for a card that isn't covering anything."""
+    SNAPSHOT: struct.Struct = struct.Struct("!BBBBbBBI")
+    """Header of `to_bytes`: players, attacking, defending, phase, condition,
+    bitmask of `player_active`, cards left in the deck and `version`."""
+    MASK_BYTES: int = 7
+    """Bytes per `CardSet` mask in `to_bytes`."""
+
+    # Event constants; see `listeners`
+    EVENT_DEAL: int = 0
+    """Card dealt to `player` at the start of the game."""
+    EVENT_BOTTOM: int = 1
+    """Bottom card of the deck turned face up (`player` is -1)."""
+    EVENT_DRAW: int = 2
+    """Card drawn from the deck by `player` in `refill_hands`."""
+    EVENT_ATTACK: int = 3
+    """Card led or thrown in by `player`."""
+    EVENT_COVER: int = 4
+    """Card played by `player` (the defender) to cover an attack."""
+    EVENT_TRANSFER: int = 5
+    """Card played by `player` (the defender) to turn the attack."""
+    EVENT_PICKUP: int = 6
+    """Cards on the board taken into hand by `player`."""
+    EVENT_DISCARD: int = 7
+    """Cards on the board moved to the discard pile (`player` is -1)."""
+
     ### Instance variables ###
     # Game-long variables
     players: list[Player]
@@ -120,12 +179,31 @@ class Game:
     i.e., has not finished their entire hand."""
     num_active: int
     """Number of active players."""
+    condition: int
+    """Result of the last `check_finished` made by `reset_round`;
+    `Game.CONDITION_ONGOING` until the game is over."""
     deck: deque[Card]
     """A deque of all the cards left to draw."""
-    discard: list[Card]
-    """A list of all cards that have been discarded."""
+    discard: CardSet
+    """All cards that have been discarded."""
+    revealed: list[CardSet]
+    """Cards each player is publicly known to hold: cards they picked up
+    from the board, and the bottom card of the deck if they drew it."""
     trump_suit: int
     """Tracks the trump suit; uses the suit numbers in `Card`."""
+    deal: bytes
+    """Card ids of the shuffled deck, top first (52 bytes).
+    Together with `history`, enough to replay the game exactly."""
+    history: list[tuple[int, int, int]]
+    """Every move made so far, in order: (player, card id, covering) for
+    `play_card`, with `Game.NO_COVER` for `None`, or `Game.RESET`."""
+    version: int
+    """Bumped by every change to the game (`play_card`, `reset_round`,
+    `refill_hands`), so that views of it can be cached."""
+    listeners: list[Callable[[int, int, int], None]]
+    """Called as `listener(event, player, mask)` after every change in where
+    cards are, where `event` is one of the event constants and `mask` is a
+    `CardSet` mask of the cards involved. Not copied or pickled."""
 
     # Turn-dependent variables
     attacking: int
@@ -137,18 +215,35 @@ class Game:
     (`PHASE_DEFEND`) or not (`PHASE_ATTACK`)."""
     pairs: list[list[Card]] = []
     """Tracks pairs of cards that are attacking/defending"""
-
-    def __init__(self, players: list[Player]) -> None:
+    table: CardSet
+    """All cards currently in `pairs`."""
+    table_ranks: int
+    """Bitmask of values on the board: bit `v` is set if a card of value `v`
+    is in `pairs`. Kept up to date by `play_card` and `reset_round`."""
+    uncovered: list[int]
+    """Indices in `pairs` of attacking cards that have not been covered yet.
+    Kept up to date by `play_card` and `reset_round`."""
+
+    def __init__(self, players: list[Player], rng: int | Random = None,
+                 deal: bytes = None,
+                 listeners: list[Callable[[int, int, int], None]] = None) -> None:
         """
         Constructor.
 
         Parameters
         ---
         `players: list[Player]` - players joining the game
+        `rng: int | Random = None` - (optional) seed or random number
+        generator used to shuffle the deck. Never touches the global RNG.
+        `deal: bytes = None` - (optional) deck order to use instead of
+        shuffling, e.g. the `deal` of an earlier game.
+        `listeners: list[Callable[[int, int, int], None]] = None` - (optional)
+        event listeners, given here so that they also see the deal.
 
         Raises
         ---
-        `ValueError` - too many players.
+        `ValueError` - too many players, or `deal` isn't an ordering
+        of the 52 card ids.
 
         Returns
         ---
@@ -163,21 +258,37 @@ class Game:
         self.num_players: int = len(players)
         self.player_active: list[bool] = [True, ] * len(self.players)
         self.num_active: int = len(players)
+        self.condition: int = Game.CONDITION_ONGOING
 
         # initialize deck
         # the "top" of the deck is the left, the "bottom" is the right
         # dealing the cards will use `popleft()` while displaying
         # the bottom card will involve subscripting - `self.deck[-1]`
-        self.deck = [Card(i) for i in range(52)]
-        shuffle(self.deck)
-        self.deck: deque[Card] = deque(self.deck)
-        self.discard: list[Card] = []
+        if deal is None:
+            if not isinstance(rng, Random):
+                rng = Random(rng)
+            order = list(range(52))
+            rng.shuffle(order)
+            deal = bytes(order)
+        elif sorted(deal) != list(range(52)):
+            raise ValueError("deal must be an ordering of the 52 card ids")
+        self.deal: bytes = bytes(deal)
+        self.history: list[tuple[int, int, int]] = []
+        self.version: int = 0
+        self.listeners: list[Callable[[int, int, int], None]] =\
+            [] if listeners is None else list(listeners)
+        self.deck: deque[Card] = deque(Card(id) for id in self.deal)
+        self.discard: CardSet = CardSet()
+        self.revealed: list[CardSet] = [CardSet() for _ in self.players]
 
         # deal initial hands
-        for player in self.players:
+        for (index, player) in enumerate(self.players):
             for _ in range(6):
-                player.deal_card(self.deck.popleft())
+                card = self.deck.popleft()
+                player.deal_card(card)
+                self.notify(Game.EVENT_DEAL, index, 1 << card.id)
         self.trump_suit: int = self.deck[-1].suit
+        self.notify(Game.EVENT_BOTTOM, -1, 1 << self.deck[-1].id)
 
         # determine who goes first
         self.attacking: int = 0
@@ -193,6 +304,202 @@ class Game:
         self.phase: int = Game.PHASE_ATTACK
         # contains the pairs of cards that are being played/covered
         self.pairs: list[list[Card]] = []
+        self.table: CardSet = CardSet()
+        self.table_ranks: int = 0
+        self.uncovered: list[int] = []
+
+    def __getstate__(self) -> dict:
+        # listeners belong to the original game only
+        state = self.__dict__.copy()
+        state["listeners"] = []
+        return state
+
+    def notify(self, event: int, player: int, mask: int) -> None:
+        """
+        Call every listener with an event.
+
+        Parameters
+        ---
+        `event: int` - one of the event constants.
+        `player: int` - index of the player involved, or -1.
+        `mask: int` - `CardSet` mask of the cards involved.
+
+        Returns
+        ---
+        `None`
+        """
+        for listener in self.listeners:
+            listener(event, player, mask)
+
+    def copy(self) -> "Game":
+        """
+        Return an independent copy of this game, e.g. for branching in a
+        tree search. Much cheaper than `copy.deepcopy`: cards are shared
+        flyweights, so only the containers holding them are copied.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `Game`
+        """
+        # shallow copy shares the plain int fields; rebuild the containers
+        game = copy(self)
+        game.players = [player.copy() for player in self.players]
+        game.player_active = self.player_active.copy()
+        game.deck = self.deck.copy()
+        game.discard = self.discard.copy()
+        game.revealed = [known.copy() for known in self.revealed]
+        game.pairs = [pair.copy() for pair in self.pairs]
+        game.table = self.table.copy()
+        game.uncovered = self.uncovered.copy()
+        game.history = self.history.copy()
+        return game
+
+    def replay(players: list[Player], history: list[tuple[int, int, int]],
+               rng: int | Random = None, deal: bytes = None) -> "Game":
+        """
+        Rebuild a game from its deal (or the seed that produced it)
+        and the moves made. Stop `history` early to get an earlier position.
+
+        Parameters
+        ---
+        `players: list[Player]` - fresh players, one per seat.
+        `history: list[tuple[int, int, int]]` - moves, as in `Game.history`.
+        `rng: int | Random = None` - seed or RNG given to the original game.
+        `deal: bytes = None` - or the original game's `deal`.
+
+        Raises
+        ---
+        `AssertionError` - a move in `history` isn't legal.
+
+        Returns
+        ---
+        `Game`
+        """
+        game = Game(players, rng, deal)
+        for (player, card, covering) in history:
+            if player == Game.RESET[0]:
+                game.reset_round()
+            elif covering == Game.NO_COVER:
+                game.play_card(player, Card(card))
+            else:
+                game.play_card(player, Card(card), covering)
+        return game
+
+    def to_bytes(self) -> bytes:
+        """
+        Pack the current position into a compact snapshot, e.g. to survive
+        a crash without replaying the game from its deal. `SNAPSHOT`, then
+        the deal (the deck is always its last cards), the discard pile, each
+        player's hand and revealed cards as `CardSet` masks, and the pairs
+        on the board. `history` and `listeners` aren't included.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `bytes` - about 100 bytes; see `from_bytes`.
+        """
+        active = 0
+        for (index, is_active) in enumerate(self.player_active):
+            active |= is_active << index
+        data = bytearray(Game.SNAPSHOT.pack(
+            self.num_players, self.attacking, self.defending, self.phase,
+            self.condition, active, len(self.deck), self.version))
+        data += self.deal
+        data += self.discard.mask.to_bytes(Game.MASK_BYTES, "big")
+        for (player, known) in zip(self.players, self.revealed):
+            data += player.hand_set.mask.to_bytes(Game.MASK_BYTES, "big")
+            data += known.mask.to_bytes(Game.MASK_BYTES, "big")
+        data.append(len(self.pairs))
+        for pair in self.pairs:
+            data.append(pair[0].id)
+            data.append(pair[1].id if len(pair) > 1 else 0xFF)
+        return bytes(data)
+
+    def from_bytes(data: bytes) -> "Game":
+        """
+        Rebuild a game from a snapshot made by `to_bytes`. Its `history`
+        starts empty and hands are in card id order.
+
+        Parameters
+        ---
+        `data: bytes` - the snapshot.
+
+        Raises
+        ---
+        `ValueError` - `data` is cut short or its deal isn't valid.
+
+        Returns
+        ---
+        `Game`
+        """
+        if len(data) < Game.SNAPSHOT.size + 52:
+            raise ValueError("snapshot cut short")
+        (num_players, attacking, defending, phase, condition, active,
+         deck_size, version) = Game.SNAPSHOT.unpack_from(data)
+        offset = Game.SNAPSHOT.size
+        deal = data[offset:offset + 52]
+        if sorted(deal) != list(range(52)):
+            raise ValueError("snapshot deal must be an ordering of the 52 card ids")
+        offset += 52
+
+        def read_mask() -> CardSet:
+            nonlocal offset
+            mask = int.from_bytes(data[offset:offset + Game.MASK_BYTES], "big")
+            offset += Game.MASK_BYTES
+            return CardSet(mask=mask)
+
+        # skip the constructor, which would shuffle and deal
+        game = Game.__new__(Game)
+        game.players = []
+        game.revealed = []
+        game.discard = read_mask()
+        for _ in range(num_players):
+            player = Player()
+            player.hand_set = read_mask()
+            player.hand = [Card.cards[id]
+                           for id in CardSet.ids(player.hand_set.mask)]
+            game.players.append(player)
+            game.revealed.append(read_mask())
+        game.num_players = num_players
+        game.player_active = [bool(active >> index & 1)
+                              for index in range(num_players)]
+        game.num_active = sum(game.player_active)
+        game.condition = condition
+        game.deal = bytes(deal)
+        game.history = []
+        game.version = version
+        game.listeners = []
+        game.deck = deque([Card.cards[id] for id in deal[52 - deck_size:]])
+        game.trump_suit = Card(deal[-1]).suit
+        game.attacking = attacking
+        game.defending = defending
+        game.phase = phase
+
+        game.pairs = []
+        game.table = CardSet()
+        game.table_ranks = 0
+        game.uncovered = []
+        if offset >= len(data):
+            raise ValueError("snapshot cut short")
+        for index in range(data[offset]):
+            attack, cover = data[offset + 1 + 2 * index:offset + 3 + 2 * index]
+            pair = [Card(attack), ]
+            if cover == 0xFF:
+                game.uncovered.append(index)
+            else:
+                pair.append(Card(cover))
+            for card in pair:
+                game.table.add(card)
+                game.table_ranks |= 1 << card.value
+            game.pairs.append(pair)
+        return game
 
     def get_next_available(self, player: int) -> int | None:
         """
@@ -232,11 +539,27 @@ class Game:
         ---
         `bool` - `True` if covers, `False` if not.
         """
-        # trump suit beats any other suit
-        if card.suit == self.trump_suit and target.suit != self.trump_suit:
-            return True
-        # else has to be higher and same suit
-        return card.suit == target.suit and card.value > target.value
+        # one lookup in the table of covers; see `CardSet.COVER_MASKS`
+        return CardSet.COVER_MASKS[self.trump_suit][target.id] >> card.id & 1 == 1
+
+    def can_cover(self, card: Card, covering: int) -> bool:
+        """
+        Test if a card can cover the given pair on the board.
+
+        Parameters
+        ---
+        `card: Card` - card to be played.
+        `covering: int` - index of the pair in `self.pairs`.
+
+        Returns
+        ---
+        `bool` - `True` if the pair exists, is uncovered and
+        `card` covers it, `False` if not.
+        """
+        if covering not in range(len(self.pairs)) or\
+                len(self.pairs[covering]) > 1:
+            return False
+        return self.check_covers(card, self.pairs[covering][0])
 
     def can_add_to_attack(self, card: Card) -> bool:
         """
@@ -252,20 +575,12 @@ class Game:
         `bool` - `True` if can be added, `False` otherwise
         """
         # first check that defender has enough cards to defend everything
-        to_be_covered = 0
-        for pair in self.pairs:
-            if len(pair) < 2:
-                to_be_covered += 1
         # defender's hand size must be >= [attacking cards remaining] + 1
         # (since we're adding one)
-        if len(self.players[self.defending].hand) <= to_be_covered:
+        if len(self.players[self.defending].hand) <= len(self.uncovered):
             return False
 
-        for pair in self.pairs:
-            for played_card in pair:
-                if card.value == played_card.value:
-                    return True
-        return False
+        return self.table_ranks >> card.value & 1 == 1
 
     def can_play_card(self, player: int, card: Card,
                       covering: int = None) -> bool:
@@ -283,7 +598,7 @@ class Game:
         `bool` - `True` if playable, `False` if not
         """
         # doesn't own the card
-        if card not in self.players[player].hand:
+        if card not in self.players[player].hand_set:
             return False
 
         if self.phase == Game.PHASE_ATTACK:
@@ -295,7 +610,7 @@ class Game:
 
                 # committing to defense
                 if covering is not None:
-                    return self.check_covers(card, self.pairs[covering][0])
+                    return self.can_cover(card, covering)
                 # turning the attack
                 else:
                     # first check that defender has enough cards to defend everything
@@ -325,12 +640,70 @@ class Game:
                 if covering is None:
                     return False
                 # must cover something
-                return self.check_covers(card, self.pairs[covering][0])
+                return self.can_cover(card, covering)
 
             # player is not the target, adding to the attack
             else:
                 return self.can_add_to_attack(card)
 
+    def legal_moves(self, player: int) -> list[tuple[Card, int | None]]:
+        """
+        Generate every move the given player can currently make, in one pass.
+        Gives the same results as calling `can_play_card` on every
+        (card, covering) combination, but works on the hand and table
+        bitmasks instead of rescanning them for each card.
+
+        Parameters
+        ---
+        `player: int` - index of the player.
+
+        Returns
+        ---
+        `list[tuple[Card, int | None]]` - (card, covering) pairs that can be
+        passed straight to `play_card`. `covering` is `None` for attacks,
+        throw-ins and transfers.
+        """
+        moves: list[tuple[Card, int | None]] = []
+        hand = self.players[player].hand_set.mask
+        if hand == 0:
+            return moves
+
+        # player is the target of the attack
+        if player == self.defending:
+            # must wait for attack to play anything
+            if len(self.pairs) == 0:
+                return moves
+
+            # covering each uncovered pair
+            covers = CardSet.COVER_MASKS[self.trump_suit]
+            for index in self.uncovered:
+                for id in CardSet.ids(hand & covers[self.pairs[index][0].id]):
+                    moves.append((Card(id), index))
+
+            # turning the attack
+            if self.phase == Game.PHASE_ATTACK:
+                next_available = self.get_next_available(player)
+                if next_available is not None and\
+                        len(self.players[next_available].hand) > len(self.pairs):
+                    for id in CardSet.ids(
+                            hand & CardSet.RANK_MASKS[self.pairs[0][0].value]):
+                        moves.append((Card(id), None))
+            return moves
+
+        # player is not the target
+        # first attack, anything is possible
+        if len(self.pairs) == 0:
+            return [(Card(id), None) for id in CardSet.ids(hand)]
+
+        # adding to the attack
+        if len(self.players[self.defending].hand) <= len(self.uncovered):
+            return moves
+        ranks = self.table_ranks
+        ranks |= ranks << 13 | ranks << 26 | ranks << 39
+        for id in CardSet.ids(hand & ranks):
+            moves.append((Card(id), None))
+        return moves
+
     def play_card(self, player: int, card: Card, covering: int = None):
         """
         Has the given player play the given card.
@@ -352,6 +725,13 @@ class Game:
         assert self.can_play_card(player, card, covering),\
             "card not playable by this player"
 
+        covers = player == self.defending and covering is not None
+        if covers:
+            event = Game.EVENT_COVER
+        elif player == self.defending:
+            event = Game.EVENT_TRANSFER
+        else:
+            event = Game.EVENT_ATTACK
         if self.phase == Game.PHASE_ATTACK:
             # player is the target of the attack
             if player == self.defending:
@@ -374,7 +754,20 @@ class Game:
             else:
                 self.pairs.append([card, ])
 
+        # update board index
+        if covers:
+            self.uncovered.remove(covering)
+        else:
+            self.uncovered.append(len(self.pairs) - 1)
+        self.table_ranks |= 1 << card.value
+        self.table.add(card)
         self.players[player].play_card(card)
+        self.revealed[player].mask &= ~(1 << card.id)
+        self.history.append((player, card.id,
+                             covering if covers else Game.NO_COVER))
+        self.version += 1
+        if self.listeners:
+            self.notify(event, player, 1 << card.id)
 
     def check_finished(self) -> int:
         """
@@ -403,6 +796,27 @@ class Game:
                 return index
         return self.num_players-1
 
+    def draw_card(self, player: int) -> None:
+        """
+        Deal the top card of the deck to the given player.
+        The last card is the face-up bottom card, so whoever draws it
+        is known to hold it.
+
+        Parameters
+        ---
+        `player: int` - index of the player drawing.
+
+        Returns
+        ---
+        `None`
+        """
+        card = self.deck.popleft()
+        self.players[player].deal_card(card)
+        if len(self.deck) == 0:
+            self.revealed[player].add(card)
+        if self.listeners:
+            self.notify(Game.EVENT_DRAW, player, 1 << card.id)
+
     def refill_hands(self) -> None:
         """
         Refill each player's hands to 6 cards while there are still cards
@@ -416,6 +830,7 @@ class Game:
         ---
         `None`
         """
+        self.version += 1
         for i in range(self.num_players):
             deal_target = (self.attacking + i) % self.num_players
             # skip the defender for last
@@ -425,14 +840,14 @@ class Game:
             if not self.player_active[deal_target]:
                 continue
             while len(self.deck) > 0 and len(self.players[deal_target].hand) < 6:
-                self.players[deal_target].deal_card(self.deck.popleft())
+                self.draw_card(deal_target)
             if len(self.deck) == 0:
                 return
 
         if not self.player_active[self.defending]:
             return
         while len(self.deck) > 0 and len(self.players[self.defending].hand) < 6:
-            self.players[self.defending].deal_card(self.deck.popleft())
+            self.draw_card(self.defending)
 
     def reset_round(self) -> None:
         """
@@ -447,37 +862,46 @@ class Game:
         ---
         `None`
         """
-        defense_successful = True
-        for pair in self.pairs:
-            if len(pair) < 2:
-                defense_successful = False
-                break
+        self.history.append(Game.RESET)
+        self.version += 1
+        defense_successful = len(self.uncovered) == 0
 
         # clear everything; defender becomes attacker
         if defense_successful:
-            for pair in self.pairs:
-                for card in pair:
-                    self.discard.append(card)
+            self.discard.mask |= self.table.mask
+            if self.listeners:
+                self.notify(Game.EVENT_DISCARD, -1, self.table.mask)
             self.pairs.clear()
-            condition = self.check_finished()
-            if condition != Game.CONDITION_ONGOING:
+            self.table.clear()
+            self.table_ranks = 0
+            self.uncovered.clear()
+            self.condition = self.check_finished()
+            if self.condition != Game.CONDITION_ONGOING:
                 return
 
             self.refill_hands()
 
             self.attacking = self.defending
             self.defending = self.get_next_available(self.attacking)
+            self.phase = Game.PHASE_ATTACK
         # defender takes all cards; next person is attacker
         else:
             for pair in self.pairs:
                 for card in pair:
                     self.players[self.defending].deal_card(card)
+            self.revealed[self.defending].mask |= self.table.mask
+            if self.listeners:
+                self.notify(Game.EVENT_PICKUP, self.defending, self.table.mask)
             self.pairs.clear()
-            condition = self.check_finished()
-            if condition != Game.CONDITION_ONGOING:
+            self.table.clear()
+            self.table_ranks = 0
+            self.uncovered.clear()
+            self.condition = self.check_finished()
+            if self.condition != Game.CONDITION_ONGOING:
                 return
 
             self.refill_hands()
 
             self.attacking = self.get_next_available(self.defending)
             self.defending = self.get_next_available(self.attacking)
+            self.phase = Game.PHASE_ATTACK
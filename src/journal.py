@@ -0,0 +1,639 @@
+#!usr/bin/env python3
+"""
+`journal` module. An append-only on-disk log of games, and the functions
+to read it back.
+
+A journal starts with `MAGIC` and is followed by records, each with an
+8-byte header (see `RECORD`): kind, game id and three small numbers.
+A `KIND_DEAL` record starts a game and is followed by the 52 card ids of
+its `Game.deal`; every other record is the header alone, one per entry
+of `Game.history`. That is everything `Game.replay` needs, since
+`refill_hands` is only ever called by `reset_round` and draws from a
+deck whose order is already known.
+
+Records from many games are interleaved in one file. Readers work on any
+buffer, e.g. an `mmap` from `map_file`, and walk the headers without
+building a `Game` for every record, so large archives can be scanned
+cheaply.
+
+Next to the journal, `Journal` keeps a checkpoint file: a snapshot of
+every live game (see `Table.save`) as of some offset in the journal,
+replaced atomically about every `CHECKPOINT_INTERVAL`. After a crash,
+live games are rebuilt from their snapshots and the few records after
+that offset, rather than from their deals.
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+import mmap
+import os
+import struct
+import time
+from threading import Condition, Lock, Thread
+from typing import BinaryIO, Iterator
+from game import Game, Player
+
+### Constants ###
+MAGIC: bytes = b"DURAKJ1\n"
+"""First bytes of every journal."""
+RECORD: struct.Struct = struct.Struct("!BIBBB")
+"""Record header: kind, game id, then three numbers depending on the kind."""
+DEAL_SIZE: int = 52
+"""Bytes following a `KIND_DEAL` header."""
+NONE: int = 0xFF
+"""Stands in for a missing number, e.g. `Game.NO_COVER`."""
+
+# Record kinds
+KIND_DEAL: int = 1
+"""A game has started. Numbers: number of players. Followed by the deal."""
+KIND_PLAY: int = 2
+"""`Game.play_card`. Numbers: player, card id, pair covered or `NONE`."""
+KIND_RESET: int = 3
+"""`Game.reset_round`, including the `refill_hands` it makes."""
+KIND_END: int = 4
+"""The game's table has closed; it won't be recovered."""
+
+SIZES: dict[int, int] = {
+    KIND_DEAL: RECORD.size + DEAL_SIZE,
+    KIND_PLAY: RECORD.size,
+    KIND_RESET: RECORD.size,
+    KIND_END: RECORD.size,
+}
+"""Total size of each kind of record."""
+
+CHECKPOINT_MAGIC: bytes = b"DURAKC1\n"
+"""First bytes of every checkpoint file."""
+CHECKPOINT_HEADER: struct.Struct = struct.Struct("!QII")
+"""Checkpoint header: journal offset it was taken at, `next_game_id`
+and number of games."""
+CHECKPOINT_ENTRY: struct.Struct = struct.Struct("!IH")
+"""Header of each game in a checkpoint: game id and snapshot size."""
+
+
+class Journal:
+    """
+    `Journal` class. Appends games to a journal file. Appending only
+    copies a few bytes into a buffer; a background thread writes the
+    buffer out and fsyncs it every `sync_interval`, so many moves from
+    many tables share each fsync. At most that much is lost in a crash.
+    Safe from any thread.
+
+    Live games hand over a fresh snapshot with their records, which the
+    same thread checkpoints every `CHECKPOINT_INTERVAL`, and right away
+    once a game starts so that it can always be recovered.
+    """
+
+    ### Constants ###
+    SYNC_INTERVAL: float = 0.05
+    """Default seconds between fsyncs."""
+    CHECKPOINT_INTERVAL: float = 1.0
+    """Seconds between checkpoints."""
+
+    ### Instance variables ###
+    path: str
+    """Path of the journal file."""
+    checkpoint_path: str
+    """Path of the checkpoint file."""
+    file: BinaryIO
+    """The journal file, opened for appending."""
+    sync_interval: float
+    """Seconds between fsyncs."""
+    buffer: bytearray
+    """Records appended but not yet written."""
+    size: int
+    """Bytes of records written to the file."""
+    next_game_id: int
+    """One more than the largest game id in the journal."""
+    snapshots: dict[int, bytes]
+    """Latest snapshot of every live game, by game id."""
+    recovered: dict[int, tuple[bytes, list[tuple[int, int, int]]]]
+    """Games that were live when the journal was last closed or crashed,
+    by game id: the snapshot in the checkpoint and the `Game.history`
+    entries recorded after it. No checkpoints are taken until they're
+    taken over with `resume`."""
+    checkpoint_due: bool
+    """Whether to checkpoint on the next flush."""
+    last_checkpoint: float
+    """When the last checkpoint was taken (`time.monotonic`)."""
+    open: bool
+    """Whether the journal still accepts records."""
+    wakeup: Condition
+    """Lock on `buffer`, `snapshots`, `checkpoint_due` and `open`;
+    wakes the flusher when closing."""
+    write_lock: Lock
+    """Held while writing to the file."""
+    flusher: Thread
+    """Writes and fsyncs the buffer."""
+
+    def __init__(self, path: str, sync_interval: float = SYNC_INTERVAL) -> None:
+        """
+        Constructor. Opens the journal, creating it if needed. If the last
+        record was cut short, e.g. by a crash, it's cut off. Only the records
+        after the last checkpoint are read, to fill in `recovered`.
+
+        Parameters
+        ---
+        `path: str` - path of the journal file.
+        `sync_interval: float = SYNC_INTERVAL` - (optional) seconds
+        between fsyncs.
+
+        Raises
+        ---
+        `ValueError` - the file isn't a journal.
+
+        Returns
+        ---
+        `None`
+        """
+        self.path: str = path
+        self.checkpoint_path: str = path + ".checkpoint"
+        self.sync_interval: float = sync_interval
+        self.buffer: bytearray = bytearray()
+        self.next_game_id: int = 0
+        self.snapshots: dict[int, bytes] = {}
+        self.recovered: dict[int, tuple[bytes,
+                                        list[tuple[int, int, int]]]] = {}
+        self.checkpoint_due: bool = True
+        self.last_checkpoint: float = time.monotonic()
+        self.open: bool = True
+
+        self.file: BinaryIO = open(path, "a+b")
+        size = self.file.seek(0, os.SEEK_END)
+        if size == 0:
+            self.file.write(MAGIC)
+            size = len(MAGIC)
+        else:
+            size = self.recover(size)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size: int = size
+
+        self.wakeup: Condition = Condition()
+        self.write_lock: Lock = Lock()
+        self.flusher: Thread = Thread(target=self.run, daemon=True,
+                                      name="journal")
+        self.flusher.start()
+
+    def recover(self, size: int) -> int:
+        """
+        Load the checkpoint, then read the records after it into `recovered`
+        and cut off an incomplete last record. Without a checkpoint, the
+        whole journal is read but nothing is recovered. Constructor only.
+
+        Parameters
+        ---
+        `size: int` - size of the file.
+
+        Raises
+        ---
+        `ValueError` - the file isn't a journal.
+
+        Returns
+        ---
+        `int` - size of the file once cut.
+        """
+        start = len(MAGIC)
+        snapshots = {}
+        checkpoint = read_checkpoint(self.checkpoint_path)
+        if checkpoint is not None:
+            if checkpoint[0] <= size:
+                (start, self.next_game_id, snapshots) = checkpoint
+            else:
+                print(f"Journal {self.path}: checkpoint is past the end "
+                      "of the journal, ignoring it.")
+        self.recovered = {game_id: (snapshot, [])
+                          for (game_id, snapshot) in snapshots.items()}
+
+        buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            end = start
+            for (offset, kind, game_id, a, b, c) in records(buffer, start):
+                end = offset + SIZES[kind]
+                self.next_game_id = max(self.next_game_id, game_id + 1)
+                game = self.recovered.get(game_id)
+                if kind == KIND_END:
+                    self.recovered.pop(game_id, None)
+                elif game is None:
+                    continue  # closed, or started after the checkpoint
+                elif kind == KIND_PLAY:
+                    game[1].append((a, b, Game.NO_COVER if c == NONE else c))
+                elif kind == KIND_RESET:
+                    game[1].append(Game.RESET)
+        finally:
+            buffer.close()
+        if end < size:
+            print(f"Journal {self.path}: dropping {size - end} bytes "
+                  "of incomplete records.")
+            self.file.truncate(end)
+        return end
+
+    def resume(self, snapshots: dict[int, bytes]) -> None:
+        """
+        Take over the games in `recovered`, once they're rebuilt, and let
+        checkpoints go on.
+
+        Parameters
+        ---
+        `snapshots: dict[int, bytes]` - snapshot of every recovered game
+        still live, by game id.
+
+        Returns
+        ---
+        `None`
+        """
+        with self.wakeup:
+            self.snapshots.update(snapshots)
+            self.recovered = {}
+            self.checkpoint_due = True
+
+    def begin(self, game_id: int, game: Game, snapshot: bytes,
+              history: list[tuple[int, int, int]] = ()) -> None:
+        """
+        Record the start of a game. It's checkpointed on the next flush.
+
+        Parameters
+        ---
+        `game_id: int` - the game's id, unique within the journal.
+        `game: Game` - the game, as dealt.
+        `snapshot: bytes` - everything needed to recover it,
+        see `Table.save`.
+        `history: list[tuple[int, int, int]] = ()` - (optional) moves
+        already made, e.g. in a game moved over from another journal;
+        `snapshot` must be as of after them. Recorded together with the
+        deal, so that no checkpoint can come in between.
+
+        Returns
+        ---
+        `None`
+        """
+        data = pack_history(game_id, history)
+        with self.wakeup:
+            self.buffer += RECORD.pack(KIND_DEAL, game_id, game.num_players,
+                                       0, 0)
+            self.buffer += game.deal
+            self.buffer += data
+            self.next_game_id = max(self.next_game_id, game_id + 1)
+            self.snapshots[game_id] = snapshot
+            self.checkpoint_due = True
+
+    def record(self, game_id: int, history: list[tuple[int, int, int]],
+               snapshot: bytes = None) -> None:
+        """
+        Record moves made in a game.
+
+        Parameters
+        ---
+        `game_id: int` - the game's id.
+        `history: list[tuple[int, int, int]]` - the new entries of
+        `Game.history`, in order.
+        `snapshot: bytes = None` - (optional) the game's snapshot after
+        them, replacing the last one.
+
+        Returns
+        ---
+        `None`
+        """
+        data = pack_history(game_id, history)
+        with self.wakeup:
+            self.buffer += data
+            if snapshot is not None:
+                self.snapshots[game_id] = snapshot
+
+    def finish(self, game_id: int) -> None:
+        """
+        Record that a game's table has closed, so it won't be recovered.
+
+        Parameters
+        ---
+        `game_id: int` - the game's id.
+
+        Returns
+        ---
+        `None`
+        """
+        with self.wakeup:
+            self.buffer += RECORD.pack(KIND_END, game_id, 0, 0, 0)
+            self.snapshots.pop(game_id, None)
+
+    def flush(self) -> None:
+        """
+        Write out and fsync everything appended so far, then checkpoint
+        if it's time to. The snapshots are taken together with the records,
+        so the checkpoint matches the journal up to its offset.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        with self.write_lock:
+            now = time.monotonic()
+            snapshots = None
+            with self.wakeup:
+                data = self.buffer
+                self.buffer = bytearray()
+                if len(self.recovered) == 0 and (
+                        self.checkpoint_due or now - self.last_checkpoint
+                        >= Journal.CHECKPOINT_INTERVAL):
+                    snapshots = self.snapshots.copy()
+                    next_game_id = self.next_game_id
+                    self.checkpoint_due = False
+            if len(data) > 0:
+                self.file.write(data)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.size += len(data)
+            if snapshots is not None:
+                write_checkpoint(self.checkpoint_path, self.size,
+                                 next_game_id, snapshots)
+                self.last_checkpoint = now
+
+    def close(self) -> None:
+        """
+        Write out everything appended so far and close the file.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        with self.wakeup:
+            self.open = False
+            self.wakeup.notify()
+        self.flusher.join()
+        self.flush()
+        self.file.close()
+
+    def run(self) -> None:
+        """
+        The flusher: write and fsync the buffer every `sync_interval`
+        until closed.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        while True:
+            with self.wakeup:
+                self.wakeup.wait(self.sync_interval)
+                if not self.open:
+                    return
+            self.flush()
+
+
+def pack_history(game_id: int,
+                 history: list[tuple[int, int, int]]) -> bytearray:
+    """
+    Turn moves made in a game into journal records.
+
+    Parameters
+    ---
+    `game_id: int` - the game's id.
+    `history: list[tuple[int, int, int]]` - entries of `Game.history`.
+
+    Returns
+    ---
+    `bytearray` - one record per entry.
+    """
+    data = bytearray()
+    for (player, card, covering) in history:
+        if player == Game.RESET[0]:
+            data += RECORD.pack(KIND_RESET, game_id, 0, 0, 0)
+        else:
+            data += RECORD.pack(KIND_PLAY, game_id, player, card,
+                                NONE if covering == Game.NO_COVER
+                                else covering)
+    return data
+
+
+def write_checkpoint(path: str, offset: int, next_game_id: int,
+                     snapshots: dict[int, bytes]) -> None:
+    """
+    Replace a checkpoint file. The new one is written and fsynced beside it,
+    then renamed over it, so a crash leaves either the old or the new one.
+
+    Parameters
+    ---
+    `path: str` - path of the checkpoint file.
+    `offset: int` - size of the journal the snapshots match.
+    `next_game_id: int` - `Journal.next_game_id` at that point.
+    `snapshots: dict[int, bytes]` - snapshot of every live game, by id.
+
+    Returns
+    ---
+    `None`
+    """
+    data = bytearray(CHECKPOINT_MAGIC)
+    data += CHECKPOINT_HEADER.pack(offset, next_game_id, len(snapshots))
+    for (game_id, snapshot) in snapshots.items():
+        data += CHECKPOINT_ENTRY.pack(game_id, len(snapshot))
+        data += snapshot
+    with open(path + ".tmp", "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def read_checkpoint(path: str) -> tuple[int, int, dict[int, bytes]] | None:
+    """
+    Read a checkpoint file.
+
+    Parameters
+    ---
+    `path: str` - path of the checkpoint file.
+
+    Returns
+    ---
+    `tuple[int, int, dict[int, bytes]] | None` - journal offset, next game
+    id and snapshots by game id, as given to `write_checkpoint`; or `None`
+    if there's no checkpoint or it isn't valid.
+    """
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return None
+    start = len(CHECKPOINT_MAGIC)
+    if data[:start] != CHECKPOINT_MAGIC or\
+            len(data) < start + CHECKPOINT_HEADER.size:
+        return None
+    (offset, next_game_id, count) = CHECKPOINT_HEADER.unpack_from(data, start)
+    position = start + CHECKPOINT_HEADER.size
+    snapshots = {}
+    for _ in range(count):
+        if position + CHECKPOINT_ENTRY.size > len(data):
+            return None
+        (game_id, size) = CHECKPOINT_ENTRY.unpack_from(data, position)
+        position += CHECKPOINT_ENTRY.size
+        snapshots[game_id] = data[position:position + size]
+        position += size
+    if position != len(data):
+        return None
+    return offset, next_game_id, snapshots
+
+
+def map_file(path: str) -> mmap.mmap:
+    """
+    Map a journal file into memory, read-only.
+
+    Parameters
+    ---
+    `path: str` - path of the journal file.
+
+    Raises
+    ---
+    `ValueError` - the file isn't a journal.
+
+    Returns
+    ---
+    `mmap.mmap`
+    """
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        buffer.close()
+        raise ValueError(f"{path} isn't a journal")
+    return buffer
+
+
+def records(buffer, start: int = len(MAGIC)) -> Iterator[tuple[int, ...]]:
+    """
+    Walk the records of a journal, stopping at the first one that's
+    incomplete or unknown (e.g. cut short by a crash).
+
+    Parameters
+    ---
+    `buffer` - the journal's contents: `bytes`, `mmap.mmap`, etc.
+    `start: int = len(MAGIC)` - (optional) offset of the first record.
+
+    Raises
+    ---
+    `ValueError` - `buffer` isn't a journal.
+
+    Returns
+    ---
+    `Iterator[tuple[int, ...]]` - (offset, kind, game id, and the three
+    numbers) for each record. The deal following a `KIND_DEAL` record
+    is at `offset + RECORD.size`.
+    """
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a journal")
+    offset = start
+    while offset + RECORD.size <= len(buffer):
+        header = RECORD.unpack_from(buffer, offset)
+        size = SIZES.get(header[0])
+        if size is None or offset + size > len(buffer):
+            return
+        yield (offset, ) + header
+        offset += size
+
+
+def find_games(buffer) -> dict[int, int]:
+    """
+    Find every game in a journal.
+
+    Parameters
+    ---
+    `buffer` - the journal's contents.
+
+    Raises
+    ---
+    `ValueError` - `buffer` isn't a journal.
+
+    Returns
+    ---
+    `dict[int, int]` - offset of each game's `KIND_DEAL` record, by game id.
+    If an id was used twice, the later game wins.
+    """
+    return {game_id: offset for (offset, kind, game_id, *_) in records(buffer)
+            if kind == KIND_DEAL}
+
+
+def load_game(buffer, game_id: int, start: int = None
+              ) -> tuple[int, bytes, list[tuple[int, int, int]]]:
+    """
+    Read one game back out of a journal.
+
+    Parameters
+    ---
+    `buffer` - the journal's contents.
+    `game_id: int` - the game's id.
+    `start: int = None` - (optional) offset of its `KIND_DEAL` record,
+    e.g. from `find_games`; found by scanning if not given.
+
+    Raises
+    ---
+    `ValueError` - `buffer` isn't a journal, or the game isn't in it.
+
+    Returns
+    ---
+    `tuple[int, bytes, list[tuple[int, int, int]]]` - number of players,
+    `Game.deal` and `Game.history`.
+    """
+    if start is None:
+        start = find_games(buffer).get(game_id)
+        if start is None:
+            raise ValueError(f"no game {game_id} in journal")
+
+    players = 0
+    deal = b""
+    history = []
+    for (offset, kind, id, a, b, c) in records(buffer, start):
+        if id != game_id:
+            continue
+        if kind == KIND_DEAL:
+            if offset != start:
+                break  # the id was reused by a later game
+            players = a
+            deal = bytes(buffer[offset + RECORD.size:
+                                offset + RECORD.size + DEAL_SIZE])
+        elif kind == KIND_PLAY:
+            history.append((a, b, Game.NO_COVER if c == NONE else c))
+        elif kind == KIND_RESET:
+            history.append(Game.RESET)
+    return players, deal, history
+
+
+def replay(buffer, game_id: int, moves: int = None) -> Game:
+    """
+    Rebuild a game from a journal, as it is now or as it was
+    after some number of moves.
+
+    Parameters
+    ---
+    `buffer` - the journal's contents.
+    `game_id: int` - the game's id.
+    `moves: int = None` - (optional) number of `Game.history` entries to
+    replay; all of them if not given.
+
+    Raises
+    ---
+    `ValueError` - `buffer` isn't a journal, or the game isn't in it.
+
+    Returns
+    ---
+    `Game`
+    """
+    players, deal, history = load_game(buffer, game_id)
+    if moves is not None:
+        history = history[:moves]
+    return Game.replay([Player() for _ in range(players)], history,
+                       deal=deal)
@@ -0,0 +1,479 @@
+#!usr/bin/env python3
+"""
+`loadtest` module. Opens many headless clients against a running server,
+plays random legal moves at every table, and reports move latency,
+message throughput and the server's CPU and memory use.
+
+Usage: `python loadtest.py -c 300 --seats 2 --server async`
+(or `--pid PID` to measure a server started separately).
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from random import Random
+from card import Card
+from cardset import CardSet
+from server import Server, SERVERS
+from simulate import percentile
+import protocol
+
+RETRY_AFTER: float = 0.5
+"""Seconds without an update before a client acts again on the same state,
+e.g. because its move lost a race and was dropped."""
+MOVE_TIMEOUT: float = 5.0
+"""Seconds before a move that never showed up is counted as rejected."""
+
+
+class LoadStats:
+    """
+    `LoadStats` class. Counters shared by every client.
+    Only counted while `recording` is set.
+    """
+
+    ### Instance variables ###
+    recording: bool
+    """Whether the measurement window is open."""
+    latencies: list[float]
+    """Seconds from sending a card to seeing it leave the hand."""
+    sent: int
+    """Messages sent."""
+    received: int
+    """Messages received."""
+    moves: int
+    """Moves sent."""
+    rejected: int
+    """Cards sent that never left the hand."""
+    games: int
+    """Games seen to the end."""
+    errors: int
+    """Connections that failed."""
+
+    def __init__(self) -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.recording: bool = False
+        self.latencies: list[float] = []
+        self.sent: int = 0
+        self.received: int = 0
+        self.moves: int = 0
+        self.rejected: int = 0
+        self.games: int = 0
+        self.errors: int = 0
+
+
+def choose_move(fields: dict, trump_suit: int, rng: Random,
+                lead: bool = False) -> tuple[int, int] | None:
+    """
+    Pick a random move that looks legal from a player's view.
+    The server has the final say.
+
+    Parameters
+    ---
+    `fields: dict` - the player's gamestate fields.
+    `trump_suit: int` - the trump suit.
+    `rng: Random` - random number generator.
+    `lead: bool = False` - (optional) open the attack even if the view
+    says it's somebody else's turn to.
+
+    Returns
+    ---
+    `tuple[int, int] | None` - (card id, pair to cover) as sent with
+    `protocol.MSG_MOVE`, or `None` if there's nothing to do.
+    """
+    seat = fields["seat"]
+    attacking, defending = fields["turn"]
+    hand = list(CardSet.ids(fields["hand"]))
+    pairs = fields["pairs"]
+    uncovered = [index for (index, pair) in enumerate(pairs) if len(pair) == 1]
+    if len(hand) == 0:
+        return None
+
+    if seat == defending:
+        if len(uncovered) == 0:
+            return None
+        covers = [(id, index) for index in uncovered for id in hand
+                  if CardSet.COVER_MASKS[trump_suit][pairs[index][0]] >> id & 1]
+        if len(covers) > 0 and rng.random() < 0.9:
+            return rng.choice(covers)
+        return (protocol.NO_CARD, protocol.NO_CARD)  # take
+
+    if len(pairs) == 0:
+        if seat == attacking or lead:
+            return (rng.choice(hand), protocol.NO_CARD)
+        return None
+
+    ranks = {id % 13 for pair in pairs for id in pair}
+    throws = [id for id in hand if id % 13 in ranks]
+    if len(throws) > 0 and fields["sizes"][defending] > len(uncovered) and\
+            rng.random() < 0.5:
+        return (rng.choice(throws), protocol.NO_CARD)
+    return (protocol.NO_CARD, protocol.NO_CARD)  # pass
+
+
+class LoadClient:
+    """
+    `LoadClient` class. One headless player: joins a table, readies up,
+    and answers every update with at most one move until the game ends,
+    then joins another.
+    """
+
+    ### Instance variables ###
+    index: int
+    """Client number."""
+    stats: LoadStats
+    """Shared counters."""
+    rng: Random
+    """Private random number generator."""
+    host: str
+    """Server address."""
+    port: int
+    """Server port."""
+
+    def __init__(self, index: int, stats: LoadStats, seed: int,
+                 host: str, port: int) -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        `index: int` - client number.
+        `stats: LoadStats` - shared counters.
+        `seed: int` - seed for the client's RNG.
+        `host: str` - server address.
+        `port: int` - server port.
+
+        Returns
+        ---
+        `None`
+        """
+        self.index: int = index
+        self.stats: LoadStats = stats
+        self.rng: Random = Random(seed)
+        self.host: str = host
+        self.port: int = port
+
+    async def run(self, deadline: float) -> None:
+        """
+        Play games back to back until the deadline.
+
+        Parameters
+        ---
+        `deadline: float` - `time.perf_counter()` value to stop at.
+
+        Returns
+        ---
+        `None`
+        """
+        while time.perf_counter() < deadline:
+            try:
+                await self.play_game(deadline)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                self.stats.errors += 1
+                await asyncio.sleep(RETRY_AFTER)
+
+    async def play_game(self, deadline: float) -> None:
+        """
+        Connect, play one game and disconnect.
+
+        Parameters
+        ---
+        `deadline: float` - `time.perf_counter()` value to stop at.
+
+        Returns
+        ---
+        `None`
+        """
+        stats = self.stats
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        decoder = protocol.FrameDecoder()
+
+        def send(message: bytes) -> None:
+            writer.write(protocol.frame(message))
+            if stats.recording:
+                stats.sent += 1
+
+        send(protocol.encode_message(protocol.MSG_START,
+                                     tail=f"load{self.index}".encode()))
+        send(protocol.encode_message(protocol.MSG_READY))
+
+        states: dict[int, dict] = {}
+        fields = None
+        trump_suit = -1
+        acted = -1  # version last acted on
+        version = -1
+        pending: dict[int, float] = {}  # card id -> time sent
+        try:
+            while time.perf_counter() < deadline:
+                try:
+                    data = await asyncio.wait_for(
+                        reader.read(Server.BUFFER_SIZE), RETRY_AFTER)
+                except asyncio.TimeoutError:
+                    data = None
+                    acted = -1  # act again on the same state
+                if data == b"":
+                    break
+
+                for message in decoder.feed(data or b""):
+                    if stats.recording:
+                        stats.received += 1
+                    kind, numbers, tail = protocol.decode_message(message)
+                    if kind == protocol.MSG_STATE:
+                        base = None
+                        (version, ) = numbers
+                        new = {}
+                    elif kind == protocol.MSG_DELTA:
+                        base, version = numbers
+                        if base not in states:
+                            send(protocol.encode_message(protocol.MSG_SYNC))
+                            continue
+                        new = states[base].copy()
+                    else:
+                        if kind == protocol.MSG_PING:
+                            send(protocol.encode_message(protocol.MSG_PONG))
+                        continue
+                    for (name, value) in protocol.decode_fields(tail).items():
+                        match name:
+                            case "add":
+                                new["hand"] |= value
+                            case "remove":
+                                new["hand"] &= ~value
+                            case _:
+                                new[name] = value
+                    states[version] = new
+                    if base is not None:
+                        for old in [old for old in states if old < base]:
+                            del states[old]
+                    send(protocol.encode_message(protocol.MSG_ACK, version))
+                    fields = new
+
+                if fields is None:
+                    continue
+                if fields["deck"][0] > 0:
+                    trump_suit = Card(fields["deck"][1]).suit
+
+                # moves made: their cards have left the hand
+                now = time.perf_counter()
+                for (id, sent) in list(pending.items()):
+                    if not fields["hand"] >> id & 1:
+                        if stats.recording:
+                            stats.latencies.append(now - sent)
+                        del pending[id]
+                    elif now - sent > MOVE_TIMEOUT:
+                        if stats.recording:
+                            stats.rejected += 1
+                        del pending[id]
+
+                # over once at most one player still has cards
+                if fields["deck"][0] == 0 and\
+                        sum([size > 0 for size in fields["sizes"]]) <= 1:
+                    if stats.recording:
+                        stats.games += 1
+                    break
+
+                if acted == version:
+                    continue
+                move = choose_move(fields, trump_suit, self.rng,
+                                   lead=acted < 0)
+                acted = version
+                if move is None:
+                    continue
+                if move[0] != protocol.NO_CARD and move[0] not in pending:
+                    pending[move[0]] = time.perf_counter()
+                send(protocol.encode_message(protocol.MSG_MOVE, *move))
+                if stats.recording:
+                    stats.moves += 1
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+def process_usage(pid: int) -> tuple[float, int, int]:
+    """
+    Read a process's CPU time and memory use from `/proc` (Linux only).
+
+    Parameters
+    ---
+    `pid: int` - process id.
+
+    Returns
+    ---
+    `tuple[float, int, int]` - (CPU seconds used so far, resident memory
+    in kB, peak resident memory in kB).
+    """
+    with open(f"/proc/{pid}/stat") as file:
+        # the command name may contain spaces, so split after it
+        stat = file.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = (int(stat[11]) + int(stat[12])) / ticks  # utime + stime
+
+    rss = peak = 0
+    with open(f"/proc/{pid}/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+            elif line.startswith("VmHWM:"):
+                peak = int(line.split()[1])
+    return cpu, rss, peak
+
+
+async def load_test(clients: int, host: str, port: int, warmup: float,
+                    duration: float, pid: int | None, seed: int) -> dict:
+    """
+    Run the clients, measuring only after the warmup.
+
+    Parameters
+    ---
+    `clients: int` - number of clients.
+    `host: str` - server address.
+    `port: int` - server port.
+    `warmup: float` - seconds before measuring, to reach steady state.
+    `duration: float` - seconds to measure for.
+    `pid: int | None` - server process to measure, or `None`.
+    `seed: int` - base seed.
+
+    Returns
+    ---
+    `dict` - statistics; see `print_report`.
+    """
+    stats = LoadStats()
+    deadline = time.perf_counter() + warmup + duration
+    tasks = []
+    for index in range(clients):
+        client = LoadClient(index, stats, seed + index, host, port)
+        tasks.append(asyncio.create_task(client.run(deadline)))
+        await asyncio.sleep(0)  # don't open every connection at once
+
+    await asyncio.sleep(max(0.0, deadline - duration - time.perf_counter()))
+    usage = process_usage(pid) if pid is not None else None
+    stats.recording = True
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    stats.recording = False
+    seconds = time.perf_counter() - start
+    end_usage = process_usage(pid) if pid is not None else None
+    await asyncio.gather(*tasks)
+
+    result = {
+        "clients": clients,
+        "seconds": seconds,
+        "latencies": sorted(stats.latencies),
+        "messages_per_sec": (stats.sent + stats.received) / seconds,
+        "sent": stats.sent,
+        "received": stats.received,
+        "moves": stats.moves,
+        "rejected": stats.rejected,
+        "games": stats.games,
+        "errors": stats.errors,
+    }
+    if usage is not None:
+        result["cpu"] = (end_usage[0] - usage[0]) / seconds
+        result["rss"] = end_usage[1]
+        result["peak_rss"] = end_usage[2]
+    return result
+
+
+def print_report(stats: dict) -> None:
+    """
+    Print the statistics returned by `load_test`.
+
+    Parameters
+    ---
+    `stats: dict` - statistics from `load_test`.
+
+    Returns
+    ---
+    `None`
+    """
+    latencies = stats["latencies"]
+    print(f"{stats['clients']} clients measured for {stats['seconds']:.2f} s")
+    print(f"throughput: {stats['messages_per_sec']:.0f} msgs/s "
+          f"({stats['sent']} sent, {stats['received']} received), "
+          f"{stats['moves'] / stats['seconds']:.0f} moves/s, "
+          f"{stats['games']} games finished")
+    if len(latencies) > 0:
+        print(f"move latency (ms): p50 {percentile(latencies, 0.5) * 1000:.2f}, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.2f}, "
+              f"max {latencies[-1] * 1000:.2f} over {len(latencies)} moves")
+    print(f"rejected moves: {stats['rejected']}, "
+          f"connection errors: {stats['errors']}")
+    if "cpu" in stats:
+        print(f"server: {stats['cpu']:.1%} of a core, "
+              f"{stats['rss'] / 1024:.1f} MB resident "
+              f"(peak {stats['peak_rss'] / 1024:.1f} MB)")
+
+
+def main() -> None:
+    """
+    Run everything.
+
+    Parameters
+    ---
+    (no parameters)
+
+    Returns
+    ---
+    `None`
+    """
+    parser = argparse.ArgumentParser(description="Durak server load test.")
+    parser.add_argument("-c", "--clients", type=int, default=100,
+                        help="number of clients")
+    parser.add_argument("--seats", type=int, default=Server.DESIRED_PLAYERS,
+                        help="seats per table, passed to a started server")
+    parser.add_argument("--host", default="127.0.0.1", help="server address")
+    parser.add_argument("--port", type=int, default=Server.PORT,
+                        help="server port")
+    parser.add_argument("--server", choices=sorted(SERVERS), default=None,
+                        help="start this server and measure it")
+    parser.add_argument("--pid", type=int, default=None,
+                        help="measure an already running server")
+    parser.add_argument("--warmup", type=float, default=3.0,
+                        help="seconds before measuring")
+    parser.add_argument("-t", "--duration", type=float, default=10.0,
+                        help="seconds to measure for")
+    parser.add_argument("--seed", type=int, default=0, help="base seed")
+    args = parser.parse_args()
+
+    process = None
+    pid = args.pid
+    if args.server is not None:
+        process = subprocess.Popen(
+            [sys.executable,
+             os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          SERVERS[args.server]),
+             "--seats", str(args.seats), "--port", str(args.port)],
+            stdout=subprocess.DEVNULL)
+        pid = process.pid
+        time.sleep(1.0)  # let it start listening
+        if process.poll() is not None:
+            parser.error(f"{args.server} server exited with code "
+                         f"{process.returncode}")
+
+    try:
+        print_report(asyncio.run(load_test(
+            args.clients, args.host, args.port, args.warmup,
+            args.duration, pid, args.seed)))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1415 @@
+#!usr/bin/env python3
+"""
+`lobby` module. Provides the `Table` class, which holds one game and the
+players seated at it, the `PlayerView` and `SpectatorView` classes, through
+which a connection sees its seat or watches a table, and the `Lobby` class, which hosts many tables
+in one server process and lets players who lost their connection
+resume their seats, even after the server restarts if it keeps a journal.
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+import secrets
+import struct
+import time
+from copy import deepcopy
+from queue import SimpleQueue
+from threading import Lock, Thread
+from typing import Callable, NamedTuple
+from bot import Bot
+from card import Card
+from game import Game, Player
+from journal import Journal
+from mcts import MCTSBot
+from referee import Referee
+from tracker import CardTracker
+import protocol
+
+
+class Snapshot(NamedTuple):
+    """
+    `Snapshot` class. Everything players can see of a table at one version.
+    Never modified once published, so it can be read from any thread
+    without a lock.
+    """
+
+    version: int
+    """Version of the table, see `Table.view_version`."""
+    ready: int
+    """Number of players who have confirmed ready."""
+    seats: int
+    """Number of seats."""
+    fields: tuple[dict, ...] | None
+    """Gamestate fields for each seat (see `protocol.FIELDS`),
+    or `None` before the game starts."""
+    public: dict | None
+    """Gamestate fields everyone can see (see `protocol.PUBLIC_FIELDS`),
+    or `None` before the game starts."""
+
+
+class Table:
+    """
+    `Table` class. Holds one game and its seats.
+
+    Only one thread, the table's writer, ever changes the game: connections
+    `submit` commands to the table's queue and the writer applies them in
+    order, a whole batch at a time. After each batch that changed anything
+    it publishes a new `snapshot` and calls the subscribers, so that
+    readers never need a lock. Seating players is left to `Lobby`.
+
+    Spectators all see the same thing, so each version of the public view
+    is encoded once, by whichever spectator asks first, and the same bytes
+    are sent to all of them.
+
+    With a journal, the writer also hands it a fresh `save` of the table
+    after every batch once the game has started, for its checkpoints.
+
+    Seats can also be given to bots (see `add_bot`). A bot thinks in a
+    thread of its own, on a copy of the game, and its move comes back
+    through the queue like anybody else's, so the writer never waits on it.
+    """
+
+    ### Constants ###
+    MIN_SEATS: int = 2
+    MAX_SEATS: int = Game.MAX_PLAYERS
+
+    # State constants
+    STATE_START: int = 0
+    STATE_WAIT: int = 1
+    STATE_PLAY: int = 2
+    STATE_END: int = 3
+
+    BOT_MOVE: int = -1
+    """Command kind of a bot's move: (game version it was chosen for,
+    card id, covering), as in `play_move`. Never comes from a client."""
+
+    SAVE: struct.Struct = struct.Struct("!BBBI")
+    """Header of `save`: seats, state, bitmask of `Referee.passed`
+    and `version`."""
+
+    ### Instance variables ###
+    table_id: int
+    """Identifier, unique within the lobby."""
+    seats: int
+    """Number of players to wait for before the game can start."""
+    players: list[Player]
+    """List of players, one per seat."""
+    player_names: list[str]
+    """List of player names."""
+    connected: list[bool]
+    """Whether each seat currently has a client, or a bot.
+    Changed under `Lobby.lock`."""
+    bots: dict[int, Bot]
+    """Bots by the seat they play. Changed under `Lobby.lock`,
+    before the game starts."""
+    trackers: dict[int, CardTracker]
+    """What each bot that tracks cards has seen, by seat. Writer only."""
+    thinking: bool
+    """Whether a bot is choosing a move. Writer only."""
+    tokens: list[bytes | None]
+    """Session token of each seat's player, or `None` for a free seat.
+    Changed under `Lobby.lock`."""
+    idle_since: float | None
+    """When the last player left a game in progress (`time.monotonic`),
+    or `None`. Changed under `Lobby.lock`."""
+    ready: list[bool]
+    """Whether each seat has confirmed ready."""
+    state: int
+    """Tracks game state. See state constants for more info."""
+    game: Game
+    """The game instance, or `None` until everyone is ready."""
+    referee: Referee
+    """Keeps track of passes and ends rounds, or `None` until the game
+    starts. Unlike bots, players don't wait their turn to throw in:
+    any move `Game.can_play_card` allows is taken."""
+    version: int
+    """Bumped on every change to the table itself that players can see."""
+    subscribers: dict[int, Callable[[], None]]
+    """Change callbacks by seat."""
+    spectators: set[Callable[[], None]]
+    """Change callbacks of spectators."""
+    broadcast: tuple[int, bytes] | None
+    """Last public view encoded, with the version it was encoded for."""
+    broadcast_lock: Lock
+    """Lock on `broadcast`."""
+    snapshot: Snapshot
+    """What players can currently see. Replaced, never modified."""
+    commands: SimpleQueue
+    """Commands for the writer: (seat, message kind, numbers, tail),
+    or `None` to stop."""
+    writer: Thread
+    """The only thread that changes the table after it's created."""
+    closed: bool
+    """Set once the table has been closed."""
+    journal: Journal | None
+    """Where the game is recorded, or `None`."""
+    journaled: int
+    """Entries of `game.history` already recorded."""
+
+    def __init__(self, table_id: int, seats: int,
+                 journal: Journal = None) -> None:
+        """
+        Constructor. Starts the table's writer.
+
+        Parameters
+        ---
+        `table_id: int` - identifier, also used as the game's id
+        in the journal.
+        `seats: int` - number of seats.
+        `journal: Journal = None` - (optional) where to record the game.
+
+        Raises
+        ---
+        `ValueError` - number of seats out of range.
+
+        Returns
+        ---
+        `None`
+        """
+        if seats not in range(Table.MIN_SEATS, Table.MAX_SEATS + 1):
+            raise ValueError(f"seats must be in range "
+                             f"[{Table.MIN_SEATS}, {Table.MAX_SEATS}]")
+        self.table_id: int = table_id
+        self.seats: int = seats
+        self.players: list[Player] = [Player() for _ in range(seats)]
+        self.player_names: list[str] = ["Unknown Player", ] * seats
+        self.connected: list[bool] = [False, ] * seats
+        self.bots: dict[int, Bot] = {}
+        self.trackers: dict[int, CardTracker] = {}
+        self.thinking: bool = False
+        self.tokens: list[bytes | None] = [None, ] * seats
+        self.idle_since: float | None = None
+        self.ready: list[bool] = [False, ] * seats
+        self.state: int = Table.STATE_START
+        self.game: Game = None
+        self.referee: Referee = None
+        self.version: int = 0
+        self.subscribers: dict[int, Callable[[], None]] = {}
+        self.spectators: set[Callable[[], None]] = set()
+        self.broadcast: tuple[int, bytes] | None = None
+        self.broadcast_lock: Lock = Lock()
+        self.closed: bool = False
+        self.journal: Journal | None = journal
+        self.journaled: int = 0
+        self.snapshot: Snapshot = self.take_snapshot()
+        self.commands: SimpleQueue = SimpleQueue()
+        self.writer: Thread = Thread(target=self.run, daemon=True,
+                                     name=f"table-{table_id}")
+        self.writer.start()
+
+    @property
+    def ready_count(self) -> int:
+        """Number of players who have confirmed ready."""
+        return sum(self.ready)
+
+    @property
+    def view_version(self) -> int:
+        """Version of what players see: goes up whenever the table
+        or its game changes."""
+        return self.version + (0 if self.game is None else self.game.version)
+
+    def is_open(self) -> bool:
+        """
+        Test if a new player can sit down at this table.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `bool`
+        """
+        return self.game is None and not all(self.connected)
+
+    def is_finished(self) -> bool:
+        """
+        Test if everybody but the bots has left this table.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `bool`
+        """
+        return not any([connected for (seat, connected) in
+                        enumerate(self.connected) if seat not in self.bots])
+
+    def add_player(self) -> int:
+        """
+        Seat a new player. Call with `Lobby.lock` held.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `int` - seat index.
+        """
+        seat = self.connected.index(False)
+        self.connected[seat] = True
+        if all(self.connected):
+            print(f"Table {self.table_id}: all players have joined! "
+                  "Waiting for players to ready...")
+            self.state = Table.STATE_WAIT
+        return seat
+
+    def add_bot(self, bot: Bot, name: str) -> int:
+        """
+        Give a free seat to a bot, which is ready straight away.
+        Call with `Lobby.lock` held, before the game starts.
+
+        Parameters
+        ---
+        `bot: Bot` - the bot.
+        `name: str` - name shown to the players.
+
+        Returns
+        ---
+        `int` - seat index.
+        """
+        seat = self.add_player()
+        self.bots[seat] = bot
+        self.submit(seat, protocol.MSG_START, tail=name.encode())
+        self.submit(seat, protocol.MSG_READY)
+        return seat
+
+    def remove_player(self, seat: int) -> None:
+        """
+        A player has left. Before the game starts their seat is freed up
+        for somebody else; the writer forgets their name and readiness
+        before it sees anything from whoever sits down next. Once it has
+        started the seat is kept for them to resume.
+        Call with `Lobby.lock` held.
+
+        Parameters
+        ---
+        `seat: int` - seat index.
+
+        Returns
+        ---
+        `None`
+        """
+        self.connected[seat] = False
+        self.subscribers.pop(seat, None)
+        self.submit(seat, protocol.MSG_END)
+
+    def subscribe(self, seat: int, callback: Callable[[], None]) -> None:
+        """
+        Ask to be told whenever the table changes. The callback is called
+        from the writer, so it should only schedule work
+        (e.g. wake up a sender).
+
+        Parameters
+        ---
+        `seat: int` - seat index.
+        `callback: Callable[[], None]` - called after every change.
+
+        Returns
+        ---
+        `None`
+        """
+        self.subscribers[seat] = callback
+
+    def watch(self, callback: Callable[[], None]) -> None:
+        """
+        Ask to be told, as a spectator, whenever the table changes.
+        See `subscribe`.
+
+        Parameters
+        ---
+        `callback: Callable[[], None]` - called after every change.
+
+        Returns
+        ---
+        `None`
+        """
+        self.spectators.add(callback)
+
+    def unwatch(self, callback: Callable[[], None]) -> None:
+        """
+        Stop telling a spectator about changes.
+
+        Parameters
+        ---
+        `callback: Callable[[], None]` - callback given to `watch`.
+
+        Returns
+        ---
+        `None`
+        """
+        self.spectators.discard(callback)
+
+    def submit(self, seat: int, kind: int, numbers: tuple[int, ...] = (),
+               tail: bytes = b"") -> None:
+        """
+        Queue a command for the writer. Safe from any thread.
+
+        Parameters
+        ---
+        `seat: int` - seat index of the player it comes from.
+        `kind: int` - message kind, one of the `protocol.MSG_` constants.
+        `numbers: tuple[int, ...] = ()` - (optional) the message's numbers.
+        `tail: bytes = b""` - (optional) the message's tail.
+
+        Returns
+        ---
+        `None`
+        """
+        self.commands.put((seat, kind, numbers, tail))
+
+    def close(self) -> None:
+        """
+        Stop the writer once it's done with the commands already queued.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.closed = True
+        self.commands.put(None)
+
+    def run(self) -> None:
+        """
+        The writer: apply commands, in order, until closed. Everything that
+        has queued up is applied as one batch, e.g. a burst of throw-ins
+        from several attackers, then the round is settled and the result
+        published once.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        while True:
+            batch = [self.commands.get()]
+            while not self.commands.empty():
+                batch.append(self.commands.get())
+
+            version = self.view_version
+            for command in batch:
+                if command is None:
+                    if self.journal is not None and self.game is not None:
+                        self.journal.finish(self.table_id)
+                    return
+                try:
+                    self.apply(*command)
+                except Exception as error:
+                    # one bad command mustn't take the table down with it
+                    print(f"Table {self.table_id}: "
+                          f"dropped command {command}: {error!r}")
+            if self.referee is not None:
+                self.settle()
+                self.prompt_bot()
+            if self.journal is not None and self.game is not None:
+                # passes don't show up in the history, so always save
+                self.journal.record(self.table_id,
+                                    self.game.history[self.journaled:],
+                                    self.save())
+                self.journaled = len(self.game.history)
+
+            if self.view_version != version:
+                self.snapshot = self.take_snapshot()
+                self.notify()
+
+    def apply(self, seat: int, kind: int, numbers: tuple[int, ...],
+              tail: bytes) -> None:
+        """
+        Apply one command. Writer only.
+
+        Parameters
+        ---
+        `seat: int` - seat index of the player it comes from.
+        `kind: int` - message kind.
+        `numbers: tuple[int, ...]` - the message's numbers.
+        `tail: bytes` - the message's tail.
+
+        Returns
+        ---
+        `None`
+        """
+        match kind:
+            case protocol.MSG_READY:
+                if not self.ready[seat]:
+                    self.ready[seat] = True
+                    self.changed()
+                    print(f"Table {self.table_id}: "
+                          f"player {seat} is ready!")
+                if self.ready_count == self.seats:
+                    self.start_game()
+            case protocol.MSG_START:
+                name = tail.decode(errors="replace")
+                if name != self.player_names[seat]:
+                    self.player_names[seat] = name
+                    self.changed()
+            case protocol.MSG_MOVE:
+                self.play_move(seat, *numbers)
+            case Table.BOT_MOVE:
+                self.thinking = False
+                (version, card_id, covering) = numbers
+                # the game moved on while the bot was thinking
+                if version == self.game.version:
+                    self.play_move(seat, card_id, covering)
+            case protocol.MSG_END:
+                if self.game is None:
+                    self.ready[seat] = False
+                    self.player_names[seat] = "Unknown Player"
+                    self.state = Table.STATE_START
+                    self.changed()
+
+    def play_move(self, seat: int, card_id: int, covering: int) -> None:
+        """
+        Validate a move and make it if it's legal; illegal moves, e.g. a
+        throw-in that lost a race with another, are dropped. Writer only.
+
+        Parameters
+        ---
+        `seat: int` - seat index of the player moving.
+        `card_id: int` - id of the card to play, or `protocol.NO_CARD`
+        to pass (attacker) or take (defender).
+        `covering: int` - index of the pair to cover,
+        or `protocol.NO_CARD`.
+
+        Returns
+        ---
+        `None`
+        """
+        game = self.game
+        if game is None or self.referee.finished():
+            return
+
+        if card_id == protocol.NO_CARD:
+            # the opening attack can't be passed, and there is
+            # nothing to take while everything is covered
+            if len(game.pairs) == 0 or\
+                    (seat == game.defending and len(game.uncovered) == 0):
+                return
+            self.referee.apply(seat, Referee.PASS)
+            return
+
+        if card_id >= Card.BACK:
+            return
+        card = Card(card_id)
+        if covering == protocol.NO_CARD:
+            covering = None
+        if not game.can_play_card(seat, card, covering):
+            return
+        self.referee.apply(seat, (card, covering))
+
+    def settle(self) -> None:
+        """
+        End the round if nobody has anything left to do in it,
+        and notice when the game is over. Writer only.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.referee.to_act()
+        if self.referee.finished() and self.state != Table.STATE_END:
+            print(f"Table {self.table_id}: game over!")
+            self.state = Table.STATE_END
+            self.changed()
+
+    def prompt_bot(self) -> None:
+        """
+        If it's a bot's turn, have it start choosing a move. Only one bot
+        thinks at a time; if the game changes before its move comes back,
+        the move is dropped and the bot is asked again. Writer only.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        if self.thinking or self.referee.finished():
+            return
+        seat = self.referee.to_act()
+        bot = self.bots.get(seat)
+        if bot is None:
+            return
+
+        self.thinking = True
+        if seat in self.trackers:
+            bot.tracker = deepcopy(self.trackers[seat])
+        Thread(target=self.think, daemon=True,
+               name=f"table-{self.table_id}-bot-{seat}",
+               args=(seat, bot, self.referee.copy(), self.game.version)).start()
+
+    def think(self, seat: int, bot: Bot, referee: Referee,
+              version: int) -> None:
+        """
+        Choose a bot's move and queue it for the writer. Runs in a thread
+        of its own, see `prompt_bot`.
+
+        Parameters
+        ---
+        `seat: int` - the bot's seat.
+        `bot: Bot` - the bot.
+        `referee: Referee` - copy of the game, the bot's to search.
+        `version: int` - the game's version when it was copied.
+
+        Returns
+        ---
+        `None`
+        """
+        options = referee.options(seat)
+        try:
+            move = bot.choose(referee, seat, options)
+        except Exception as error:
+            # a seat that never moves would hold up the whole table
+            print(f"Table {self.table_id}: bot {seat} failed: {error!r}")
+            move = options[0]
+        if move is Referee.PASS:
+            (card_id, covering) = (protocol.NO_CARD, protocol.NO_CARD)
+        else:
+            (card, covering) = move
+            card_id = card.id
+            if covering is None:
+                covering = protocol.NO_CARD
+        self.submit(seat, Table.BOT_MOVE, (version, card_id, covering))
+
+    def changed(self) -> None:
+        """
+        Record a change to the table that players can see. Writer only.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.version += 1
+
+    def notify(self) -> None:
+        """
+        Call every subscriber.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        for callback in list(self.subscribers.values()):
+            callback()
+        for callback in list(self.spectators):
+            callback()
+
+    def start_game(self) -> None:
+        """
+        Everyone is ready, initialize the game. Writer only.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        # make sure we don't re-initialize the game, or start it
+        # while someone who was ready is on their way out
+        if self.game is not None or not all(self.connected):
+            return
+
+        print(f"Table {self.table_id}: all players are ready! "
+              "Starting game...")
+        self.state = Table.STATE_PLAY
+        self.trackers = {seat: CardTracker(seat, self.seats) for
+                         (seat, bot) in self.bots.items() if bot.TRACKS_CARDS}
+        self.game = Game(self.players, listeners=[
+            tracker.on_event for tracker in self.trackers.values()])
+        self.referee = Referee(self.game)
+        self.changed()
+        if self.journal is not None:
+            self.journal.begin(self.table_id, self.game, self.save())
+
+    def save(self) -> bytes:
+        """
+        Pack everything needed to carry on with the game into a snapshot:
+        `SAVE`, then each seat's session token and name, then the game
+        (see `Game.to_bytes`). Writer only, once the game has started.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `bytes` - see `restore`.
+        """
+        passed = 0
+        for (seat, has_passed) in enumerate(self.referee.passed):
+            passed |= has_passed << seat
+        data = bytearray(Table.SAVE.pack(self.seats, self.state, passed,
+                                         self.version))
+        for (token, name) in zip(self.tokens, self.player_names):
+            data += bytes(protocol.TOKEN_BYTES) if token is None else token
+            name = name.encode()[:255]
+            data.append(len(name))
+            data += name
+        data += self.game.to_bytes()
+        return bytes(data)
+
+    def restore(table_id: int, data: bytes,
+                history: list[tuple[int, int, int]],
+                journal: Journal = None,
+                bot: Callable[[], Bot] = None) -> "Table":
+        """
+        Rebuild a table from a `save`, and bring it up to date with the
+        moves recorded since. Nobody is connected to it yet, except for
+        bots: seats without a session token were a bot's.
+
+        Parameters
+        ---
+        `table_id: int` - the table's id.
+        `data: bytes` - the snapshot.
+        `history: list[tuple[int, int, int]]` - moves made after it,
+        as in `Game.history`.
+        `journal: Journal = None` - (optional) where to record the game.
+        `bot: Callable[[], Bot] = None` - (optional) makes the bots for
+        the bots' seats, which are left empty if not given.
+
+        Raises
+        ---
+        `ValueError` - `data` isn't a valid snapshot.
+        `AssertionError` - a move in `history` isn't legal.
+
+        Returns
+        ---
+        `Table`
+        """
+        if len(data) < Table.SAVE.size:
+            raise ValueError("snapshot cut short")
+        (seats, state, passed, version) = Table.SAVE.unpack_from(data)
+        offset = Table.SAVE.size
+        seating = []
+        for _ in range(seats):
+            token = data[offset:offset + protocol.TOKEN_BYTES]
+            offset += protocol.TOKEN_BYTES
+            if offset >= len(data):
+                raise ValueError("snapshot cut short")
+            name = data[offset + 1:offset + 1 + data[offset]]
+            offset += 1 + data[offset]
+            seating.append((token if any(token) else None,
+                            name.decode(errors="replace")))
+        game = Game.from_bytes(data[offset:])
+        if game.num_players != seats:
+            raise ValueError("snapshot has the wrong number of players")
+        referee = Referee(game)
+        referee.passed = [bool(passed >> seat & 1) for seat in range(seats)]
+        for (player, card, covering) in history:
+            if player == Game.RESET[0]:
+                referee.end_round()
+            else:
+                referee.apply(player, (Card(card), None if covering ==
+                                       Game.NO_COVER else covering))
+
+        table = Table(table_id, seats, journal)
+        table.tokens = [token for (token, _) in seating]
+        table.player_names = [name for (_, name) in seating]
+        table.players = game.players
+        table.ready = [True, ] * seats
+        table.state = state
+        table.version = version
+        table.game = game
+        table.referee = referee
+        table.journaled = len(game.history)
+        if bot is not None:
+            for (seat, token) in enumerate(table.tokens):
+                if token is None:
+                    table.bots[seat] = bot()
+                    table.connected[seat] = True
+        # nothing has been submitted yet, so this is still safe
+        table.settle()
+        table.snapshot = table.take_snapshot()
+        table.prompt_bot()
+        return table
+
+    def take_snapshot(self) -> Snapshot:
+        """
+        Capture what players can currently see. Writer only.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `Snapshot`
+        """
+        fields = None
+        public = None
+        if self.game is not None:
+            fields = tuple([self.generate_fields(seat)
+                            for seat in range(self.seats)])
+            public = {name: fields[0][name] for name in protocol.PUBLIC_FIELDS
+                      if name in fields[0]}
+            public["trump"] = self.game.trump_suit
+        return Snapshot(self.view_version, self.ready_count, self.seats,
+                        fields, public)
+
+    def public_view(self) -> bytes:
+        """
+        Get the update message for spectators, encoding it only if nobody
+        has since the table last changed. Safe from any thread.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `bytes` - message payload, shared by every spectator.
+        """
+        snapshot = self.snapshot
+        with self.broadcast_lock:
+            if self.broadcast is not None and\
+                    self.broadcast[0] == snapshot.version:
+                return self.broadcast[1]
+
+            if snapshot.public is None:
+                view = protocol.encode_message(protocol.MSG_WAIT,
+                                               snapshot.ready, snapshot.seats)
+            else:
+                view = protocol.encode_view(snapshot.version, snapshot.public)
+            self.broadcast = (snapshot.version, view)
+            return view
+
+    def generate_fields(self, seat: int) -> dict:
+        """
+        Describe the gamestate as seen by a particular player, one entry
+        per field of the update message (see `protocol.FIELDS`).
+        Writer only.
+
+        Parameters
+        ---
+        `seat: int` - player to describe it for.
+
+        Returns
+        ---
+        `dict` - field values by name.
+        """
+        fields = {}
+        # player current hand
+        fields["hand"] = self.players[seat].hand_set.mask
+        # player current index
+        fields["seat"] = seat
+        # players' hand sizes
+        fields["sizes"] = tuple([len(player.hand) for player in self.players])
+        # who is attacking/defending
+        fields["turn"] = (self.game.attacking, self.game.defending)
+        # deck size and last card
+        if len(self.game.deck) > 0:
+            fields["deck"] = (len(self.game.deck), self.game.deck[-1].id)
+        else:
+            fields["deck"] = (0, -1)
+        # cards on the table
+        fields["pairs"] = tuple([tuple([card.id for card in pair])
+                                 for pair in self.game.pairs])
+        # other players' names
+        fields["names"] = tuple(self.player_names)
+        return fields
+
+
+class PlayerView:
+    """
+    `PlayerView` class. One connection's view of its seat: turns the
+    table's snapshots into the updates it sends, as deltas against the
+    last version the client acknowledged, and passes everything else on
+    to the table. Only ever shared between a connection's own reader and
+    sender, which is all its lock is for.
+
+    A view starts with nothing acknowledged, so the first update a
+    resumed session gets is one full snapshot.
+    """
+
+    ### Constants ###
+    MAX_UNACKED: int = 64
+    """Updates sent without an acknowledgement before
+    falling back to full snapshots."""
+
+    ### Instance variables ###
+    table: Table
+    """The table."""
+    seat: int
+    """The seat."""
+    token: bytes
+    """Session token, for resuming the seat from another connection."""
+    detached: bool
+    """Set once another connection has resumed the session;
+    this one should close."""
+    views: dict[int, dict]
+    """Fields of the gamestate sent, by version, from the version
+    last acknowledged onwards."""
+    acked: int
+    """Last version acknowledged, or -1."""
+    cache: tuple[tuple[int, int], bytes] | None
+    """Last update generated, with the (version, base version)
+    it was generated for."""
+    lock: Lock
+    """Lock on the above."""
+
+    def __init__(self, table: Table, seat: int, token: bytes = b"") -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        `table: Table` - the table.
+        `seat: int` - the seat.
+        `token: bytes = b""` - (optional) session token.
+
+        Returns
+        ---
+        `None`
+        """
+        self.table: Table = table
+        self.seat: int = seat
+        self.token: bytes = token
+        self.detached: bool = False
+        self.views: dict[int, dict] = {}
+        self.acked: int = -1
+        self.cache: tuple[tuple[int, int], bytes] | None = None
+        self.lock: Lock = Lock()
+
+    def subscribe(self, callback: Callable[[], None]) -> None:
+        """
+        Ask to be told whenever the table changes.
+
+        Parameters
+        ---
+        `callback: Callable[[], None]` - called after every change,
+        see `Table.subscribe`.
+
+        Returns
+        ---
+        `None`
+        """
+        self.table.subscribe(self.seat, callback)
+
+    def hello(self) -> bytes:
+        """
+        Get the greeting for the connection: where it's been seated,
+        and the token to resume it with.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `bytes` - message payload.
+        """
+        return protocol.encode_message(protocol.MSG_HELLO, self.table.table_id,
+                                       self.seat, tail=self.token)
+
+    def view(self, full: bool = False) -> bytes:
+        """
+        Get the current update message, from the cache if nothing
+        has changed since it was last generated.
+
+        This is a delta against the last version acknowledged
+        (see `acknowledge`) when possible, otherwise a full snapshot.
+
+        Parameters
+        ---
+        `full: bool = False` - (optional) send a full snapshot regardless.
+
+        Returns
+        ---
+        `bytes` - message payload.
+        """
+        snapshot = self.table.snapshot
+        if snapshot.fields is None:
+            return protocol.encode_message(protocol.MSG_WAIT,
+                                           snapshot.ready, snapshot.seats)
+
+        with self.lock:
+            if len(self.views) >= PlayerView.MAX_UNACKED:
+                # the client has stopped acknowledging, start over
+                self.views.clear()
+                self.acked = -1
+            base_version = -1 if full else self.acked
+            key = (snapshot.version, base_version)
+            if self.cache is not None and self.cache[0] == key:
+                return self.cache[1]
+
+            fields = snapshot.fields[self.seat]
+            base = self.views.get(base_version)
+            self.views[snapshot.version] = fields
+            if base is None:
+                view = protocol.encode_view(snapshot.version, fields)
+            else:
+                view = protocol.encode_view(snapshot.version, fields,
+                                            base_version, base)
+            self.cache = (key, view)
+            return view
+
+    def acknowledge(self, version: int) -> None:
+        """
+        The client has applied the update with the given version;
+        later deltas can be based on it.
+
+        Parameters
+        ---
+        `version: int` - version from the update's header.
+
+        Returns
+        ---
+        `None`
+        """
+        with self.lock:
+            if version not in self.views or version < self.acked:
+                return
+            self.acked = version
+            for old in [old for old in self.views if old < version]:
+                del self.views[old]
+
+    def handle_message(self, message: bytes) -> bytes | None:
+        """
+        Act on a message from the client and generate the reply.
+
+        Parameters
+        ---
+        `message: bytes` - message payload given by client.
+
+        Raises
+        ---
+        `ValueError` - malformed message.
+
+        Returns
+        ---
+        `bytes | None` - reply payload, or `None` if the pushed update
+        says it all.
+        """
+        kind, numbers, tail = protocol.decode_message(message)
+        match kind:
+            case protocol.MSG_ACK:
+                self.acknowledge(numbers[0])
+                return None
+            case protocol.MSG_PLAY | protocol.MSG_SYNC:
+                return self.view(full=True)
+            case protocol.MSG_START:
+                self.table.submit(self.seat, kind, numbers, tail)
+                return protocol.encode_message(protocol.MSG_START)
+            case protocol.MSG_PING:
+                return protocol.encode_message(protocol.MSG_PONG)
+            case protocol.MSG_PONG | protocol.MSG_RESUME:
+                # liveness only; resuming is settled before there's a view
+                return None
+            case _:
+                self.table.submit(self.seat, kind, numbers, tail)
+                return None
+
+
+class SpectatorView:
+    """
+    `SpectatorView` class. One spectator's view of a table: the public
+    view only, as full snapshots shared with every other spectator, and
+    nothing it sends changes the table.
+    """
+
+    ### Instance variables ###
+    table: Table
+    """The table."""
+    callback: Callable[[], None] | None
+    """Change callback, once subscribed."""
+
+    def __init__(self, table: Table) -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        `table: Table` - the table.
+
+        Returns
+        ---
+        `None`
+        """
+        self.table: Table = table
+        self.callback: Callable[[], None] | None = None
+
+    @property
+    def detached(self) -> bool:
+        """Whether the connection should close: the table is gone."""
+        return self.table.closed
+
+    def subscribe(self, callback: Callable[[], None]) -> None:
+        """
+        Ask to be told whenever the table changes.
+
+        Parameters
+        ---
+        `callback: Callable[[], None]` - called after every change,
+        see `Table.subscribe`.
+
+        Returns
+        ---
+        `None`
+        """
+        self.callback = callback
+        self.table.watch(callback)
+
+    def hello(self) -> bytes:
+        """
+        Get the greeting for the connection.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `bytes` - message payload.
+        """
+        return protocol.encode_message(protocol.MSG_HELLO, self.table.table_id,
+                                       protocol.NO_SEAT)
+
+    def view(self) -> bytes:
+        """
+        Get the current update message.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `bytes` - message payload.
+        """
+        return self.table.public_view()
+
+    def handle_message(self, message: bytes) -> bytes | None:
+        """
+        Act on a message from the spectator and generate the reply.
+        Anything that would change the table is ignored.
+
+        Parameters
+        ---
+        `message: bytes` - message payload given by client.
+
+        Raises
+        ---
+        `ValueError` - malformed message.
+
+        Returns
+        ---
+        `bytes | None` - reply payload, or `None`.
+        """
+        kind, _, _ = protocol.decode_message(message)
+        match kind:
+            case protocol.MSG_PLAY | protocol.MSG_SYNC:
+                return self.view()
+            case protocol.MSG_PING:
+                return protocol.encode_message(protocol.MSG_PONG)
+            case _:
+                return None
+
+
+class Lobby:
+    """
+    `Lobby` class. Matches players into tables, hands each player a session
+    token to resume their seat with, and reclaims tables once everybody has
+    left. A game in progress is kept for `SESSION_TIMEOUT` after its last
+    player leaves, in case they come back.
+    """
+
+    ### Constants ###
+    SESSION_TIMEOUT: float = 300.0
+    """Seconds an abandoned game is kept for its players to resume."""
+    BOT_TIME: float = 1.0
+    """Seconds a bot thinks about each move."""
+
+    ### Instance variables ###
+    tables: dict[int, Table]
+    """Every live table by id."""
+    journal: Journal | None
+    """Where games are recorded, or `None`."""
+    sessions: dict[bytes, PlayerView]
+    """The latest view of every seated player, by session token."""
+    owns: Callable[[int], bool] | None
+    """Whether this lobby may create a table with the given id, when other
+    lobbies are creating tables too (see `router`); `None` for any id."""
+    next_id: int
+    """Id for the next table created."""
+    bots: int
+    """Seats given to bots at every new table."""
+    lock: Lock
+    """Lock on `tables`, `sessions` and on who is seated where."""
+
+    def __init__(self, journal: Journal = None,
+                 owns: Callable[[int], bool] = None, first_id: int = 0,
+                 bots: int = 0) -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        `journal: Journal = None` - (optional) where to record games.
+        Table ids carry on from the ids already in it.
+        `owns: Callable[[int], bool] = None` - (optional) which table ids
+        this lobby may create; any if not given.
+        `first_id: int = 0` - (optional) smallest table id to create.
+        `bots: int = 0` - (optional) seats given to bots at every new table,
+        at least one seat always being left for players. With no bots,
+        recovered games don't get theirs back either.
+
+        Returns
+        ---
+        `None`
+        """
+        self.bots: int = bots
+        self.tables: dict[int, Table] = {}
+        self.sessions: dict[bytes, PlayerView] = {}
+        self.journal: Journal | None = journal
+        self.owns: Callable[[int], bool] | None = owns
+        self.next_id: int = first_id if journal is None else\
+            max(first_id, journal.next_game_id)
+        self.lock: Lock = Lock()
+        if journal is not None:
+            self.recover()
+
+    def recover(self) -> None:
+        """
+        Reopen the tables that were live when the journal was last closed
+        or crashed (see `Journal.recovered`). Their players can resume their
+        sessions; tables nobody comes back to are reaped like any other
+        abandoned game. Constructor only.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        start = time.monotonic()
+        snapshots = {}
+        for (table_id, (data, history)) in self.journal.recovered.items():
+            try:
+                table = Table.restore(table_id, data, history, self.journal,
+                                      self.new_bot if self.bots > 0 else None)
+            except (ValueError, AssertionError) as error:
+                print(f"Table {table_id} can't be recovered: {error}")
+                continue
+            table.idle_since = start
+            self.tables[table_id] = table
+            for (seat, token) in enumerate(table.tokens):
+                if token is not None:
+                    self.sessions[token] = PlayerView(table, seat, token)
+            snapshots[table_id] = data if len(history) == 0 else table.save()
+        self.journal.resume(snapshots)
+        if len(self.tables) > 0:
+            print(f"Recovered {len(self.tables)} tables in "
+                  f"{(time.monotonic() - start) * 1000:.0f} ms.")
+
+    def join(self, seats: int) -> PlayerView:
+        """
+        Seat a new player at an open table with the given number of seats,
+        opening a new table if there isn't one.
+
+        Parameters
+        ---
+        `seats: int` - desired number of seats, in the range
+        [`Table.MIN_SEATS`, `Table.MAX_SEATS`].
+
+        Raises
+        ---
+        `ValueError` - number of seats out of range.
+
+        Returns
+        ---
+        `PlayerView` - the player's view of their seat, with a new token.
+        """
+        with self.lock:
+            self.reap()
+            for table in self.tables.values():
+                if table.seats == seats and table.is_open():
+                    return self.seat(table, table.add_player())
+
+            while self.owns is not None and not self.owns(self.next_id):
+                self.next_id += 1
+            table = Table(self.next_id, seats, self.journal)
+            self.tables[table.table_id] = table
+            self.next_id += 1
+            for _ in range(min(self.bots, seats - 1)):
+                table.add_bot(self.new_bot(), "Computer")
+            return self.seat(table, table.add_player())
+
+    def new_bot(self) -> Bot:
+        """
+        Make a bot to fill a seat.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `Bot`
+        """
+        return MCTSBot(iterations=None, time_limit=Lobby.BOT_TIME)
+
+    def seat(self, table: Table, seat: int) -> PlayerView:
+        """
+        Start a session for a player just seated. Call with `lock` held.
+
+        Parameters
+        ---
+        `table: Table` - the player's table.
+        `seat: int` - the player's seat.
+
+        Returns
+        ---
+        `PlayerView`
+        """
+        token = protocol.TOKEN_TABLE.pack(table.table_id) + secrets.token_bytes(
+            protocol.TOKEN_BYTES - protocol.TOKEN_TABLE.size)
+        view = PlayerView(table, seat, token)
+        table.tokens[seat] = token
+        self.sessions[token] = view
+        return view
+
+    def resume(self, token: bytes) -> PlayerView | None:
+        """
+        Give a returning player their seat back. If their old connection
+        hasn't noticed it's gone yet, it's detached.
+
+        Parameters
+        ---
+        `token: bytes` - session token from `PlayerView.hello`.
+
+        Returns
+        ---
+        `PlayerView | None` - a fresh view of the seat,
+        or `None` if the session is unknown or over.
+        """
+        with self.lock:
+            self.reap()
+            old = self.sessions.get(token)
+            if old is None:
+                return None
+            old.detached = True
+            table = old.table
+            view = PlayerView(table, old.seat, token)
+            self.sessions[token] = view
+            table.connected[view.seat] = True
+            table.idle_since = None
+            return view
+
+    def watch(self, table_id: int) -> SpectatorView | None:
+        """
+        Let a spectator watch a table. Spectators don't keep a table open.
+
+        Parameters
+        ---
+        `table_id: int` - the table's id.
+
+        Returns
+        ---
+        `SpectatorView | None` - the spectator's view,
+        or `None` if there's no such table.
+        """
+        with self.lock:
+            table = self.tables.get(table_id)
+            if table is None:
+                return None
+            return SpectatorView(table)
+
+    def leave(self, view: PlayerView | SpectatorView) -> None:
+        """
+        A connection has closed. If it was a player's, reclaims the table
+        if it's empty, unless there's a game in progress to come back to.
+
+        Parameters
+        ---
+        `view: PlayerView | SpectatorView` - the connection's view.
+
+        Returns
+        ---
+        `None`
+        """
+        if isinstance(view, SpectatorView):
+            if view.callback is not None:
+                view.table.unwatch(view.callback)
+            return
+
+        with self.lock:
+            if self.sessions.get(view.token) is not view:
+                return  # somebody resumed the session already
+            table = view.table
+            table.remove_player(view.seat)
+            if table.game is None:
+                # the seat is up for grabs again
+                del self.sessions[view.token]
+                table.tokens[view.seat] = None
+            if table.is_finished():
+                if table.game is None or table.state == Table.STATE_END:
+                    self.close_table(table)
+                else:
+                    table.idle_since = time.monotonic()
+
+    def reap(self) -> None:
+        """
+        Close tables whose game has been abandoned for longer than
+        `SESSION_TIMEOUT`. Call with `lock` held.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        now = time.monotonic()
+        for table in list(self.tables.values()):
+            if table.idle_since is not None and\
+                    now - table.idle_since > Lobby.SESSION_TIMEOUT:
+                self.close_table(table)
+
+    def close_table(self, table: Table) -> None:
+        """
+        Close a table and end its players' sessions. Call with `lock` held.
+
+        Parameters
+        ---
+        `table: Table` - the table.
+
+        Returns
+        ---
+        `None`
+        """
+        print(f"Table {table.table_id} is empty, closing it.")
+        del self.tables[table.table_id]
+        for token in table.tokens:
+            if token is not None:
+                self.sessions.pop(token, None)
+        table.close()
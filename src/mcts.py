@@ -0,0 +1,348 @@
+#!usr/bin/env python3
+"""
+`mcts` module. Provides `MCTSBot`, a computer player using
+information-set Monte Carlo Tree Search.
+
+Hidden information is handled by determinization: every iteration deals
+the cards the bot can't see at random, consistently with what it has seen,
+and then searches a single tree shared by all of those deals.
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+import time
+from math import log, sqrt
+from multiprocessing import Pool
+from random import Random
+from bot import Bot, SimpleBot, BOTS
+from card import Card
+from cardset import CardSet
+from game import Game
+from referee import Referee, Move
+from tracker import CardTracker
+
+MAX_ROLLOUT: int = 1000
+"""Rollouts still going after this many decisions are scored as a draw."""
+ROLLOUT_EPSILON: float = 0.1
+"""Chance of a random move instead of the `SimpleBot` move during rollouts."""
+
+
+class Node:
+    """
+    `Node` class. One node of the search tree.
+    """
+
+    __slots__ = ("parent", "player", "children", "visits", "reward", "avail")
+
+    ### Instance variables ###
+    parent: "Node"
+    """Parent node, or `None` for the root."""
+    player: int
+    """Player who made the move leading here, or -1 for the root."""
+    children: "dict[tuple[int, Move], Node]"
+    """Children by (player, move)."""
+    visits: int
+    """Number of iterations that went through this node."""
+    reward: float
+    """Total reward of those iterations, for `player`."""
+    avail: int
+    """Number of iterations in which this node's move was available."""
+
+    def __init__(self, parent: "Node" = None, player: int = -1) -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        `parent: Node = None` - parent node.
+        `player: int = -1` - player who made the move leading here.
+
+        Returns
+        ---
+        `None`
+        """
+        self.parent: Node = parent
+        self.player: int = player
+        self.children: dict[tuple[int, Move], Node] = {}
+        self.visits: int = 0
+        self.reward: float = 0.0
+        self.avail: int = 1
+
+
+def determinize(referee: Referee, viewer: int, rng: Random,
+                tracker: CardTracker = None) -> Referee:
+    """
+    Copy a game, redealing every card the viewer can't see.
+
+    The viewer knows its own hand, the board, the discard pile, the
+    face-up bottom card of the deck and the cards other players are known
+    to hold (`Game.revealed`, or `tracker` if given). Everything else is
+    shuffled and dealt back into the other hands and the deck, keeping
+    every hand size the same.
+
+    Parameters
+    ---
+    `referee: Referee` - the real game.
+    `viewer: int` - index of the player whose knowledge to use.
+    `rng: Random` - random number generator.
+    `tracker: CardTracker = None` - (optional) the viewer's card tracker.
+
+    Returns
+    ---
+    `Referee` - a copy with hidden cards redealt.
+    """
+    referee = referee.copy()
+    game = referee.game
+    bottom = game.deck[-1] if len(game.deck) > 0 else None
+
+    if tracker is not None:
+        unseen = tracker.unseen
+        known = tracker.certain
+    else:
+        seen = game.players[viewer].hand_set.mask | game.discard.mask |\
+            game.table.mask
+        for revealed in game.revealed:
+            seen |= revealed.mask
+        if bottom is not None:
+            seen |= 1 << bottom.id
+        unseen = CardSet.FULL & ~seen
+        known = [revealed.mask for revealed in game.revealed]
+
+    hidden = [Card(id) for id in CardSet.ids(unseen)]
+    rng.shuffle(hidden)
+
+    for (index, player) in enumerate(game.players):
+        if index == viewer:
+            continue
+        count = len(player.hand) - known[index].bit_count()
+        player.hand = [Card(id) for id in CardSet.ids(known[index])] +\
+            hidden[:count]
+        player.hand_set = CardSet(player.hand)
+        del hidden[:count]
+
+    if bottom is not None:
+        hidden.append(bottom)
+    game.deck.clear()
+    game.deck.extend(hidden)
+    return referee
+
+
+def rewards(game: Game) -> list[float]:
+    """
+    Score a finished (or abandoned) game for every player.
+
+    Parameters
+    ---
+    `game: Game` - the game.
+
+    Returns
+    ---
+    `list[float]` - 1 for escaping, 0 for being the durak, 0.5 for a draw.
+    """
+    if game.condition < 0:  # draw or abandoned
+        return [0.5, ] * game.num_players
+    scores = [1.0, ] * game.num_players
+    scores[game.condition] = 0.0
+    return scores
+
+
+def search(referee: Referee, viewer: int, iterations: int | None,
+           time_limit: float | None, exploration: float, seed: int,
+           tracker: CardTracker = None) -> tuple[dict[Move, int], int]:
+    """
+    Run one single-threaded search. Module-level so that worker
+    processes can run it.
+
+    Parameters
+    ---
+    `referee: Referee` - the real game.
+    `viewer: int` - index of the player to move.
+    `iterations: int | None` - iteration budget, or `None` for no limit.
+    `time_limit: float | None` - time budget in seconds, or `None`.
+    `exploration: float` - UCB exploration constant.
+    `seed: int` - seed for this search's RNG.
+    `tracker: CardTracker = None` - (optional) the viewer's card tracker.
+
+    Returns
+    ---
+    `tuple[dict[Move, int], int]` - visit counts of the viewer's moves
+    at the root, and the number of tree nodes visited.
+    """
+    rng = Random(seed)
+    policy = SimpleBot()
+    root = Node()
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+    nodes = 0
+    done = 0
+
+    while (iterations is None or done < iterations) and\
+            (deadline is None or time.perf_counter() < deadline):
+        done += 1
+        state = determinize(referee, viewer, rng, tracker)
+        node = root
+
+        # selection and expansion
+        while True:
+            player = state.to_act()
+            if player is None:
+                break
+            options = state.options(player)
+            untried = [move for move in options
+                       if (player, move) not in node.children]
+            if len(untried) > 0:
+                move = rng.choice(untried)
+                child = Node(node, player)
+                node.children[(player, move)] = child
+                state.apply(player, move)
+                node = child
+                nodes += 1
+                break
+
+            best = None
+            best_score = -1.0
+            for move in options:
+                child = node.children[(player, move)]
+                child.avail += 1
+                score = child.reward / child.visits +\
+                    exploration * sqrt(log(child.avail) / child.visits)
+                if score > best_score:
+                    best, best_score = child, score
+                    best_move = move
+            state.apply(player, best_move)
+            node = best
+            nodes += 1
+
+        # rollout: mostly greedy, which is both faster and a far better
+        # estimate than uniformly random play
+        while state.moves < referee.moves + MAX_ROLLOUT:
+            player = state.to_act()
+            if player is None:
+                break
+            options = state.options(player)
+            if rng.random() < ROLLOUT_EPSILON:
+                move = rng.choice(options)
+            else:
+                move = policy.choose(state, player, options)
+            state.apply(player, move)
+
+        # backpropagation
+        scores = rewards(state.game)
+        while node is not None:
+            node.visits += 1
+            if node.player >= 0:
+                node.reward += scores[node.player]
+            node = node.parent
+
+    visits = {move: child.visits for ((player, move), child)
+              in root.children.items() if player == viewer}
+    return visits, nodes
+
+
+class MCTSBot(Bot):
+    """
+    `MCTSBot` class. Information-set MCTS with epsilon-greedy rollouts.
+    Uses `tracker` for what it knows about hidden cards when one is set.
+    With `processes > 1`, independent searches run in parallel worker
+    processes and their root visit counts are added together.
+    """
+
+    ### Constants ###
+    TRACKS_CARDS: bool = True
+
+    ### Instance variables ###
+    iterations: int | None
+    """Iteration budget per search (per process), or `None`."""
+    time_limit: float | None
+    """Time budget per decision in seconds, or `None`."""
+    exploration: float
+    """UCB exploration constant."""
+    processes: int
+    """Number of searches run in parallel."""
+    pool: Pool
+    """Worker processes, created on first use."""
+    nodes: int
+    """Tree nodes visited during the last decision."""
+    nodes_per_sec: float
+    """Search speed during the last decision."""
+
+    def __init__(self, seed: int = None, iterations: int | None = 200,
+                 time_limit: float | None = None, exploration: float = 0.7,
+                 processes: int = 1) -> None:
+        """
+        Constructor. At least one of `iterations` and `time_limit`
+        must be given.
+
+        Parameters
+        ---
+        `seed: int = None` - (optional) seed for the bot's RNG.
+        `iterations: int | None = 200` - iteration budget per search.
+        `time_limit: float | None = None` - time budget per decision.
+        `exploration: float = 0.7` - UCB exploration constant.
+        `processes: int = 1` - number of parallel searches.
+
+        Raises
+        ---
+        `ValueError` - no budget given.
+
+        Returns
+        ---
+        `None`
+        """
+        if iterations is None and time_limit is None:
+            raise ValueError("need an iteration budget or a time limit")
+        super().__init__(seed)
+        self.iterations: int | None = iterations
+        self.time_limit: float | None = time_limit
+        self.exploration: float = exploration
+        self.processes: int = processes
+        self.pool: Pool = None
+        self.nodes: int = 0
+        self.nodes_per_sec: float = 0.0
+
+    def choose(self, referee: Referee, player: int,
+               options: list[Move]) -> Move:
+        if len(options) == 1:
+            return options[0]
+
+        start = time.perf_counter()
+        args = [(referee, player, self.iterations, self.time_limit,
+                 self.exploration, self.rng.getrandbits(64), self.tracker)
+                for _ in range(self.processes)]
+        if self.processes > 1:
+            if self.pool is None:
+                self.pool = Pool(self.processes)
+            results = self.pool.starmap(search, args)
+        else:
+            results = [search(*args[0])]
+
+        visits: dict[Move, int] = {}
+        self.nodes = 0
+        for (counts, nodes) in results:
+            self.nodes += nodes
+            for (move, count) in counts.items():
+                visits[move] = visits.get(move, 0) + count
+        self.nodes_per_sec = self.nodes / max(time.perf_counter() - start, 1e-9)
+
+        return max(options, key=lambda move: visits.get(move, 0))
+
+    def close(self) -> None:
+        """
+        Shut down the worker processes, if any.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+BOTS["mcts"] = MCTSBot
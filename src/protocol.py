@@ -0,0 +1,392 @@
+#!usr/bin/env python3
+"""
+`protocol` module. The wire format spoken between `Server` and `Client`.
+
+Every message is a frame: a 2-byte big-endian payload length followed by
+the payload. A payload starts with one byte giving its kind (see the
+`MSG_` constants), followed by fixed-size numbers for that kind and, for
+some kinds, a variable-length tail. Card ids take one byte each, and
+a hand is sent as its 52-bit `CardSet` mask.
+
+Use `FrameDecoder` to split a byte stream back into payloads;
+it copes with a `recv` holding several frames or only part of one.
+
+The client speaks first: `MSG_START` as a new player, or `MSG_RESUME` to
+take its seat back after losing the connection. The server then seats it
+and replies `MSG_HELLO` with a session token for resuming later.
+A spectator starts with `MSG_WATCH` instead, and is sent the public view
+of the table (see `PUBLIC_FIELDS`) as full snapshots.
+Either side that hears nothing for `HEARTBEAT_INTERVAL` sends
+`MSG_PING`, and gives up on the connection after `IDLE_TIMEOUT`.
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+import struct
+
+### Constants ###
+HEADER: struct.Struct = struct.Struct("!H")
+"""Frame header: payload length."""
+MAX_PAYLOAD: int = 0xFFFF
+"""Largest payload a frame can hold."""
+NO_CARD: int = 0xFF
+"""Stands in for a missing card id, e.g. an uncovered pair."""
+NO_SEAT: int = 0xFF
+"""Seat given to spectators in `MSG_HELLO`."""
+MASK_BYTES: int = 7
+"""Size of a card mask (52 bits)."""
+TOKEN_BYTES: int = 16
+"""Size of a session token."""
+TOKEN_TABLE: struct.Struct = struct.Struct("!I")
+"""Start of a session token: the id of the table it's for, so that it can
+be routed (see `router`) without asking the server. The rest is random."""
+HEARTBEAT_INTERVAL: float = 5.0
+"""Seconds of silence before asking the other side if it's still there."""
+IDLE_TIMEOUT: float = 15.0
+"""Seconds of silence before giving up on the connection."""
+
+# Message kinds
+MSG_HELLO: int = 0
+"""Server: you have been seated. Numbers: table id, seat.
+Tail: session token, for `MSG_RESUME`."""
+MSG_START: int = 1
+"""Client: my name is the tail. Server: name received."""
+MSG_READY: int = 2
+"""Client: I'm ready to play."""
+MSG_WAIT: int = 3
+"""Server: the game hasn't started. Numbers: players ready, seats."""
+MSG_PLAY: int = 4
+"""Client: send me a full snapshot of the game
+(or `MSG_WAIT` if it hasn't started)."""
+MSG_SYNC: int = 5
+"""Client: I've lost track, send me a full snapshot."""
+MSG_ACK: int = 6
+"""Client: I've applied this version. Numbers: version."""
+MSG_END: int = 7
+"""Client: I'm leaving."""
+MSG_STATE: int = 8
+"""Server: full snapshot. See `encode_view`."""
+MSG_DELTA: int = 9
+"""Server: changes since an earlier version. See `encode_view`."""
+MSG_MOVE: int = 10
+"""Client: make a move. Numbers: card id and index of the pair to cover,
+either of which may be `NO_CARD`. A card with no pair attacks, throws in
+or transfers; no card passes (attacker) or takes everything (defender)."""
+MSG_RESUME: int = 11
+"""Client, as its first message: I'm back, give me my seat.
+Tail: session token. An unknown token gets a new seat instead."""
+MSG_PING: int = 12
+"""Either side: are you still there?"""
+MSG_PONG: int = 13
+"""Either side: yes."""
+MSG_WATCH: int = 14
+"""Client, as its first message: let me watch a table.
+Numbers: table id. An unknown table closes the connection."""
+
+FORMATS: dict[int, struct.Struct] = {
+    MSG_HELLO: struct.Struct("!BIB"),
+    MSG_START: struct.Struct("!B"),
+    MSG_READY: struct.Struct("!B"),
+    MSG_WAIT: struct.Struct("!BBB"),
+    MSG_PLAY: struct.Struct("!B"),
+    MSG_SYNC: struct.Struct("!B"),
+    MSG_ACK: struct.Struct("!BI"),
+    MSG_END: struct.Struct("!B"),
+    MSG_STATE: struct.Struct("!BI"),
+    MSG_DELTA: struct.Struct("!BII"),
+    MSG_MOVE: struct.Struct("!BBB"),
+    MSG_RESUME: struct.Struct("!B"),
+    MSG_PING: struct.Struct("!B"),
+    MSG_PONG: struct.Struct("!B"),
+    MSG_WATCH: struct.Struct("!BI"),
+}
+"""Kind byte and fixed-size numbers of each message kind."""
+
+FIELDS: tuple[str, ...] = ("hand", "seat", "sizes", "turn", "deck",
+                           "pairs", "names", "add", "remove", "trump")
+"""Gamestate fields, by tag. "add" and "remove" only appear in deltas,
+as the masks of cards that entered and left the hand. "trump" is only
+sent to spectators, who may turn up after the bottom card is drawn."""
+PUBLIC_FIELDS: tuple[str, ...] = ("sizes", "turn", "deck", "pairs", "names",
+                                  "trump")
+"""Fields everyone can see, sent to spectators."""
+
+
+def token_table(token: bytes) -> int:
+    """
+    Get the id of the table a session token is for.
+
+    Parameters
+    ---
+    `token: bytes` - the token.
+
+    Returns
+    ---
+    `int` - table id, or -1 if `token` is too short to be a token.
+    """
+    if len(token) < TOKEN_TABLE.size:
+        return -1
+    return TOKEN_TABLE.unpack_from(token)[0]
+
+
+def frame(payload: bytes) -> bytes:
+    """
+    Put a payload into a frame.
+
+    Parameters
+    ---
+    `payload: bytes` - the payload.
+
+    Raises
+    ---
+    `ValueError` - payload too big.
+
+    Returns
+    ---
+    `bytes` - header followed by the payload.
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"payload must be at most {MAX_PAYLOAD} bytes")
+    return HEADER.pack(len(payload)) + payload
+
+
+def encode_message(kind: int, *numbers: int, tail: bytes = b"") -> bytes:
+    """
+    Build the payload of a message.
+
+    Parameters
+    ---
+    `kind: int` - one of the `MSG_` constants.
+    `*numbers: int` - the numbers for that kind, see `FORMATS`.
+    `tail: bytes = b""` - (optional) variable-length data.
+
+    Returns
+    ---
+    `bytes`
+    """
+    return FORMATS[kind].pack(kind, *numbers) + tail
+
+
+def decode_message(payload: bytes) -> tuple[int, tuple[int, ...], bytes]:
+    """
+    Split the payload of a message.
+
+    Parameters
+    ---
+    `payload: bytes` - the payload.
+
+    Raises
+    ---
+    `ValueError` - unknown or truncated message.
+
+    Returns
+    ---
+    `tuple[int, tuple[int, ...], bytes]` - kind, numbers and tail.
+    """
+    if len(payload) == 0 or payload[0] not in FORMATS:
+        raise ValueError("unknown message kind")
+    format = FORMATS[payload[0]]
+    try:
+        values = format.unpack_from(payload)
+    except struct.error:
+        raise ValueError("truncated message") from None
+    return values[0], values[1:], payload[format.size:]
+
+
+def encode_field(name: str, value) -> bytes:
+    """
+    Encode one gamestate field, tag first.
+
+    Parameters
+    ---
+    `name: str` - one of `FIELDS`.
+    `value` - the field's value, as made by `Table.generate_fields`.
+
+    Returns
+    ---
+    `bytes`
+    """
+    data = bytearray((FIELDS.index(name), ))
+    match name:
+        case "hand" | "add" | "remove":
+            data += value.to_bytes(MASK_BYTES, "big")
+        case "seat" | "trump":
+            data.append(value)
+        case "sizes":
+            data.append(len(value))
+            data += bytes(value)
+        case "turn":
+            data += bytes(value)
+        case "deck":
+            size, bottom = value
+            data += bytes((size, NO_CARD if bottom < 0 else bottom))
+        case "pairs":
+            data.append(len(value))
+            for pair in value:
+                data += bytes((pair[0], pair[1] if len(pair) > 1 else NO_CARD))
+        case "names":
+            data.append(len(value))
+            for name in value:
+                encoded = name.encode()[:0xFF]
+                data.append(len(encoded))
+                data += encoded
+    return bytes(data)
+
+
+def decode_fields(data: bytes) -> dict:
+    """
+    Decode a run of gamestate fields.
+
+    Parameters
+    ---
+    `data: bytes` - fields made by `encode_field`, back to back.
+
+    Raises
+    ---
+    `ValueError` - malformed data.
+
+    Returns
+    ---
+    `dict` - field values by name.
+    """
+    fields = {}
+    offset = 0
+    try:
+        while offset < len(data):
+            name = FIELDS[data[offset]]
+            offset += 1
+            match name:
+                case "hand" | "add" | "remove":
+                    value = int.from_bytes(
+                        data[offset:offset + MASK_BYTES], "big")
+                    offset += MASK_BYTES
+                case "seat" | "trump":
+                    value = data[offset]
+                    offset += 1
+                case "sizes":
+                    count = data[offset]
+                    value = tuple(data[offset + 1:offset + 1 + count])
+                    offset += 1 + count
+                case "turn":
+                    value = (data[offset], data[offset + 1])
+                    offset += 2
+                case "deck":
+                    bottom = data[offset + 1]
+                    value = (data[offset], -1 if bottom == NO_CARD else bottom)
+                    offset += 2
+                case "pairs":
+                    count = data[offset]
+                    offset += 1
+                    pairs = []
+                    for _ in range(count):
+                        attack, cover = data[offset], data[offset + 1]
+                        pairs.append((attack, ) if cover == NO_CARD
+                                     else (attack, cover))
+                        offset += 2
+                    value = tuple(pairs)
+                case "names":
+                    count = data[offset]
+                    offset += 1
+                    names = []
+                    for _ in range(count):
+                        length = data[offset]
+                        names.append(data[offset + 1:offset + 1 + length]
+                                     .decode(errors="replace"))
+                        offset += 1 + length
+                    value = tuple(names)
+            fields[name] = value
+    except IndexError:
+        raise ValueError("malformed gamestate fields") from None
+    if offset > len(data):
+        raise ValueError("malformed gamestate fields")
+    return fields
+
+
+def encode_view(version: int, fields: dict, base_version: int = -1,
+                base: dict = None) -> bytes:
+    """
+    Build the payload of a gamestate update: a full snapshot,
+    or, given a base, only the fields that differ from it.
+
+    Parameters
+    ---
+    `version: int` - version of `fields`.
+    `fields: dict` - field values by name.
+    `base_version: int = -1` - (optional) version the client has.
+    `base: dict = None` - (optional) field values at `base_version`.
+
+    Returns
+    ---
+    `bytes`
+    """
+    if base is None:
+        data = encode_message(MSG_STATE, version)
+        for (name, value) in fields.items():
+            data += encode_field(name, value)
+        return data
+
+    data = encode_message(MSG_DELTA, base_version, version)
+    for (name, value) in fields.items():
+        if value == base[name]:
+            continue
+        if name == "hand":
+            if value & ~base[name]:
+                data += encode_field("add", value & ~base[name])
+            if base[name] & ~value:
+                data += encode_field("remove", base[name] & ~value)
+        else:
+            data += encode_field(name, value)
+    return data
+
+
+class FrameDecoder:
+    """
+    `FrameDecoder` class. Splits a byte stream into payloads,
+    holding on to any partial frame until the rest arrives.
+    """
+
+    ### Instance variables ###
+    buffer: bytearray
+    """Bytes received that don't make up a whole frame yet."""
+
+    def __init__(self) -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.buffer: bytearray = bytearray()
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        Add received bytes and take out every complete payload.
+
+        Parameters
+        ---
+        `data: bytes` - bytes just received.
+
+        Returns
+        ---
+        `list[bytes]` - complete payloads, in order. May be empty.
+        """
+        self.buffer += data
+        payloads = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            (length, ) = HEADER.unpack_from(self.buffer, offset)
+            end = offset + HEADER.size + length
+            if end > len(self.buffer):
+                break
+            payloads.append(bytes(self.buffer[offset + HEADER.size:end]))
+            offset = end
+        del self.buffer[:offset]
+        return payloads
+
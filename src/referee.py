@@ -0,0 +1,179 @@
+#!usr/bin/env python3
+"""
+`referee` module. Provides the `Referee` class, which decides whose
+turn it is in a headless `Game` and when a round is over.
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+from copy import copy
+from card import Card
+from game import Game
+
+Move = tuple[Card, int | None] | None
+"""A (card, covering) pair as taken by `Game.play_card`,
+or `Referee.PASS` to pass (attacker) or take the cards (defender)."""
+
+
+class Referee:
+    """
+    `Referee` class. Drives a `Game` one decision at a time so that bots
+    can play it without a server. Turn order within a round:
+    * while any attack is uncovered, the defender acts: cover, transfer,
+      or take everything;
+    * otherwise the attackers, starting from `Game.attacking`, may each add
+      a card or pass. Playing any card gives everyone a fresh chance.
+    Once nobody has anything left to do, the round is reset.
+    """
+
+    ### Constants ###
+    PASS: None = None
+    """Move meaning "done" for an attacker and "take" for the defender."""
+
+    ### Instance variables ###
+    game: Game
+    """The game being refereed."""
+    passed: list[bool]
+    """Whether each player has passed since the last card was played."""
+    moves: int
+    """Number of decisions applied so far."""
+
+    def __init__(self, game: Game) -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        `game: Game` - freshly dealt game to referee.
+
+        Returns
+        ---
+        `None`
+        """
+        self.game: Game = game
+        self.passed: list[bool] = [False, ] * game.num_players
+        self.moves: int = 0
+
+    def copy(self) -> "Referee":
+        """
+        Return an independent copy of this referee and its game.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `Referee`
+        """
+        referee = copy(self)
+        referee.game = self.game.copy()
+        referee.passed = self.passed.copy()
+        return referee
+
+    def finished(self) -> bool:
+        """
+        Test if the game is over.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `bool`
+        """
+        return self.game.condition != Game.CONDITION_ONGOING
+
+    def to_act(self) -> int | None:
+        """
+        Find the player who has to make the next decision.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `int` - index of the player, or
+        `None` - if the game is over.
+        """
+        game = self.game
+        while game.condition == Game.CONDITION_ONGOING:
+            if len(game.uncovered) > 0:
+                return game.defending
+
+            for i in range(game.num_players):
+                player = (game.attacking + i) % game.num_players
+                if player == game.defending or self.passed[player]:
+                    continue
+                # nothing to add, so don't bother asking
+                if len(game.pairs) > 0 and len(game.legal_moves(player)) == 0:
+                    self.passed[player] = True
+                    continue
+                if len(game.players[player].hand) > 0:
+                    return player
+
+            # everybody is done with this round
+            self.end_round()
+        return None
+
+    def options(self, player: int) -> list[Move]:
+        """
+        List every decision available to the given player.
+
+        Parameters
+        ---
+        `player: int` - index of the player, as given by `to_act`.
+
+        Returns
+        ---
+        `list[Move]`
+        """
+        moves: list[Move] = self.game.legal_moves(player)
+        # the opening attack can't be passed
+        if len(self.game.pairs) > 0:
+            moves.append(Referee.PASS)
+        return moves
+
+    def apply(self, player: int, move: Move) -> None:
+        """
+        Apply a decision made by the given player.
+
+        Parameters
+        ---
+        `player: int` - index of the player, as given by `to_act`.
+        `move: Move` - one of the moves given by `options`.
+
+        Returns
+        ---
+        `None`
+        """
+        self.moves += 1
+        if move is Referee.PASS:
+            if player == self.game.defending:
+                # take everything
+                self.end_round()
+            else:
+                self.passed[player] = True
+            return
+
+        self.game.play_card(player, *move)
+        self.passed = [False, ] * self.game.num_players
+
+    def end_round(self) -> None:
+        """
+        Reset the round on the board and clear everybody's passes.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.game.reset_round()
+        self.passed = [False, ] * self.game.num_players
@@ -0,0 +1,148 @@
+#!usr/bin/env python3
+"""
+`replay` module. Rebuilds games from journals written by the server
+(see `journal`), at the end or at any point in between, and summarizes
+whole journals without replaying them.
+
+Usage: `python replay.py durak.journal -g 3 -m 40`
+(or `python replay.py *.journal` for a summary of each).
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+import argparse
+from game import Game
+import journal
+
+
+def summarize(buffer) -> dict:
+    """
+    Count what's in a journal by walking its records; no games are built.
+
+    Parameters
+    ---
+    `buffer` - the journal's contents, e.g. from `journal.map_file`.
+
+    Raises
+    ---
+    `ValueError` - `buffer` isn't a journal.
+
+    Returns
+    ---
+    `dict` - statistics; see `print_summary`.
+    """
+    games: dict[int, int] = {}  # moves by game id
+    players: dict[int, int] = {}  # games by number of players
+    plays = covers = resets = 0
+    for (_, kind, game_id, a, _, c) in journal.records(buffer):
+        match kind:
+            case journal.KIND_DEAL:
+                games[game_id] = 0
+                players[a] = players.get(a, 0) + 1
+            case journal.KIND_PLAY:
+                games[game_id] = games.get(game_id, 0) + 1
+                plays += 1
+                covers += c != journal.NONE
+            case journal.KIND_RESET:
+                games[game_id] = games.get(game_id, 0) + 1
+                resets += 1
+    return {
+        "games": len(games),
+        "players": players,
+        "plays": plays,
+        "covers": covers,
+        "resets": resets,
+        "lengths": sorted(games.values()),
+    }
+
+
+def print_summary(stats: dict) -> None:
+    """
+    Print the statistics returned by `summarize`.
+
+    Parameters
+    ---
+    `stats: dict` - statistics from `summarize`.
+
+    Returns
+    ---
+    `None`
+    """
+    lengths = stats["lengths"]
+    print(f"{stats['games']} games "
+          + ", ".join([f"{count} with {players} players" for
+                       (players, count) in sorted(stats["players"].items())]))
+    print(f"cards played: {stats['plays']} "
+          f"({stats['covers']} covering), rounds: {stats['resets']}")
+    if len(lengths) > 0:
+        print(f"game length (moves): min {lengths[0]}, "
+              f"max {lengths[-1]}, mean {sum(lengths) / len(lengths):.1f}")
+
+
+def print_game(game: Game) -> None:
+    """
+    Print a game's position.
+
+    Parameters
+    ---
+    `game: Game` - the game.
+
+    Returns
+    ---
+    `None`
+    """
+    print(f"after {len(game.history)} moves: trump suit {game.trump_suit}, "
+          f"{len(game.deck)} cards in the deck, "
+          f"{len(game.discard)} discarded")
+    for (index, player) in enumerate(game.players):
+        role = ""
+        if index == game.attacking:
+            role = " (attacking)"
+        elif index == game.defending:
+            role = " (defending)"
+        print(f"  seat {index}{role}: {player}")
+    print("  table:", " ".join(["/".join([str(card.id) for card in pair])
+                                for pair in game.pairs]))
+    if game.condition == Game.CONDITION_DRAW:
+        print("  game over: draw")
+    elif game.condition != Game.CONDITION_ONGOING:
+        print(f"  game over: seat {game.condition} lost")
+
+
+def main() -> None:
+    """
+    Run everything.
+
+    Parameters
+    ---
+    (no parameters)
+
+    Returns
+    ---
+    `None`
+    """
+    parser = argparse.ArgumentParser(description="Durak journal replay.")
+    parser.add_argument("journals", nargs="+", help="journal files")
+    parser.add_argument("-g", "--game", type=int, default=None,
+                        help="game id to rebuild (from the first journal)")
+    parser.add_argument("-m", "--moves", type=int, default=None,
+                        help="rebuild as of this many moves in")
+    args = parser.parse_args()
+
+    if args.game is None:
+        for path in args.journals:
+            buffer = journal.map_file(path)
+            print(f"{path}:")
+            print_summary(summarize(buffer))
+            buffer.close()
+        return
+
+    buffer = journal.map_file(args.journals[0])
+    print_game(journal.replay(buffer, args.game, args.moves))
+    buffer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+#!usr/bin/env python3
+"""
+`router` module. Contains the `Router` class, a front end that spreads
+tables over several local server processes ("workers"), so that one
+process's GIL doesn't cap the whole server.
+
+Clients connect to the router just as they would to a `Server`. Each
+connection is handed to one worker, chosen by its first message, and from
+then on the router only copies bytes both ways:
+    * `MSG_WATCH` goes to the worker owning the table (see `shard.Ring`);
+    * `MSG_RESUME` too, by the table id at the start of the token;
+    * `MSG_START` goes to a worker with a table that's still filling up,
+      or else to the least busy one.
+Each worker only creates the table ids the ring gives it, so ids stay
+unique and returning players find their table.
+
+With `--journal`, each worker keeps a journal of its own. Before the
+workers start, live games are moved to the journals of the workers that
+own them now, through their snapshots, in case the number of workers
+changed (see `rebalance`). A worker that dies is restarted and picks up
+its games from its journal, and their players can resume.
+
+Usage: `python router.py --workers 4 --journal durak.journal`
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+from typing import Callable
+from journal import Journal
+from lobby import Lobby
+from server import Server, SERVERS
+from shard import Ring
+import journal
+import protocol
+
+
+class Worker:
+    """
+    `Worker` class. One server process behind the router, and what the
+    router knows about it.
+    """
+
+    ### Instance variables ###
+    index: int
+    """Worker number, as used by `shard.Ring`."""
+    port: int
+    """Port it listens on, on this machine."""
+    command: list[str]
+    """Command line that starts it."""
+    process: subprocess.Popen | None
+    """The process, or `None` until started."""
+    connections: int
+    """Client connections currently handed to it."""
+    waiting: int
+    """Players handed to it who haven't been sent a gamestate yet."""
+
+    def __init__(self, index: int, port: int, command: list[str]) -> None:
+        """
+        Constructor. Doesn't start the process.
+
+        Parameters
+        ---
+        `index: int` - worker number.
+        `port: int` - port it listens on.
+        `command: list[str]` - command line that starts it.
+
+        Returns
+        ---
+        `None`
+        """
+        self.index: int = index
+        self.port: int = port
+        self.command: list[str] = command
+        self.process: subprocess.Popen | None = None
+        self.connections: int = 0
+        self.waiting: int = 0
+
+    def start(self) -> None:
+        """
+        Start the process.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.process = subprocess.Popen(self.command)
+
+    def stop(self) -> None:
+        """
+        Ask the process to shut down cleanly, and wait for it.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+
+class Router:
+    """
+    `Router` class. Accepts client connections and forwards each to one
+    of its workers, which it starts, and restarts if they die.
+    """
+
+    ### Constants ###
+    WORKER_HOST: str = "127.0.0.1"
+    """Where the workers are."""
+    CONNECT_TIMEOUT: float = 5.0
+    """Seconds to keep trying a worker that isn't up, e.g. restarting."""
+    CHECK_INTERVAL: float = 1.0
+    """Seconds between checks that the workers are still running."""
+
+    ### Instance variables ###
+    seats: int
+    """Number of seats at the workers' tables."""
+    port: int
+    """Port to listen on."""
+    ring: Ring
+    """Which worker each table belongs to."""
+    workers: list[Worker]
+    """The workers."""
+    writers: set[asyncio.StreamWriter]
+    """Open client connections, closed on shutdown."""
+    stopping: asyncio.Event
+    """Set to shut the router down."""
+
+    def __init__(self, workers: int, seats: int = Server.DESIRED_PLAYERS,
+                 server: str = "async", journal_path: str = None,
+                 port: int = Server.PORT, bots: int = 0) -> None:
+        """
+        Constructor. Gets the journals ready, if any, but doesn't
+        start the workers.
+
+        Parameters
+        ---
+        `workers: int` - number of workers.
+        `seats: int = DESIRED_PLAYERS` - (optional) seats per table.
+        `server: str = "async"` - (optional) server workers run,
+        one of `SERVERS`.
+        `journal_path: str = None` - (optional) where to record games:
+        worker `i` keeps its journal in `journal_path.i`.
+        `port: int = PORT` - (optional) port to listen on. Workers
+        listen on the ones after it.
+        `bots: int = 0` - (optional) seats given to bots at every table.
+
+        Raises
+        ---
+        `ValueError` - fewer than one worker, or a journal
+        isn't a journal.
+
+        Returns
+        ---
+        `None`
+        """
+        self.seats: int = seats
+        self.port: int = port
+        self.ring: Ring = Ring(workers)
+        self.writers: set[asyncio.StreamWriter] = set()
+        self.stopping: asyncio.Event = None
+
+        first_id = 0
+        if journal_path is not None:
+            first_id = rebalance(journal_path, self.ring)
+        self.workers: list[Worker] = []
+        for index in range(workers):
+            command = [sys.executable,
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    SERVERS[server]),
+                       "--seats", str(seats), "--port", str(port + 1 + index),
+                       "--shard", str(index), "--shards", str(workers),
+                       "--first-id", str(first_id), "--bots", str(bots)]
+            if journal_path is not None:
+                command += ["--journal", f"{journal_path}.{index}"]
+            self.workers.append(Worker(index, port + 1 + index, command))
+
+    def choose(self, message: bytes) -> Worker:
+        """
+        Pick the worker for a new connection.
+
+        Parameters
+        ---
+        `message: bytes` - the connection's first message.
+
+        Raises
+        ---
+        `ValueError` - the message can't be decoded.
+
+        Returns
+        ---
+        `Worker`
+        """
+        (kind, numbers, tail) = protocol.decode_message(message)
+        if kind == protocol.MSG_WATCH:
+            return self.workers[self.ring.owner(numbers[0])]
+        if kind == protocol.MSG_RESUME and\
+                protocol.token_table(tail) >= 0:
+            return self.workers[self.ring.owner(protocol.token_table(tail))]
+        # a new player: fill up a table somebody is already waiting at
+        filling = [worker for worker in self.workers
+                   if worker.waiting % self.seats != 0]
+        return min(filling or self.workers,
+                   key=lambda worker: worker.connections)
+
+    async def connect(self, worker: Worker) -> tuple[asyncio.StreamReader,
+                                                     asyncio.StreamWriter]:
+        """
+        Open a connection to a worker, waiting for it to come up if needed.
+
+        Parameters
+        ---
+        `worker: Worker` - the worker.
+
+        Raises
+        ---
+        `OSError` - it didn't come up within `CONNECT_TIMEOUT`.
+
+        Returns
+        ---
+        `tuple[asyncio.StreamReader, asyncio.StreamWriter]`
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + Router.CONNECT_TIMEOUT
+        while True:
+            try:
+                return await asyncio.open_connection(
+                    Router.WORKER_HOST, worker.port,
+                    limit=Server.BUFFER_SIZE)
+            except OSError:
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+    async def handle_client(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+        """
+        Run the connection to one client: wait for its first message,
+        pick its worker, and copy bytes between the two until either
+        side hangs up.
+
+        Parameters
+        ---
+        `reader: asyncio.StreamReader` - incoming side of the connection.
+        `writer: asyncio.StreamWriter` - outgoing side of the connection.
+
+        Returns
+        ---
+        `None`
+        """
+        self.writers.add(writer)
+        address = writer.get_extra_info("peername")
+        decoder = protocol.FrameDecoder()
+        received = bytearray()
+        worker = None
+        started = False
+
+        def start() -> None:
+            nonlocal started
+            started = True
+            worker.waiting -= 1
+
+        try:
+            # the first message is forwarded as is, with
+            # anything that came along with it
+            messages = []
+            while len(messages) == 0:
+                data = await asyncio.wait_for(reader.read(Server.BUFFER_SIZE),
+                                              protocol.IDLE_TIMEOUT)
+                if data == b"":
+                    raise ConnectionError("closed before saying anything")
+                received += data
+                messages = decoder.feed(data)
+            worker = self.choose(messages[0])
+        except (asyncio.TimeoutError, ConnectionError, ValueError) as e:
+            print(f"Couldn't route {address[0]} at {address[1]}:",
+                  str(e) + ".")
+            self.writers.discard(writer)
+            writer.close()
+            return
+
+        # counted before waiting for the worker, so that
+        # players arriving meanwhile are matched with this one
+        player = messages[0][0] != protocol.MSG_WATCH
+        worker.connections += 1
+        if player:
+            worker.waiting += 1
+        upstream = None
+        tasks = []
+        try:
+            (upstream_reader, upstream) = await self.connect(worker)
+            upstream.write(received)
+            tasks = [asyncio.create_task(self.forward(reader, upstream)),
+                     asyncio.create_task(self.forward(
+                         upstream_reader, writer, start if player else None))]
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        except OSError as e:
+            print(f"Couldn't reach worker {worker.index} for {address[0]} "
+                  f"at {address[1]}:", str(e) + ".")
+        finally:
+            for task in tasks:
+                task.cancel()
+            worker.connections -= 1
+            if player and not started:
+                worker.waiting -= 1
+            self.writers.discard(writer)
+            if upstream is not None:
+                upstream.close()
+            writer.close()
+
+    async def forward(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter,
+                      on_start: Callable[[], None] = None) -> None:
+        """
+        Copy bytes from one side to the other until the reading side
+        hangs up.
+
+        Parameters
+        ---
+        `reader: asyncio.StreamReader` - side to read from.
+        `writer: asyncio.StreamWriter` - side to write to.
+        `on_start: Callable[[], None] = None` - (optional) called on the
+        first gamestate; until then, messages are decoded to look for it.
+
+        Returns
+        ---
+        `None`
+        """
+        decoder = None if on_start is None else protocol.FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(Server.BUFFER_SIZE)
+                if data == b"":
+                    return
+                writer.write(data)
+                if decoder is not None:
+                    for message in decoder.feed(data):
+                        if len(message) > 0 and message[0] in (
+                                protocol.MSG_STATE, protocol.MSG_DELTA):
+                            on_start()
+                            decoder = None
+                            break
+                await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+
+    async def supervise(self) -> None:
+        """
+        Restart workers that have exited, until the router stops.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        while not self.stopping.is_set():
+            await asyncio.sleep(Router.CHECK_INTERVAL)
+            for worker in self.workers:
+                code = worker.process.poll()
+                if code is not None and not self.stopping.is_set():
+                    print(f"Worker {worker.index} exited ({code}), "
+                          "restarting it.")
+                    worker.start()
+
+    async def serve(self) -> None:
+        """
+        Start the workers and accept connections until SIGINT/SIGTERM,
+        then shut everything down cleanly.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # not supported on this platform/thread
+
+        for worker in self.workers:
+            worker.start()
+        supervisor = asyncio.create_task(self.supervise())
+        server = await asyncio.start_server(
+            self.handle_client, Server.IP or None, self.port,
+            limit=Server.BUFFER_SIZE, reuse_address=True)
+        print(f"Routing to {len(self.workers)} workers on ports "
+              f"{self.port + 1}-{self.port + len(self.workers)}.")
+        async with server:
+            await self.stopping.wait()
+
+            print("Closing socket...")
+            server.close()
+            supervisor.cancel()
+            for writer in list(self.writers):
+                writer.close()
+            await server.wait_closed()
+
+    def mainloop(self) -> None:
+        """
+        Keep the router running.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `None`
+        """
+        try:
+            asyncio.run(self.serve())
+        finally:
+            for worker in self.workers:
+                worker.stop()
+
+
+def rebalance(journal_path: str, ring: Ring) -> int:
+    """
+    Get the workers' journals ready: move every live game to the journal
+    of the worker that owns it now, e.g. after the number of workers
+    changed. A game moves by way of its snapshot (see `Table.save`), and
+    its history is copied along so that the new journal can replay it.
+
+    Parameters
+    ---
+    `journal_path: str` - worker `i`'s journal is `journal_path.i`.
+    Journals of workers past `ring.workers`, left over from a run with
+    more workers, are emptied of live games too.
+    `ring: Ring` - the workers.
+
+    Raises
+    ---
+    `ValueError` - a journal isn't a journal.
+
+    Returns
+    ---
+    `int` - smallest table id the workers may create, so that no id is
+    used twice, whichever worker had it before.
+    """
+    paths = [f"{journal_path}.{index}" for index in range(ring.workers)]
+    while os.path.exists(f"{journal_path}.{len(paths)}"):
+        paths.append(f"{journal_path}.{len(paths)}")
+    journals = [Journal(path) for path in paths]
+    lobbies = []
+    try:
+        first_id = max([log.next_game_id for log in journals])
+        moving = {index: [game_id for game_id in log.recovered
+                          if index >= ring.workers or
+                          ring.owner(game_id) != index]
+                  for (index, log) in enumerate(journals)}
+        if not any(moving.values()):
+            return first_id
+
+        # rebuild everything, so that every journal gets checkpointed
+        lobbies = [Lobby(log) for log in journals]
+        moved = 0
+        for (index, game_ids) in moving.items():
+            if len(game_ids) == 0:
+                continue
+            lobby = lobbies[index]
+            buffer = journal.map_file(paths[index])
+            try:
+                offsets = journal.find_games(buffer)
+                for game_id in game_ids:
+                    table = lobby.tables.get(game_id)
+                    if table is None or game_id not in offsets:
+                        continue  # couldn't be recovered
+                    (_, _, history) = journal.load_game(buffer, game_id,
+                                                        offsets[game_id])
+                    target = journals[ring.owner(game_id)]
+                    target.begin(game_id, table.game, table.save(),
+                                 history)
+                    with lobby.lock:
+                        lobby.close_table(table)
+                    table.writer.join()
+                    moved += 1
+            finally:
+                buffer.close()
+        print(f"Moved {moved} tables to their new workers.")
+        return first_id
+    finally:
+        # stop the writers without ending their games in the journals
+        for lobby in lobbies:
+            for table in lobby.tables.values():
+                table.journal = None
+                table.close()
+        for log in journals:
+            log.close()
+
+
+def main() -> None:
+    """
+    Run everything.
+
+    Parameters
+    ---
+    (no parameters)
+
+    Returns
+    ---
+    `None`
+    """
+    parser = argparse.ArgumentParser(description="Durak router.")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument("--seats", type=int, default=Server.DESIRED_PLAYERS,
+                        help="number of seats per table")
+    parser.add_argument("--server", choices=sorted(SERVERS), default="async",
+                        help="server the workers run")
+    parser.add_argument("--journal", default=None,
+                        help="record games in JOURNAL.0, JOURNAL.1, ... "
+                        "(one per worker)")
+    parser.add_argument("--port", type=int, default=Server.PORT,
+                        help="port to listen on; workers use the next ones")
+    parser.add_argument("--bots", type=int, default=0,
+                        help="seats given to computer players at every table")
+    args = parser.parse_args()
+
+    router = Router(args.workers, args.seats, args.server, args.journal,
+                    args.port, args.bots)
+    router.mainloop()
+
+
+if __name__ == "__main__":
+    main()
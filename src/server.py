@@ -10,18 +10,36 @@ __author__ = "Chris Bao"
 __version__ = 0.9
 
 ### Imports ###
+import argparse
+import select
 import socket as s
+import time
 from _thread import *
-from threading import Lock
-from collections import deque
-import pygame
-from card import Card
-from game import Game, Player
+from threading import Condition, Lock
+from typing import Callable
+from journal import Journal
+from lobby import Lobby, PlayerView, SpectatorView, Table
+from shard import Ring
+import protocol
+
+SERVERS: dict[str, str] = {
+    "threaded": "server.py",
+    "async": "async_server.py",
+}
+"""Server scripts, by name, for whatever starts servers (e.g. `router`).
+They all take the command line of `parse_args`."""
 
 
 class Server:
     """
     `Server` class. Provides methods for running the server.
+    Hosts any number of tables (see `lobby`), each with its own game.
+
+    Messages in both directions are framed (see `protocol`). Clients don't
+    poll: the server pushes a player's view to them whenever their
+    table changes. A client that loses its connection can come back to its
+    seat with its session token, and one that goes quiet is pinged and
+    eventually dropped. Spectators can watch any table without a seat.
     """
 
     ### Constants ###
@@ -32,46 +50,78 @@ class Server:
     """Connection port number. Pretty much arbitrary."""
     BUFFER_SIZE: int = 8192
     """Size of buffer for receiving messages."""
-    MAX_PLAYERS: int = 4
-    """Maximum number of players per game."""
-
-    ##################################
-    # THIS MUST BE SET EVERY GAME!!! #
-    ##################################
+    BACKLOG: int = 128
+    """Maximum number of connections waiting to be accepted."""
     DESIRED_PLAYERS: int = 2
-    """Set by the host. Number of people to wait for before the game can start."""
-
-    # State constants
-    STATE_START: int = 0
-    STATE_WAIT: int = 1
-    STATE_PLAY: int = 2
-    STATE_END: int = 3
+    """Default number of seats per table. Overridden with `--seats`."""
 
     ### Instance variables ###
     socket: s.socket
     """The `socket` that the server uses to connect."""
-    player_count: int
-    """Number of players connected."""
-    ready_count: int
-    """Number of players who have confirmed ready."""
-    client_sockets: list[s.socket]
-    client_addresses: list[tuple[str, int]]
-    """List of (address, port) for clients."""
-    players: list[Player]
-    """List of players."""
-    player_names: list[str]
-    """List of player names."""
-    state: int
-    """Tracks game state. See state constants for more info."""
-    lock: Lock
-    """Lock on the game state to avoid issues while multithreading."""
-    game: Game
-    """The game instance."""
-
-    def __init__(self) -> None:
+    seats: int
+    """Number of seats at the tables new players are matched into."""
+    port: int
+    """Port to listen on."""
+    lobby: Lobby
+    """All tables hosted by this server."""
+    journal: Journal | None
+    """Where games are recorded, or `None`."""
+
+    def __init__(self, seats: int = DESIRED_PLAYERS,
+                 journal_path: str = None, port: int = PORT,
+                 shard: int = 0, shards: int = 1, first_id: int = 0,
+                 bots: int = 0) -> None:
         """
         Constructor. Initializes the server.
 
+        Parameters
+        ---
+        `seats: int = DESIRED_PLAYERS` - seats per table.
+        `journal_path: str = None` - (optional) journal file to record
+        every game in, see `journal`. Games still going in it are
+        recovered, so their players can resume.
+        `port: int = PORT` - (optional) port to listen on.
+        `shard: int = 0` - (optional) which of `shards` workers behind a
+        `router` this is; it only creates the tables `Ring` gives it.
+        `shards: int = 1` - (optional) number of workers.
+        `first_id: int = 0` - (optional) smallest table id to create.
+        `bots: int = 0` - (optional) seats given to bots at every table.
+
+        Raises
+        ---
+        `ValueError` - number of seats out of range, `shard` isn't
+        one of `shards`, or `journal_path` isn't a journal.
+
+        Returns
+        ---
+        `None`
+        """
+        if seats not in range(Table.MIN_SEATS, Table.MAX_SEATS + 1):
+            raise ValueError(f"seats must be in range "
+                             f"[{Table.MIN_SEATS}, {Table.MAX_SEATS}]")
+        if shard not in range(shards):
+            raise ValueError(f"shard must be in range [0, {shards})")
+        self.seats: int = seats
+        self.port: int = port
+        self.journal: Journal | None = None
+        if journal_path is not None:
+            self.journal = Journal(journal_path)
+            print(f"Recording games in {journal_path}.")
+        owns = None
+        if shards > 1:
+            ring = Ring(shards)
+
+            def owns(table_id: int) -> bool:
+                return ring.owner(table_id) == shard
+        self.lobby: Lobby = Lobby(self.journal, owns, first_id, bots)
+
+        self.open_socket()
+        print(f"Server initialized. Matching players into tables of {seats}...")
+
+    def open_socket(self) -> None:
+        """
+        Create the listening socket.
+
         Parameters
         ---
         (no parameters)
@@ -84,173 +134,161 @@ class Server:
             s.AF_INET, s.SOCK_STREAM)
 
         try:
-            self.socket.bind((Server.IP, Server.PORT))
+            self.socket.bind((Server.IP, self.port))
         except s.error as err:
             print(str(err))
 
-        pygame.init()
-        # we don't care about the actual display;
-        # display just needs to be created so that card images can be loaded
-        # so that we don't get an error initializing the game
-        pygame.display.set_mode(flags=pygame.HIDDEN)
-        Card.load_images()
+        self.socket.listen(Server.BACKLOG)
 
-        self.player_count: int = 0
-        self.ready_count: int = 0
-
-        self.client_sockets: list[s.socket] = []
-        self.client_addresses: list[tuple[str, int]] = []
-        self.players: list[Player] = []
-        self.player_names: list[str] = []
-        self.state = Server.STATE_START
-
-        self.lock = Lock()
-        self.game = None
-
-        self.socket.listen(Server.MAX_PLAYERS)
-        print("Server initialized. Waiting for up to " +
-              f"{Server.MAX_PLAYERS} connections...")
-
-    def start_game(self) -> None:
+    def add_player(self, address: tuple[str, int],
+                   message: bytes) -> PlayerView | SpectatorView:
         """
-        Everyone is ready, initialize the game.
+        Register a newly connected client given its first message:
+        as a spectator if it wants to watch, back at its old seat if it's
+        resuming a session it still has, otherwise as a new player
+        at some table.
 
         Parameters
         ---
-        (no parameters)
+        `address: tuple[str, int]` - (address, port) of the client.
+        `message: bytes` - first message payload given by client.
+
+        Raises
+        ---
+        `ValueError` - malformed message, or no table to watch.
 
         Returns
         ---
-        `None`
+        `PlayerView | SpectatorView` - the client's view.
         """
-        print("All players are ready! Starting game...")
-        self.state = Server.STATE_PLAY
-        self.lock.acquire()
-
-        # make sure we don't re-initialize the game
-        if self.game is not None:
-            self.lock.release()
-            return
+        kind, numbers, tail = protocol.decode_message(message)
+        if kind == protocol.MSG_WATCH:
+            spectator = self.lobby.watch(numbers[0])
+            if spectator is None:
+                raise ValueError(f"no table {numbers[0]} to watch")
+            print(f"Spectator watching table {numbers[0]}:",
+                  address[0], "at", str(address[1])+".")
+            return spectator
+
+        if kind == protocol.MSG_RESUME:
+            view = self.lobby.resume(tail)
+            if view is not None:
+                print(f"Player {view.seat} is back at table "
+                      f"{view.table.table_id}:",
+                      address[0], "at", str(address[1])+".")
+                return view
 
-        self.game = Game(self.players)
-        self.lock.release()
+        view = self.lobby.join(self.seats)
+        print(f"Connected to player {view.seat} at table "
+              f"{view.table.table_id}:",
+              address[0], "at", str(address[1])+".")
+        return view
 
-    def generate_message(self, input: str, player_index: int) -> str:
+    def remove_player(self, view: PlayerView | SpectatorView) -> None:
         """
-        Generate the update message to send back over the specified
-        connection.
+        Unregister a client that has disconnected.
 
         Parameters
         ---
-        `input: str` - message given by client.
-        `player_index: int` - player id.
+        `view: PlayerView | SpectatorView` - the client's view.
 
         Returns
         ---
-        `str` - message.
+        `None`
         """
-        match input.split()[0]:
-            case "start":
-                return "start"
-            case "wait" | "ready":
-                return "wait" + " " + str(self.ready_count) + " " + str(Server.DESIRED_PLAYERS)
-            case "play":
-                # TODO: this has to give more information about game state
-                self.lock.acquire()
-                result = self.generate_gamestate_string(player_index)
-                self.lock.release()
-                return result
-            case "end":
-                return ""  # TODO
-    
-    def generate_gamestate_string(self, player_index: int) -> str:
+        if isinstance(view, SpectatorView):
+            print(f"Spectator left table {view.table.table_id}.")
+        elif view.detached:
+            print(f"Player {view.seat} at table {view.table.table_id} "
+                  "has resumed elsewhere, closing old connection.")
+        else:
+            print(f"Lost connection to player {view.seat} at table "
+                  f"{view.table.table_id}, closing connection.")
+        self.lobby.leave(view)
+
+    def handle_message(self, message: bytes,
+                       view: PlayerView | SpectatorView) -> bytes | None:
         """
-        Generate a string representing the gamestate for a
-        particular player.
-        
+        Act on a message from a client and generate the reply.
+        Shared by every transport (see `threaded_client` and `AsyncServer`).
+
         Parameters
         ---
-        `player_index: int` - player to send to.
-        
+        `message: bytes` - message payload given by client.
+        `view: PlayerView | SpectatorView` - the client's view.
+
+        Raises
+        ---
+        `ValueError` - malformed message.
+
         Returns
-        `str`
+        ---
+        `bytes | None` - reply payload, or `None` for no reply.
         """
-        reply = "play\n"
-        # player current hand
-        reply += str(self.players[player_index]) + "\n"
-        # player current index
-        reply += f"{player_index}\n"
-        # players' hand sizes
-        reply += " ".join([str(len(self.players[i].hand))
-                           for i in range(self.player_count)]) + "\n"
-        # who is attacking/defending
-        reply += f"{self.game.attacking} {self.game.defending}\n"
-        # deck size and last card
-        if len(self.game.deck) > 0:
-            reply += f"{len(self.game.deck)} {self.game.deck[-1].id}\n"
-        else:
-            reply += f"{len(self.game.deck)} {-1}\n"
-        # other players' names
-        reply += "`".join(self.player_names) + "\n"
-        # DEBUG
-        # print(reply)
-        return reply
-
-    def threaded_client(self, client: s.socket, player_index: int) -> None:
+        return view.handle_message(message)
+
+    def threaded_client(self, client: s.socket,
+                        address: tuple[str, int]) -> None:
         """
-        Run the connection to the client.
+        Run the connection to the client. It's seated when its first
+        message arrives, and pinged whenever it's been quiet for
+        `protocol.HEARTBEAT_INTERVAL`. The socket itself has no timeout,
+        which would cut short the outbox's sends to a slow reader too.
 
         Parameters
         ---
         `client: socket` - the socket to the client
-        `player_index: int` - the index of the `Player` instance
-                              assigned to the client within self.players
+        `address: tuple[str, int]` - (address, port) of the client.
 
         Returns
         ---
         `None`
         """
-        client.send(str.encode(str(self.players[player_index])))
-
-        to_do = deque()
-        while True:
+        decoder = protocol.FrameDecoder()
+        view = None
+        outbox = None
+        heard = time.monotonic()
+        while view is None or not view.detached:
             try:
-                message = client.recv(Server.BUFFER_SIZE).decode()
-
-                match message.split()[0]:
-                    case "ready":
-                        self.ready_count += 1
-                        print(f"Player {player_index} is ready!")
-                        if self.ready_count == Server.DESIRED_PLAYERS:
-                            to_do.appendleft("start game")
-                    case "start":
-                        self.player_names[player_index] = message[len("start "):]
-
-                # DEBUG
-                # if message != "refresh":
-                #     print("received message:", message)
-
-                reply = str.encode(
-                    self.generate_message(message, player_index))
-                # DEBUG
-                # print(self.state, reply)
-                client.send(reply)
+                (readable, _, _) = select.select(
+                    [client], [], [], protocol.HEARTBEAT_INTERVAL)
+                if len(readable) == 0:
+                    if time.monotonic() - heard > protocol.IDLE_TIMEOUT:
+                        print(f"No word from {address[0]} at {address[1]}, "
+                              "giving up on it.")
+                        break
+                    if outbox is not None:
+                        outbox.send(protocol.encode_message(protocol.MSG_PING))
+                    continue
+                data = client.recv(Server.BUFFER_SIZE)
+                if data == b"":
+                    break
+                heard = time.monotonic()
+                for message in decoder.feed(data):
+                    if view is None:
+                        view = self.add_player(address, message)
+                        # anything pushed waits until the greeting has
+                        # gone out; the first push covers any change
+                        # made before we subscribed
+                        outbox = Server.Outbox(client, view.view)
+                        view.subscribe(outbox.notify)
+                        outbox.send(view.hello())
+                        outbox.notify()
+                        start_new_thread(outbox.run, ())
+                    reply = self.handle_message(message, view)
+                    if reply is not None:
+                        outbox.send(reply)
             except Exception as e:
-                print(f"Error reading input from player {player_index}:",
-                      str(e) + ".")
+                print(f"Error reading input from {address[0]} "
+                      f"at {address[1]}:", str(e) + ".")
                 break
 
-            while len(to_do) > 0:
-                task = to_do.popleft()
-                if task == "start game":
-                    self.start_game()
-
-        print(
-            f"Lost connection to player {player_index}, closing connection.")
+        if outbox is not None:
+            outbox.close()
+        if view is not None:
+            self.remove_player(view)
         client.close()
 
-    # TODO: figure out how to restart when a player leaves
-
     def mainloop(self) -> None:
         """
         Keep the server running.
@@ -266,28 +304,150 @@ class Server:
         try:
             while True:
                 socket, address = self.socket.accept()
-                self.client_sockets.append(socket)
-                self.client_addresses.append(address)
-                print(f"Connected to player {self.player_count}:",
-                      address[0], "at", str(address[1])+".")
-
-                new_player = Player()
-                self.players.append(new_player)
-                self.player_count += 1
-                self.player_names.append("Unknown Player")
-
-                # self.player_count-1 is the index of the player
-                start_new_thread(self.threaded_client,
-                                 (socket, self.player_count-1))
-
-                if self.player_count == Server.DESIRED_PLAYERS:
-                    print("All players have joined! Waiting for players to ready...")
-                    self.state = Server.STATE_WAIT
+                start_new_thread(self.threaded_client, (socket, address))
         except:
             pass
         finally:
             print("Closing socket...")
             self.socket.close()
+            if self.journal is not None:
+                self.journal.close()
+
+    class Outbox:
+        """
+        `Outbox` inner class. Sends pushed updates to one client from a
+        thread of its own, so that a slow client never holds up whoever
+        changed the table. Updates that pile up are sent only once.
+        """
+
+        def __init__(self, client: s.socket,
+                     render: Callable[[], bytes]) -> None:
+            """
+            Constructor.
+
+            Parameters
+            ---
+            `client: socket` - the socket to the client.
+            `render: Callable[[], bytes]` - builds the client's current view.
+
+            Returns
+            ---
+            `None`
+            """
+            self.client: s.socket = client
+            self.render: Callable[[], bytes] = render
+            self.send_lock: Lock = Lock()
+            self.wakeup: Condition = Condition()
+            self.dirty: bool = False
+            self.open: bool = True
+
+        def send(self, message: bytes) -> None:
+            """
+            Send one message right away.
+
+            Parameters
+            ---
+            `message: bytes` - message payload to send.
+
+            Returns
+            ---
+            `None`
+            """
+            with self.send_lock:
+                self.client.sendall(protocol.frame(message))
+
+        def notify(self) -> None:
+            """
+            Schedule sending the current view. Safe from any thread.
+
+            Parameters
+            ---
+            (no parameters)
+
+            Returns
+            ---
+            `None`
+            """
+            with self.wakeup:
+                self.dirty = True
+                self.wakeup.notify()
+
+        def close(self) -> None:
+            """
+            Stop the sending thread.
+
+            Parameters
+            ---
+            (no parameters)
+
+            Returns
+            ---
+            `None`
+            """
+            with self.wakeup:
+                self.open = False
+                self.wakeup.notify()
+
+        def run(self) -> None:
+            """
+            Send the view every time it's changed, until closed. If a send
+            fails, the connection is shut down, so that its reader notices
+            and the player is dropped.
+
+            Parameters
+            ---
+            (no parameters)
+
+            Returns
+            ---
+            `None`
+            """
+            while True:
+                with self.wakeup:
+                    while self.open and not self.dirty:
+                        self.wakeup.wait()
+                    if not self.open:
+                        return
+                    self.dirty = False
+                try:
+                    self.send(self.render())
+                except OSError:
+                    try:
+                        self.client.shutdown(s.SHUT_RDWR)
+                    except OSError:
+                        pass  # already closed
+                    return
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse the command line shared by every server variant.
+
+    Parameters
+    ---
+    (no parameters)
+
+    Returns
+    ---
+    `argparse.Namespace`
+    """
+    parser = argparse.ArgumentParser(description="Durak server.")
+    parser.add_argument("--seats", type=int, default=Server.DESIRED_PLAYERS,
+                        help="number of seats per table")
+    parser.add_argument("--journal", default=None,
+                        help="journal file to record games in; games still "
+                        "going in it, e.g. after a crash, are picked up again")
+    parser.add_argument("--port", type=int, default=Server.PORT,
+                        help="port to listen on")
+    parser.add_argument("--shard", type=int, default=0,
+                        help="which worker this is, behind a router")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="number of workers behind the router")
+    parser.add_argument("--first-id", type=int, default=0,
+                        help="smallest table id to create")
+    parser.add_argument("--bots", type=int, default=0,
+                        help="seats given to computer players at every table")
+    return parser.parse_args()
 
 
 def main() -> None:
@@ -302,7 +462,9 @@ def main() -> None:
     ---
     `None`
     """
-    server = Server()
+    args = parse_args()
+    server = Server(args.seats, args.journal, args.port, args.shard,
+                    args.shards, args.first_id, args.bots)
     server.mainloop()
 
 
@@ -0,0 +1,97 @@
+#!usr/bin/env python3
+"""
+`shard` module. Provides the `Ring` class, which spreads tables over a
+number of worker processes by consistent hashing on their ids (see
+`router`).
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+import bisect
+import hashlib
+import struct
+
+### Constants ###
+TABLE_KEY: struct.Struct = struct.Struct("!I")
+"""How a table id is hashed."""
+
+
+class Ring:
+    """
+    `Ring` class. A consistent hash ring: each worker is given `replicas`
+    points on it, and a table belongs to the worker owning the first
+    point at or after the table's own. Going from `n` workers to `n + 1`
+    only moves about a `1 / (n + 1)` share of the tables, all of them
+    to the new worker.
+    """
+
+    ### Constants ###
+    REPLICAS: int = 256
+    """Default points per worker; more points, more even shares."""
+
+    ### Instance variables ###
+    workers: int
+    """Number of workers."""
+    points: list[int]
+    """Every worker's points, in order."""
+    owners: list[int]
+    """Worker owning each of `points`."""
+
+    def __init__(self, workers: int, replicas: int = REPLICAS) -> None:
+        """
+        Constructor.
+
+        Parameters
+        ---
+        `workers: int` - number of workers, numbered from 0.
+        `replicas: int = REPLICAS` - (optional) points per worker.
+
+        Raises
+        ---
+        `ValueError` - fewer than one worker.
+
+        Returns
+        ---
+        `None`
+        """
+        if workers < 1:
+            raise ValueError("need at least one worker")
+        self.workers: int = workers
+        ring = sorted((position(f"worker-{worker}-{replica}".encode()), worker)
+                      for worker in range(workers)
+                      for replica in range(replicas))
+        self.points: list[int] = [point for (point, _) in ring]
+        self.owners: list[int] = [worker for (_, worker) in ring]
+
+    def owner(self, table_id: int) -> int:
+        """
+        Find the worker a table belongs to.
+
+        Parameters
+        ---
+        `table_id: int` - the table's id.
+
+        Returns
+        ---
+        `int` - worker number.
+        """
+        index = bisect.bisect_left(self.points,
+                                   position(TABLE_KEY.pack(table_id)))
+        return self.owners[index % len(self.points)]
+
+
+def position(key: bytes) -> int:
+    """
+    Hash a key to a point on the ring.
+
+    Parameters
+    ---
+    `key: bytes` - the key.
+
+    Returns
+    ---
+    `int` - a 64-bit point.
+    """
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
@@ -0,0 +1,215 @@
+#!usr/bin/env python3
+"""
+`simulate` module. Plays many headless games between bots across a
+process pool and reports throughput, results by seat and game lengths.
+
+Usage: `python simulate.py -n 10000 -b simple random -j 8 --seed 1`
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+import argparse
+import time
+from multiprocessing import Pool, cpu_count
+from bot import BOTS
+import mcts  # registers "mcts" in BOTS
+from game import Game, Player
+from referee import Referee
+from tracker import CardTracker
+
+MAX_MOVES: int = 5000
+"""Games still going after this many decisions are abandoned."""
+
+
+def play_game(task: tuple[int, tuple[str, ...]]) -> tuple[int, int, int]:
+    """
+    Play one complete game. Runs inside a worker process.
+
+    Parameters
+    ---
+    `task: tuple[int, tuple[str, ...]]` - (seed, bot name for each seat).
+
+    Returns
+    ---
+    `tuple[int, int, int]` - (number of seats, final `Game.condition`,
+    number of decisions made). The condition is `Game.CONDITION_ONGOING`
+    if the game was abandoned after `MAX_MOVES` decisions.
+    """
+    seed, bot_names = task
+    bots = [BOTS[name](seed * len(bot_names) + seat)
+            for (seat, name) in enumerate(bot_names)]
+    listeners = []
+    for (seat, bot) in enumerate(bots):
+        if bot.TRACKS_CARDS:
+            bot.tracker = CardTracker(seat, len(bots))
+            listeners.append(bot.tracker.on_event)
+    game = Game([Player() for _ in bot_names], rng=seed, listeners=listeners)
+    referee = Referee(game)
+
+    while referee.moves < MAX_MOVES:
+        player = referee.to_act()
+        if player is None:
+            break
+        options = referee.options(player)
+        referee.apply(player, bots[player].choose(referee, player, options))
+    return len(bot_names), game.condition, referee.moves
+
+
+def simulate(games: int, bot_names: list[str], processes: int = None,
+             seed: int = 0) -> dict:
+    """
+    Play a batch of games and collect statistics.
+
+    Parameters
+    ---
+    `games: int` - number of games to play.
+    `bot_names: list[str]` - bot for each seat; keys of `bot.BOTS`.
+    `processes: int = None` - worker processes (default: one per core).
+    `seed: int = 0` - base seed; game `i` is seeded with `seed + i`.
+
+    Raises
+    ---
+    `ValueError` - unknown bot name or bad number of seats.
+
+    Returns
+    ---
+    `dict` - statistics; see `print_report` for the fields.
+    """
+    for name in bot_names:
+        if name not in BOTS:
+            raise ValueError(f"unknown bot {name!r} (choose from {list(BOTS)})")
+    if len(bot_names) not in range(2, Game.MAX_PLAYERS + 1):
+        raise ValueError(f"need 2 to {Game.MAX_PLAYERS} seats")
+    if processes is None:
+        processes = cpu_count()
+
+    seats = len(bot_names)
+    tasks = [(seed + i, tuple(bot_names)) for i in range(games)]
+    wins = [0, ] * seats
+    losses = [0, ] * seats
+    draws = 0
+    abandoned = 0
+    lengths: list[int] = []
+
+    start = time.perf_counter()
+    with Pool(processes) as pool:
+        chunksize = max(1, games // (processes * 8))
+        for (_, condition, moves) in pool.imap_unordered(play_game, tasks,
+                                                         chunksize):
+            lengths.append(moves)
+            if condition == Game.CONDITION_ONGOING:
+                abandoned += 1
+            elif condition == Game.CONDITION_DRAW:
+                draws += 1
+            else:
+                losses[condition] += 1
+                for seat in range(seats):
+                    if seat != condition:
+                        wins[seat] += 1
+    elapsed = time.perf_counter() - start
+
+    lengths.sort()
+    return {
+        "games": games,
+        "bots": list(bot_names),
+        "processes": processes,
+        "seconds": elapsed,
+        "games_per_sec": games / elapsed,
+        "moves_per_sec": sum(lengths) / elapsed,
+        "wins": wins,
+        "losses": losses,
+        "draws": draws,
+        "abandoned": abandoned,
+        "lengths": lengths,
+    }
+
+
+def percentile(values: list[int], fraction: float) -> int:
+    """
+    Nearest-rank percentile of an already sorted list.
+
+    Parameters
+    ---
+    `values: list[int]` - sorted values.
+    `fraction: float` - in the range [0, 1].
+
+    Returns
+    ---
+    `int`
+    """
+    if len(values) == 0:
+        return 0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def print_report(stats: dict) -> None:
+    """
+    Print the statistics returned by `simulate`.
+
+    Parameters
+    ---
+    `stats: dict` - statistics from `simulate`.
+
+    Returns
+    ---
+    `None`
+    """
+    games = stats["games"]
+    lengths = stats["lengths"]
+    print(f"{games} games on {stats['processes']} processes "
+          f"in {stats['seconds']:.2f} s")
+    print(f"throughput: {stats['games_per_sec']:.1f} games/s, "
+          f"{stats['moves_per_sec']:.0f} moves/s")
+    for (seat, name) in enumerate(stats["bots"]):
+        print(f"seat {seat} ({name}): "
+              f"win {stats['wins'][seat] / games:.1%}, "
+              f"loss {stats['losses'][seat] / games:.1%}")
+    print(f"draws: {stats['draws'] / games:.1%}, "
+          f"abandoned: {stats['abandoned'] / games:.1%}")
+    if len(lengths) > 0:
+        print(f"game length (moves): min {lengths[0]}, "
+              f"p50 {percentile(lengths, 0.5)}, "
+              f"p90 {percentile(lengths, 0.9)}, "
+              f"p99 {percentile(lengths, 0.99)}, max {lengths[-1]}, "
+              f"mean {sum(lengths) / len(lengths):.1f}")
+
+        # histogram in ten equal-width buckets
+        width = max(1, (lengths[-1] - lengths[0]) // 10 + 1)
+        buckets: dict[int, int] = {}
+        for length in lengths:
+            low = lengths[0] + (length - lengths[0]) // width * width
+            buckets[low] = buckets.get(low, 0) + 1
+        for (low, count) in sorted(buckets.items()):
+            bar = "#" * max(1, round(50 * count / len(lengths)))
+            print(f"  {low:5d}-{low + width - 1:<5d} {count:7d} {bar}")
+
+
+def main() -> None:
+    """
+    Run everything.
+
+    Parameters
+    ---
+    (no parameters)
+
+    Returns
+    ---
+    `None`
+    """
+    parser = argparse.ArgumentParser(description="Self-play Durak simulator.")
+    parser.add_argument("-n", "--games", type=int, default=1000,
+                        help="number of games to play")
+    parser.add_argument("-b", "--bots", nargs="+", default=["simple", "simple"],
+                        choices=sorted(BOTS), help="bot for each seat")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0, help="base seed")
+    args = parser.parse_args()
+
+    print_report(simulate(args.games, args.bots, args.processes, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!usr/bin/env python3
+"""
+`tracker` module. Provides the `CardTracker` class, which keeps track of
+where every card could be from one seat's point of view.
+"""
+
+__author__ = "Chris Bao"
+__version__ = 0.9
+
+### Imports ###
+from cardset import CardSet
+from game import Game
+
+
+class CardTracker:
+    """
+    `CardTracker` class. Follows a game through its events
+    (see `Game.listeners`) and keeps, for every player, the cards they
+    certainly hold and how many of their cards are unknown. Every event
+    is handled with a few bit operations.
+
+    Usage: `tracker = CardTracker(seat, num_players)`, then
+    `Game(players, listeners=[tracker.on_event])`.
+    Only information visible to `viewer` is used.
+    """
+
+    ### Instance variables ###
+    viewer: int
+    """Index of the player whose point of view this is."""
+    certain: list[int]
+    """Mask of cards each player certainly holds."""
+    hidden: list[int]
+    """Number of cards in each player's hand that the viewer can't identify."""
+    hand_sizes: list[int]
+    """Number of cards in each player's hand."""
+    unseen: int
+    """Mask of cards whose location is unknown: in some hidden hand,
+    or in the deck (not counting the face-up bottom card)."""
+    bottom: int
+    """Mask of the face-up bottom card while it is in the deck, or 0."""
+    discard: int
+    """Mask of discarded cards."""
+
+    def __init__(self, viewer: int, num_players: int) -> None:
+        """
+        Constructor. Must be attached to the game before the deal.
+
+        Parameters
+        ---
+        `viewer: int` - index of the player whose point of view this is.
+        `num_players: int` - number of players in the game.
+
+        Returns
+        ---
+        `None`
+        """
+        self.viewer: int = viewer
+        self.certain: list[int] = [0, ] * num_players
+        self.hidden: list[int] = [0, ] * num_players
+        self.hand_sizes: list[int] = [0, ] * num_players
+        self.unseen: int = CardSet.FULL
+        self.bottom: int = 0
+        self.discard: int = 0
+
+    def on_event(self, event: int, player: int, mask: int) -> None:
+        """
+        Update for a game event. Pass this method to `Game` as a listener.
+
+        Parameters
+        ---
+        `event: int` - one of the `Game` event constants.
+        `player: int` - index of the player involved, or -1.
+        `mask: int` - `CardSet` mask of the cards involved.
+
+        Returns
+        ---
+        `None`
+        """
+        match event:
+            case Game.EVENT_DEAL | Game.EVENT_DRAW:
+                self.hand_sizes[player] += 1
+                # own cards, and the bottom card, are seen when drawn
+                if player == self.viewer or mask == self.bottom:
+                    self.certain[player] |= mask
+                    self.unseen &= ~mask
+                else:
+                    self.hidden[player] += 1
+                if mask == self.bottom:
+                    self.bottom = 0
+            case Game.EVENT_BOTTOM:
+                self.bottom = mask
+                self.unseen &= ~mask
+            case Game.EVENT_ATTACK | Game.EVENT_COVER | Game.EVENT_TRANSFER:
+                self.hand_sizes[player] -= 1
+                if self.certain[player] & mask:
+                    self.certain[player] ^= mask
+                else:
+                    self.hidden[player] -= 1
+                    self.unseen &= ~mask
+            case Game.EVENT_PICKUP:
+                self.hand_sizes[player] += mask.bit_count()
+                self.certain[player] |= mask
+            case Game.EVENT_DISCARD:
+                self.discard |= mask
+
+    def possible(self, player: int) -> int:
+        """
+        Get the cards the given player might hold.
+
+        Parameters
+        ---
+        `player: int` - index of the player.
+
+        Returns
+        ---
+        `int` - mask of their certain cards, plus every unseen card
+        if any of their cards are unknown.
+        """
+        if self.hidden[player] == 0:
+            return self.certain[player]
+        return self.certain[player] | self.unseen
+
+    def deck_hidden(self) -> int:
+        """
+        Get the number of unknown cards still in the deck.
+
+        Parameters
+        ---
+        (no parameters)
+
+        Returns
+        ---
+        `int`
+        """
+        return self.unseen.bit_count() - sum(self.hidden)